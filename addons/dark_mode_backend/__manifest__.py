@@ -21,7 +21,7 @@
 ################################################################################
 {
     "name": "Dark Mode Backend Theme",
-    "version": "19.0.1.0.0",
+    "version": "19.0.1.3.1",
     "category": "Theme/Backend",
     "summary": "Dark Mode Backend Theme for Odoo 19 community edition",
     "description": "Minimalist and elegant backend theme for Odoo 19,"
@@ -32,9 +32,10 @@
     'website': "https://www.cybrosys.com",
     'assets': {
         'web.assets_backend': [
-            'dark_mode_backend/static/src/scss/theme_accent.scss',
-            'dark_mode_backend/static/src/scss/datetimepicker.scss',
-            'dark_mode_backend/static/src/scss/theme.scss',
+            # Precompiled from static/src/scss by tools/build_assets.py
+            'dark_mode_backend/static/src/dist/theme.critical.min.css',
+            'dark_mode_backend/static/src/dist/theme_assets.js',
+            'dark_mode_backend/static/src/js/lazy_theme.js',
             'https://fonts.googleapis.com/css2?family=Poppins:wght@400;600&amp;display=swap" rel="stylesheet',
         ],
         'web.assets_frontend': [
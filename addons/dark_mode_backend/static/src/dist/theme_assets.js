@@ -0,0 +1,4 @@
+/** @odoo-module **/
+// Generated by tools/build_assets.py from theme_accent.scss, datetimepicker.scss, theme.scss; do not edit.
+
+export const LAZY_THEME_CSS = "/dark_mode_backend/static/src/dist/theme.lazy.2a891d58173d.min.css";
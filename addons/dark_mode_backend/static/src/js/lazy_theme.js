@@ -0,0 +1,25 @@
+/** @odoo-module **/
+
+import { registry } from "@web/core/registry";
+import { loadCSS } from "@web/core/assets";
+import { LAZY_THEME_CSS } from "@dark_mode_backend/dist/theme_assets";
+
+/**
+ * Loads the view-specific part of the theme (calendar, pivot, dashboards,
+ * settings, discuss, date pickers...) once the web client is idle, so it does
+ * not delay the first paint. It is appended after the bundle, so its rules come
+ * after those of every other addon. The URL carries a content hash, so the
+ * browser keeps it cached until the rules change.
+ */
+export const lazyThemeService = {
+    start() {
+        const load = () => loadCSS(LAZY_THEME_CSS).catch(() => {});
+        if (window.requestIdleCallback) {
+            window.requestIdleCallback(load, { timeout: 2000 });
+        } else {
+            setTimeout(load);
+        }
+    },
+};
+
+registry.category("services").add("dark_mode_backend_lazy_theme", lazyThemeService);
@@ -0,0 +1,292 @@
+# -*- coding: utf-8 -*-
+################################################################################
+#
+#    Cybrosys Technologies Pvt. Ltd.
+#
+#    Copyright (C) 2024-TODAY Cybrosys Technologies(<https://www.cybrosys.com>).
+#
+#    You can modify it under the terms of the GNU AFFERO
+#    GENERAL PUBLIC LICENSE (AGPL v3), Version 3.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU AFFERO GENERAL PUBLIC LICENSE (AGPL v3) for more details.
+#
+#    You should have received a copy of the GNU AFFERO GENERAL PUBLIC LICENSE
+#    (AGPL v3) along with this program.
+#    If not, see <http://www.gnu.org/licenses/>.
+#
+################################################################################
+"""
+Build the precompiled theme assets shipped in ``static/src/dist``.
+
+Odoo recompiles every SCSS file of ``web.assets_backend`` whenever the bundle
+is regenerated, and the theme alone is ~77 KB of SCSS. This script compiles
+the theme sources once with libsass (the compiler Odoo itself uses), minifies
+the result and splits it in two:
+
+* ``theme.critical.min.css``: the layout rules needed for the first paint
+  (navbar, control panel, list/form/kanban views, buttons...). It is a plain
+  CSS file in ``web.assets_backend``, so no SCSS is compiled at runtime.
+* ``theme.lazy.<hash>.min.css``: rules that only apply to rarely used views
+  (calendar, pivot, dashboards, settings, discuss, date pickers...). It is
+  loaded by ``static/src/js/lazy_theme.js`` once the web client is idle, after
+  the bundle, so its rules win over other addons' rules of equal specificity. The
+  content hash in the file name is the cache key: the URL only changes when
+  the rules change, so browsers keep it across restarts and deployments.
+
+The generated ``theme_assets.js`` module exports the hashed URL. Outputs are
+committed; rerun the build after editing the SCSS sources::
+
+    python addons/dark_mode_backend/tools/build_assets.py
+    python addons/dark_mode_backend/tools/build_assets.py --check
+
+``--check`` rebuilds in memory and exits with status 1 when the committed
+outputs are out of date. ``--order-dependent`` lists the lazy rules whose
+effect depends on loading after the bundle (see `order_dependent_rules`).
+"""
+
+import argparse
+import hashlib
+import os
+import re
+import sys
+
+ADDON_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ADDON_NAME = os.path.basename(ADDON_DIR)
+SCSS_DIR = os.path.join(ADDON_DIR, 'static', 'src', 'scss')
+DIST_DIR = os.path.join(ADDON_DIR, 'static', 'src', 'dist')
+DIST_URL = f'/{ADDON_NAME}/static/src/dist'
+
+# Compiled as one stylesheet, in the order they used to appear in the bundle.
+THEME_SOURCES = ('theme_accent.scss', 'datetimepicker.scss', 'theme.scss')
+
+CRITICAL_CSS = 'theme.critical.min.css'
+LAZY_CSS = 'theme.lazy.{hash}.min.css'
+LAZY_CSS_RE = re.compile(r'^theme\.lazy\.[0-9a-f]+\.min\.css$')
+ASSETS_JS = 'theme_assets.js'
+
+# A rule is deferred when every one of its selectors starts inside one of
+# these view-specific containers. Anything else stays in the critical file.
+# The lazy file is appended to the document after the bundle, so a deferred
+# rule now comes after the rules of every addon in web.assets_backend: on equal
+# specificity it overrides them instead of being overridden by later addons.
+# Keep this list to views where the theme is meant to win.
+LAZY_SELECTOR_RE = re.compile(r"""^(?:
+      \.datepicker | \.daterangepicker | \.picker-switch | \.o_datepicker | \.o_time_picker
+    | \.o_calendar | \.o_cw_popover
+    | \.o_pivot | \.o_graph_view | \.o-dashboard | \.o_dashboard | \.o_\w+_dashboard
+    | \.o_activity_view | \.o_mail_activity
+    | \.o_base_settings | \.o_setting_container | \.settings | \.o_web_settings_invite | \.oe_module_action
+    | \.o_onboarding | \.o_hr_attendance | \.o_lunch_content
+    | \.o_domain_node | \.o_field_selector | \.ace-tm | \.note-popover | \.note-editor
+    | \.o_widget_Discuss | \.o_Discuss | \.o-mail-DiscussSidebar | \.o_ThreadView
+    | \.o_Message | \.o_Composer | \.o-mail-Composer | \.o_mail_composer_form
+    | \.o_Notification | \.o_MessagingMenu | \.o_MobileMessagingNavbar | \.o_ChatWindowHeader
+    | \.o_PartnerImStatusIcon | \.o_mail_preview | \.o_mail_systray_dropdown_items
+    | \.o_legacy_
+)""", re.VERBOSE)
+
+HASH_LENGTH = 12
+
+
+def _import_sass():
+    try:
+        import sass
+    except ImportError:
+        sys.exit('libsass is required to build the theme: pip install libsass')
+    return sass
+
+
+def compile_theme():
+    """ Compile the theme sources into minified CSS. """
+    sass = _import_sass()
+    source = '\n'.join(_read(os.path.join(SCSS_DIR, name)) for name in THEME_SOURCES)
+    css = sass.compile(string=source, output_style='compressed', include_paths=[SCSS_DIR])
+    return css.strip()
+
+
+def split_blocks(css):
+    """
+    Split minified CSS into top-level ``(prelude, body)`` blocks.
+
+    Strings are skipped so braces inside ``content: "{"`` do not count.
+    """
+    blocks = []
+    depth = 0
+    start = 0
+    prelude = None
+    quote = None
+    index = 0
+    while index < len(css):
+        char = css[index]
+        if quote:
+            if char == '\\':
+                index += 1
+            elif char == quote:
+                quote = None
+        elif char in '"\'':
+            quote = char
+        elif char == '{':
+            if depth == 0:
+                prelude = css[start:index].strip()
+                start = index + 1
+            depth += 1
+        elif char == '}':
+            depth -= 1
+            if depth == 0:
+                blocks.append((prelude, css[start:index]))
+                start = index + 1
+        elif char == ';' and depth == 0:
+            # top level statement such as @charset or @import
+            blocks.append((css[start:index].strip(), None))
+            start = index + 1
+        index += 1
+    return blocks
+
+
+def is_lazy(selectors):
+    """ Whether every selector of a rule targets a rarely used view. """
+    return all(LAZY_SELECTOR_RE.match(selector.strip()) for selector in selectors.split(','))
+
+
+def split_css(css):
+    """
+    Split the compiled theme into critical and lazy CSS.
+
+    At-rules that group rules (``@media``, ``@supports``) are split
+    recursively; other at-rules (``@font-face``, ``@keyframes``...) stay
+    critical.
+
+    :return: (critical css, lazy css)
+    """
+    critical = []
+    lazy = []
+    for prelude, body in split_blocks(css):
+        if body is None:
+            critical.append(prelude + ';')
+        elif prelude.startswith(('@media', '@supports')):
+            inner_critical, inner_lazy = split_css(body)
+            if inner_critical:
+                critical.append(f'{prelude}{{{inner_critical}}}')
+            if inner_lazy:
+                lazy.append(f'{prelude}{{{inner_lazy}}}')
+        elif not prelude.startswith('@') and is_lazy(prelude):
+            lazy.append(f'{prelude}{{{body}}}')
+        else:
+            critical.append(f'{prelude}{{{body}}}')
+    return ''.join(critical), ''.join(lazy)
+
+
+def order_dependent_rules(css, media=None):
+    """
+    Lazy rules whose effect depends on the cascade order.
+
+    A rule where every declaration is ``!important`` wins over other addons'
+    normal rules wherever it is loaded. Any other declaration only applies
+    because the lazy file comes after ``web.assets_backend``: had the rule
+    stayed in the bundle, a later addon's rule of equal specificity would win.
+
+    :return: list of (media query or None, selectors)
+    """
+    rules = []
+    for prelude, body in split_blocks(css):
+        if body is None:
+            continue
+        if prelude.startswith(('@media', '@supports')):
+            rules += order_dependent_rules(body, prelude)
+        elif any(
+            declaration.strip() and '!important' not in declaration
+            for declaration in body.split(';')
+        ):
+            rules.append((media, prelude))
+    return rules
+
+
+def content_hash(data):
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()[:HASH_LENGTH]
+
+
+def build_css():
+    """
+    Build the theme stylesheets.
+
+    :return: {file name in DIST_DIR: content}
+    """
+    critical, lazy = split_css(compile_theme())
+    lazy_name = LAZY_CSS.format(hash=content_hash(lazy))
+    assets_js = (
+        '/** @odoo-module **/\n'
+        f'// Generated by tools/build_assets.py from {", ".join(THEME_SOURCES)}; do not edit.\n\n'
+        f'export const LAZY_THEME_CSS = "{DIST_URL}/{lazy_name}";\n'
+    )
+    return {
+        CRITICAL_CSS: critical + '\n',
+        lazy_name: lazy + '\n',
+        ASSETS_JS: assets_js,
+    }
+
+
+def stale_outputs(outputs):
+    """ Previously generated lazy stylesheets that are no longer referenced. """
+    if not os.path.isdir(DIST_DIR):
+        return []
+    return sorted(
+        name for name in os.listdir(DIST_DIR)
+        if LAZY_CSS_RE.match(name) and name not in outputs
+    )
+
+
+def _read(path):
+    with open(path, encoding='utf-8') as handle:
+        return handle.read()
+
+
+def write_outputs(outputs):
+    os.makedirs(DIST_DIR, exist_ok=True)
+    for name, content in outputs.items():
+        with open(os.path.join(DIST_DIR, name), 'w', encoding='utf-8', newline='\n') as handle:
+            handle.write(content)
+    for name in stale_outputs(outputs):
+        os.remove(os.path.join(DIST_DIR, name))
+
+
+def check_outputs(outputs):
+    """ :return: list of out of date file names """
+    outdated = [
+        name for name, content in outputs.items()
+        if not os.path.exists(os.path.join(DIST_DIR, name)) or _read(os.path.join(DIST_DIR, name)) != content
+    ]
+    return outdated + stale_outputs(outputs)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Build the precompiled dark_mode_backend theme assets.')
+    parser.add_argument('--check', action='store_true', help='fail when the committed outputs are out of date')
+    parser.add_argument('--order-dependent', action='store_true',
+                        help='list the lazy rules that only apply because they load after the bundle')
+    args = parser.parse_args(argv)
+
+    outputs = build_css()
+    if args.order_dependent:
+        lazy = next(content for name, content in outputs.items() if LAZY_CSS_RE.match(name))
+        for media, selectors in order_dependent_rules(lazy):
+            print(f'{media} {selectors}' if media else selectors)
+        return 0
+    if args.check:
+        outdated = check_outputs(outputs)
+        if outdated:
+            print('Out of date, run tools/build_assets.py: ' + ', '.join(outdated))
+            return 1
+        print('Theme assets are up to date.')
+        return 0
+
+    write_outputs(outputs)
+    for name, content in outputs.items():
+        print(f'{len(content.encode("utf-8")):>8}  {os.path.relpath(os.path.join(DIST_DIR, name), ADDON_DIR)}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -26,9 +26,14 @@
         'security/ir.model.access.csv',
         'views/payment_provider_views.xml',
         'views/payment_transaction_views.xml',
+        'views/newebpay_settlement_views.xml',
+        'views/newebpay_refund_queue_views.xml',
+        'views/newebpay_transaction_archive_views.xml',
+        'views/newebpay_payment_stats_views.xml',
         'templates/payment_newebpay_form.xml',
         'data/payment_method_data.xml',
         'data/payment_provider_data.xml',
+        'data/ir_cron_data.xml',
     ],
     'installable': True,
     'application': False,
@@ -0,0 +1,454 @@
+# -*- coding: utf-8 -*-
+
+"""
+藍新金流 MPG 閘道離線模擬器
+
+以與正式閘道相同的格式與加密方式產生回調，不需要網路或藍新金流測試帳號：
+
+    * `checkout(form)` 接受 `_get_specific_rendering_values` 產生的付款表單，
+      驗證 TradeSha、解密 TradeInfo 並建立模擬交易（含藍新交易序號）
+    * `callback(trade)` 產生已加密與簽名的 notify / return POST 資料
+    * `refund(post)` / `query(post)` 模擬信用卡退款（`/API/CreditCard/Cancel`）
+      與查詢交易（`/API/QueryTradeInfo`）API
+    * `serve()` 以 HTTP 提供上述端點（含 `/MPG/mpg_gateway`）；將系統參數
+      `newebpay_payment.api_base_url` 設為 `gateway.url` 即可讓測試狀態提供者的退款與對帳排程連到模擬器
+
+HTTP 模式下 `/MPG/mpg_gateway` 與正式閘道相同：依 TradeInfo 中的 NotifyURL 背景送出伺服器通知，
+並回傳自動送出到 ReturnURL 的 HTML 表單。
+
+使用方式::
+
+    gateway = MPGGatewaySimulator({'MS100000000': (hash_key, hash_iv)})
+    trade = gateway.checkout(tx._get_specific_rendering_values({}))
+    post = gateway.callback(trade)
+
+    python addons/newebpay_payment/benchmarks/gateway_simulator.py \\
+        --merchant MS100000000:<hash_key>:<hash_iv> --port 8099
+"""
+
+import argparse
+import datetime
+import html
+import itertools
+import json
+import os
+import random
+import sys
+import threading
+import urllib.error
+import urllib.parse
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+if __name__ == '__main__':
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from benchmarks import standin  # noqa: E402
+    standin.install()
+
+from odoo.addons.newebpay_payment.utils.crypto import NewebPayCrypto  # noqa: E402
+
+# 付款表單必要欄位
+REQUIRED_TRADE_INFO_FIELDS = ('MerchantID', 'TimeStamp', 'Version', 'MerchantOrderNo', 'Amt', 'ItemDesc')
+
+# 付款失敗時的狀態碼與訊息（授權失敗）
+FAILURE_STATUS = 'MPG03009'
+FAILURE_MESSAGE = '交易失敗'
+
+
+class GatewayError(ValueError):
+    """ 模擬閘道拒絕請求（對應正式閘道的錯誤頁面或錯誤回應） """
+
+    def __init__(self, status, message):
+        super().__init__(f'{status}: {message}')
+        self.status = status
+        self.message = message
+
+
+class SimulatedTrade:
+    """ 模擬閘道上的一筆交易 """
+
+    __slots__ = ('merchant_id', 'merchant_order_no', 'trade_no', 'amount', 'payment_type',
+                 'status', 'message', 'pay_time', 'refunded', 'trade_info')
+
+    def __init__(self, merchant_id, merchant_order_no, trade_no, amount, payment_type, status, message,
+                 pay_time, trade_info):
+        self.merchant_id = merchant_id
+        self.merchant_order_no = merchant_order_no
+        self.trade_no = trade_no
+        self.amount = amount
+        self.payment_type = payment_type
+        self.status = status
+        self.message = message
+        self.pay_time = pay_time
+        self.refunded = 0
+        self.trade_info = trade_info
+
+    @property
+    def paid(self):
+        return self.status == 'SUCCESS'
+
+
+class MPGGatewaySimulator:
+    """ 藍新金流 MPG 閘道模擬器（執行緒安全） """
+
+    def __init__(self, merchants, payment_type='CREDIT', failure_rate=0.0, seed=None):
+        """
+        :param merchants: {商店代號: (Hash Key, Hash IV)}
+        :param payment_type: 回調中的付款方式
+        :param failure_rate: 付款失敗（授權失敗）的比例
+        :param seed: 亂數種子（相同種子產生相同的成功 / 失敗序列）
+        """
+        self.merchants = dict(merchants)
+        self.payment_type = payment_type
+        self.failure_rate = failure_rate
+        self._random = random.Random(seed)
+        self._trade_numbers = itertools.count(1)
+        self._lock = threading.Lock()
+        # (商店代號, 商店訂單編號) → SimulatedTrade
+        self.trades = {}
+        # (商店代號, 藍新交易序號) → SimulatedTrade
+        self._by_trade_no = {}
+        self.server = None
+
+    # ---- 加解密 ----
+
+    def _keys(self, merchant_id):
+        keys = self.merchants.get(merchant_id)
+        if not keys:
+            raise GatewayError('MPG01002', f'商店代號不存在: {merchant_id}')
+        return keys
+
+    def _decode(self, post):
+        """ 驗證 TradeSha 並解密 TradeInfo """
+        merchant_id = post.get('MerchantID', '')
+        hash_key, hash_iv = self._keys(merchant_id)
+        trade_info = post.get('TradeInfo', '')
+        if not trade_info or not NewebPayCrypto.verify_trade_sha(
+            trade_info, post.get('TradeSha', ''), hash_key, hash_iv
+        ):
+            raise GatewayError('MPG03008', 'TradeSha 檢查碼錯誤')
+        try:
+            return merchant_id, NewebPayCrypto.decrypt_trade_info(trade_info, hash_key, hash_iv)
+        except Exception as e:
+            raise GatewayError('MPG03007', f'TradeInfo 解密失敗: {e}')
+
+    def _encode(self, merchant_id, data):
+        hash_key, hash_iv = self._keys(merchant_id)
+        trade_info = NewebPayCrypto.encrypt_trade_info(data, hash_key, hash_iv)
+        return trade_info, NewebPayCrypto.create_trade_sha(trade_info, hash_key, hash_iv)
+
+    # ---- MPG 付款 ----
+
+    def checkout(self, form, status=None):
+        """
+        接受付款表單並建立模擬交易
+
+        :param form: `_get_specific_rendering_values` 的回傳值（或瀏覽器送出的表單）
+        :param status: 指定付款結果（'SUCCESS' 或錯誤代碼；未指定時依 failure_rate 決定）
+        :return: SimulatedTrade
+        """
+        merchant_id, trade_info = self._decode(form)
+        if trade_info.get('MerchantID') != merchant_id:
+            raise GatewayError('MPG03002', 'TradeInfo 中的商店代號與表單不符')
+        missing = [field for field in REQUIRED_TRADE_INFO_FIELDS if not trade_info.get(field)]
+        if missing:
+            raise GatewayError('MPG03001', f'缺少必要欄位: {", ".join(missing)}')
+        try:
+            amount = int(trade_info['Amt'])
+        except ValueError:
+            raise GatewayError('MPG03003', f'金額格式錯誤: {trade_info["Amt"]}')
+        return self.create_trade(merchant_id, trade_info['MerchantOrderNo'], amount, status, trade_info)
+
+    def create_trade(self, merchant_id, merchant_order_no, amount, status=None, trade_info=None):
+        """
+        直接建立模擬交易（不經付款表單，例如對遠端 Odoo 壓測時由訂單清單產生回調）
+
+        :param merchant_id: 商店代號
+        :param merchant_order_no: 商店訂單編號
+        :param amount: 金額（元）
+        :param status: 付款結果（未指定時依 failure_rate 決定）
+        :param trade_info: 付款表單的 TradeInfo 明文（可選）
+        :return: SimulatedTrade
+        """
+        self._keys(merchant_id)
+        with self._lock:
+            key = (merchant_id, merchant_order_no)
+            trade = self.trades.get(key)
+            if trade is not None and trade.paid:
+                raise GatewayError('MPG03005', f'商店訂單編號重複: {key[1]}')
+            if status is None:
+                status = FAILURE_STATUS if self._random.random() < self.failure_rate else 'SUCCESS'
+            trade = SimulatedTrade(
+                merchant_id=merchant_id,
+                merchant_order_no=merchant_order_no,
+                trade_no=datetime.datetime.now().strftime('%y%m%d%H%M') + f'{next(self._trade_numbers):08d}',
+                amount=int(amount),
+                payment_type=self.payment_type,
+                status=status,
+                message='授權成功' if status == 'SUCCESS' else FAILURE_MESSAGE,
+                pay_time=datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                trade_info=trade_info or {},
+            )
+            self.trades[key] = trade
+            self._by_trade_no[(merchant_id, trade.trade_no)] = trade
+        return trade
+
+    def callback(self, trade, status=None):
+        """
+        產生 notify / return 回調的 POST 資料（兩者格式相同）
+
+        :param trade: SimulatedTrade
+        :param status: 覆寫回調狀態（例如模擬過期或錯誤的重送）
+        :return: {'Status', 'MerchantID', 'Version', 'TradeInfo', 'TradeSha'}
+        """
+        status = status or trade.status
+        trade_info, trade_sha = self._encode(trade.merchant_id, {
+            'Status': status,
+            'Message': trade.message if status == trade.status else FAILURE_MESSAGE,
+            'MerchantID': trade.merchant_id,
+            'Amt': trade.amount,
+            'TradeNo': trade.trade_no,
+            'MerchantOrderNo': trade.merchant_order_no,
+            'PaymentType': trade.payment_type,
+            'RespondType': 'String',
+            'PayTime': trade.pay_time,
+            'IP': '127.0.0.1',
+            'EscrowBank': 'HNCB',
+        })
+        return {
+            'Status': status,
+            'MerchantID': trade.merchant_id,
+            'Version': '2.0',
+            'TradeInfo': trade_info,
+            'TradeSha': trade_sha,
+        }
+
+    # ---- 背景 API ----
+
+    def refund(self, post):
+        """
+        模擬信用卡退款 API（`/API/CreditCard/Cancel`）
+
+        :param post: 退款請求表單
+        :return: 回應 JSON 字典（TradeInfo / TradeSha 已加密與簽名）
+        """
+        try:
+            merchant_id, data = self._decode(post)
+        except GatewayError as e:
+            return {'Status': e.status, 'Message': e.message}
+
+        with self._lock:
+            trade = self._by_trade_no.get((merchant_id, data.get('TradeNo')))
+            amount = int(data.get('Amt') or 0)
+            if trade is None or not trade.paid:
+                status, message = 'TRA10001', '查無此筆交易或交易未付款'
+            elif amount <= 0 or trade.refunded + amount > trade.amount:
+                status, message = 'TRA10002', '退款金額超過可退款金額'
+            else:
+                trade.refunded += amount
+                status, message = 'SUCCESS', '退款成功'
+
+        trade_info, trade_sha = self._encode(merchant_id, {
+            'Status': status,
+            'Message': message,
+            'MerchantID': merchant_id,
+            'TradeNo': data.get('TradeNo', ''),
+            'MerchantOrderNo': trade.merchant_order_no if trade else data.get('MerchantOrderNo', ''),
+            'Amt': amount,
+        })
+        return {'Status': status, 'Message': message, 'TradeInfo': trade_info, 'TradeSha': trade_sha}
+
+    def query(self, post):
+        """
+        模擬查詢交易 API（`/API/QueryTradeInfo`）
+
+        :param post: 查詢請求表單
+        :return: 回應 JSON 字典（Result 含 CheckCode）
+        """
+        merchant_id = post.get('MerchantID', '')
+        try:
+            hash_key, hash_iv = self._keys(merchant_id)
+        except GatewayError as e:
+            return {'Status': e.status, 'Message': e.message, 'Result': {}}
+        check_value = NewebPayCrypto.create_check_value({
+            'Amt': post.get('Amt', ''),
+            'MerchantID': merchant_id,
+            'MerchantOrderNo': post.get('MerchantOrderNo', ''),
+        }, hash_key, hash_iv)
+        if check_value != str(post.get('CheckValue', '')).upper():
+            return {'Status': 'TRA10003', 'Message': 'CheckValue 檢查碼錯誤', 'Result': {}}
+
+        with self._lock:
+            trade = self.trades.get((merchant_id, post.get('MerchantOrderNo')))
+        if trade is None:
+            return {'Status': 'TRA10001', 'Message': '查無此筆交易', 'Result': {}}
+        if trade.refunded:
+            trade_status = '6'
+        else:
+            trade_status = '1' if trade.paid else '2'
+        result = {
+            'MerchantID': merchant_id,
+            'Amt': trade.amount,
+            'TradeNo': trade.trade_no,
+            'MerchantOrderNo': trade.merchant_order_no,
+            'TradeStatus': trade_status,
+            'PaymentType': trade.payment_type,
+            'PayTime': trade.pay_time,
+        }
+        if trade.paid and trade.payment_type == 'CREDIT':
+            result['BackBalance'] = trade.amount - trade.refunded
+        result['CheckCode'] = NewebPayCrypto.create_check_code({
+            'Amt': result['Amt'],
+            'MerchantID': merchant_id,
+            'MerchantOrderNo': result['MerchantOrderNo'],
+            'TradeNo': result['TradeNo'],
+        }, hash_key, hash_iv)
+        return {'Status': 'SUCCESS', 'Message': '查詢成功', 'Result': result}
+
+    # ---- HTTP 伺服器 ----
+
+    @property
+    def url(self):
+        if self.server is None:
+            return None
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def serve(self, host='127.0.0.1', port=0, notify_delay=0.0):
+        """
+        在背景執行緒啟動 HTTP 伺服器
+
+        :param host: 監聽位址
+        :param port: 監聽埠（0 表示自動選擇）
+        :param notify_delay: `/MPG/mpg_gateway` 送出伺服器通知前的延遲（秒）
+        :return: HTTP 伺服器（以 `shutdown()` 停止）
+        """
+        gateway = self
+
+        class Handler(_GatewayRequestHandler):
+            simulator = gateway
+            delay = notify_delay
+
+        self.server = _GatewayServer((host, port), Handler)
+        threading.Thread(target=self.server.serve_forever, name='newebpay-gateway-simulator', daemon=True).start()
+        return self.server
+
+    def shutdown(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+
+def post_form(url, data, timeout=10):
+    """ 以 application/x-www-form-urlencoded 送出 POST，回傳 (HTTP 狀態碼, 回應內容) """
+    request = urllib.request.Request(
+        url,
+        data=urllib.parse.urlencode(data).encode('utf-8'),
+        headers={'Content-Type': 'application/x-www-form-urlencoded'},
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return response.status, response.read().decode('utf-8', 'replace')
+    except urllib.error.HTTPError as e:
+        return e.code, e.read().decode('utf-8', 'replace')
+
+
+class _GatewayServer(ThreadingHTTPServer):
+    # 預設的 listen backlog（5）在高並行時會溢出，連線被重設而誤判為閘道錯誤
+    request_queue_size = 128
+    daemon_threads = True
+
+
+class _GatewayRequestHandler(BaseHTTPRequestHandler):
+    """ 模擬閘道的 HTTP 端點 """
+
+    simulator = None
+    delay = 0.0
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _read_form(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length).decode('utf-8')
+        return dict(urllib.parse.parse_qsl(body, keep_blank_values=True))
+
+    def _send(self, status, body, content_type):
+        data = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        path = urllib.parse.urlsplit(self.path).path
+        form = self._read_form()
+        if path == '/API/CreditCard/Cancel':
+            return self._send(200, json.dumps(self.simulator.refund(form)), 'application/json')
+        if path == '/API/QueryTradeInfo':
+            return self._send(200, json.dumps(self.simulator.query(form)), 'application/json')
+        if path == '/MPG/mpg_gateway':
+            return self._checkout(form)
+        return self._send(404, 'Not Found', 'text/plain')
+
+    def _checkout(self, form):
+        try:
+            trade = self.simulator.checkout(form)
+        except GatewayError as e:
+            return self._send(400, f'{e.status} {html.escape(e.message)}', 'text/plain; charset=utf-8')
+        post = self.simulator.callback(trade)
+        notify_url = trade.trade_info.get('NotifyURL')
+        if notify_url:
+            timer = threading.Timer(self.delay, post_form, args=(notify_url, post))
+            timer.daemon = True
+            timer.start()
+        return_url = html.escape(trade.trade_info.get('ReturnURL') or '/', quote=True)
+        inputs = ''.join(
+            f'<input type="hidden" name="{html.escape(name, quote=True)}" value="{html.escape(value, quote=True)}"/>'
+            for name, value in post.items()
+        )
+        page = (
+            f'<html><body onload="document.forms[0].submit()">'
+            f'<form method="post" action="{return_url}">{inputs}</form></body></html>'
+        )
+        return self._send(200, page, 'text/html; charset=utf-8')
+
+
+def _parse_merchant(value):
+    merchant_id, sep, rest = value.partition(':')
+    hash_key, sep2, hash_iv = rest.partition(':')
+    if not (sep and sep2 and merchant_id and hash_key and hash_iv):
+        raise argparse.ArgumentTypeError('格式應為 MerchantID:HashKey:HashIV')
+    return merchant_id, (hash_key, hash_iv)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='藍新金流 MPG 閘道離線模擬器')
+    parser.add_argument('--merchant', type=_parse_merchant, action='append', required=True,
+                        help='MerchantID:HashKey:HashIV（可重複指定）')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8099)
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='付款失敗比例')
+    parser.add_argument('--notify-delay', type=float, default=0.0, help='送出伺服器通知前的延遲（秒）')
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args(argv)
+
+    gateway = MPGGatewaySimulator(dict(args.merchant), failure_rate=args.failure_rate, seed=args.seed)
+    server = gateway.serve(args.host, args.port, notify_delay=args.notify_delay)
+    print(f'藍新金流模擬閘道已啟動: {gateway.url}')
+    print(f'將系統參數 newebpay_payment.api_base_url 設為 {gateway.url}（只套用於測試狀態的提供者），'
+          f'並將付款表單送往 {gateway.url}/MPG/mpg_gateway')
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,418 @@
+# -*- coding: utf-8 -*-
+
+"""
+藍新金流回調負載測試
+
+以 `gateway_simulator.MPGGatewaySimulator` 產生與正式閘道相同格式的 notify / return 回調，
+依設定的並行數送出，並可注入重複通知與亂序（return 先於 notify、延遲的重送）：
+
+    * 行程內模式（預設）：在 `standin.py` 替身環境中建立交易、產生付款表單，
+      直接呼叫 `NewebPayController` 的路由方法；退款經由 HTTP 呼叫本機模擬閘道
+    * HTTP 模式（`--target`）：將回調送往執行中的 Odoo（需提供商店金鑰與訂單清單），
+      並可同時以 `--serve-gateway` 啟動模擬閘道供退款與對帳排程使用
+
+報告內容：各階段的 throughput 與 p50 / p95 / p99 延遲、回應分布，
+以及（行程內模式）最終交易狀態與模擬閘道結果的一致性。
+
+使用方式::
+
+    python addons/newebpay_payment/benchmarks/load_driver.py --transactions 2000 --concurrency 16 \\
+        --duplicate-rate 0.2 --reorder-rate 0.3 --failure-rate 0.05 --refund-rate 0.1
+    python addons/newebpay_payment/benchmarks/load_driver.py --target http://localhost:8069 \\
+        --merchant MS100000000:<hash_key>:<hash_iv> --orders orders.jsonl --concurrency 32
+
+`--orders` 為每行一筆 `{"MerchantOrderNo": ..., "Amt": ...}` 的 JSON Lines 檔案。
+
+替身環境以執行緒鎖模擬交易列鎖（鎖定持續到單一回調請求結束），但沒有資料庫交易隔離；
+報告中的「重複處理」次數（由 `newebpay_callbacks_total` 指標計算）應為 0；
+「付款統計不一致」為增量維護的統計與由交易重新計算的結果不同的維度數，也應為 0。
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks import standin  # noqa: E402
+from benchmarks.run_benchmarks import HASH_IV, HASH_KEY, MERCHANT_ID, setup_env, summarize  # noqa: E402
+
+# 伺服器通知的來源 IP（藍新金流由少數固定 IP 送出）
+GATEWAY_IPS = ('203.0.113.10', '203.0.113.11')
+# 與 Odoo 的 `MAX_TRIES_ON_CONCURRENCY_FAILURE` 相同：並行衝突時最多重試的次數
+MAX_TRIES_ON_CONCURRENCY_FAILURE = 5
+
+
+class Event:
+    """ 一次回調請求 """
+
+    __slots__ = ('kind', 'trade', 'post', 'remote_addr', 'tag')
+
+    def __init__(self, kind, trade, post, remote_addr, tag=''):
+        self.kind = kind
+        self.trade = trade
+        self.post = post
+        self.remote_addr = remote_addr
+        self.tag = tag
+
+
+def build_events(gateway, trades, duplicate_rate, reorder_rate, rng):
+    """
+    依模擬交易產生回調事件序列
+
+    每筆交易產生一次 notify 與一次 return；`duplicate_rate` 比例的交易另有 1～3 次 notify 重送，
+    `reorder_rate` 比例的交易 return 先於 notify，且重送延後到序列中較後面的位置。
+
+    :return: Event 列表（依送出順序）
+    """
+    events = []
+    late = []
+    for index, trade in enumerate(trades):
+        post = gateway.callback(trade)
+        client_ip = f'198.51.{index // 250 % 250}.{index % 250 + 1}'
+        notify = Event('notify', trade, post, rng.choice(GATEWAY_IPS))
+        ret = Event('return', trade, post, client_ip)
+        reordered = rng.random() < reorder_rate
+        events.extend((ret, notify) if reordered else (notify, ret))
+        if rng.random() < duplicate_rate:
+            for _i in range(rng.randint(1, 3)):
+                duplicate = Event('notify', trade, post, rng.choice(GATEWAY_IPS), tag='duplicate')
+                if reordered:
+                    late.append(duplicate)
+                else:
+                    events.append(duplicate)
+    # 延後的重送插入到序列中隨機的較後位置
+    for event in late:
+        events.insert(rng.randint(len(events) // 2, len(events)), event)
+    return events
+
+
+def classify(kind, response):
+    """ 將回應整理為報告用的分類 """
+    status = getattr(response, 'status_code', 200)
+    if status == 429:
+        return 'throttled'
+    if kind == 'return':
+        location = getattr(response, 'location', None) or ''
+        return f'redirect {location}' if location else f'http {status}'
+    body = response if isinstance(response, str) else getattr(response, 'data', '')
+    return body[:40]
+
+
+def dispatch(events, send, concurrency):
+    """
+    以 `concurrency` 個執行緒依序送出事件
+
+    :param send: 送出單一事件的函式，回傳回應分類字串
+    :return: (依事件種類的延遲樣本, 回應分布 Counter, 實際經過秒數)
+    """
+    samples = defaultdict(list)
+    responses = Counter()
+    lock = threading.Lock()
+
+    def _run(event):
+        start = time.perf_counter()
+        try:
+            outcome = send(event)
+        except Exception as e:
+            outcome = f'exception {type(e).__name__}'
+        elapsed = time.perf_counter() - start
+        with lock:
+            samples[event.kind].append(elapsed)
+            responses[f'{event.kind}{"(" + event.tag + ")" if event.tag else ""}: {outcome}'] += 1
+
+    wall_start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(_run, events))
+    return samples, responses, time.perf_counter() - wall_start
+
+
+def _phase(samples, wall):
+    result = summarize(samples)
+    result['throughput_per_sec'] = len(samples) / wall if wall else 0.0
+    return result
+
+
+# ---- 行程內模式 ----
+
+def run_in_process(args):
+    env, provider, transactions = setup_env(args.transactions)
+    from benchmarks.gateway_simulator import MPGGatewaySimulator
+    from odoo.addons.newebpay_payment.utils import metrics
+
+    configure_admission(env, args)
+    controller = standin.load_controller()
+    rng = random.Random(args.seed)
+    gateway = MPGGatewaySimulator(
+        {MERCHANT_ID: (HASH_KEY, HASH_IV)}, failure_rate=args.failure_rate, seed=args.seed,
+    )
+    gateway.serve()
+    env.config_parameters['newebpay_payment.api_base_url'] = gateway.url
+    report = {'mode': 'in-process', 'phases': {}}
+    try:
+        # 付款表單 → 模擬閘道
+        trades = [None] * len(transactions)
+        checkout_samples = []
+
+        def _checkout(index):
+            start = time.perf_counter()
+            trades[index] = gateway.checkout(transactions[index]._get_specific_rendering_values({}))
+            checkout_samples.append(time.perf_counter() - start)
+
+        wall_start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            list(executor.map(_checkout, range(len(transactions))))
+        report['phases']['checkout'] = _phase(checkout_samples, time.perf_counter() - wall_start)
+
+        # 回調
+        events = build_events(gateway, trades, args.duplicate_rate, args.reorder_rate, rng)
+
+        def _send(event):
+            # 與 Odoo 相同：並行衝突（序列化失敗）時回滾並重試整個請求
+            for attempt in range(MAX_TRIES_ON_CONCURRENCY_FAILURE):
+                try:
+                    with standin.use_request(env, remote_addr=event.remote_addr):
+                        if event.kind == 'notify':
+                            response = controller.newebpay_notify(**event.post)
+                        else:
+                            response = controller.newebpay_return(**event.post)
+                    return classify(event.kind, response)
+                except standin.SerializationFailure:
+                    if attempt == MAX_TRIES_ON_CONCURRENCY_FAILURE - 1:
+                        raise
+
+        samples, responses, wall = dispatch(events, _send, args.concurrency)
+        for kind, kind_samples in samples.items():
+            report['phases'][kind] = _phase(kind_samples, wall)
+        report['callbacks'] = {'events': len(events), 'wall_seconds': wall,
+                               'throughput_per_sec': len(events) / wall if wall else 0.0}
+        report['responses'] = dict(sorted(responses.items()))
+
+        # 退款（經由 HTTP 呼叫模擬閘道）
+        paid = [tx for tx, trade in zip(transactions, trades) if trade.paid and tx.state == 'done']
+        refund_txs = rng.sample(paid, int(len(paid) * args.refund_rate))
+        if refund_txs:
+            refund_samples = []
+            refund_results = Counter()
+
+            def _refund(tx):
+                start = time.perf_counter()
+                try:
+                    tx._send_refund_request(amount_to_refund=tx.amount)
+                    refund_results['SUCCESS'] += 1
+                except Exception as e:
+                    refund_results[f'error {str(e)[:60]}'] += 1
+                refund_samples.append(time.perf_counter() - start)
+
+            wall_start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+                list(executor.map(_refund, refund_txs))
+            report['phases']['refund'] = _phase(refund_samples, time.perf_counter() - wall_start)
+            report['refunds'] = dict(refund_results)
+
+        report['consistency'] = check_consistency(transactions, trades, callback_results(metrics))
+        report['consistency']['stats_mismatches'] = check_stats(env, transactions)
+    finally:
+        gateway.shutdown()
+    return report
+
+
+def callback_results(metrics):
+    """ 由行程內指標取得回調處理結果（重複通知與首次處理的回應內容相同，只能由指標區分） """
+    values = metrics.registry.snapshot().get(metrics.CALLBACKS.name, {})
+    return {f'{route} {result}': int(cell[0]) for (route, result), cell in sorted(values.items())}
+
+
+def check_consistency(transactions, trades, results):
+    """
+    比對交易最終狀態與模擬閘道的付款結果
+
+    :param results: `callback_results()` 的結果
+    """
+    states = Counter()
+    mismatches = []
+    for tx, trade in zip(transactions, trades):
+        states[tx.state] += 1
+        expected_done = trade.paid
+        if (tx.state == 'done') != expected_done or (expected_done and tx.newebpay_trade_no != trade.trade_no):
+            mismatches.append({
+                'reference': tx.reference,
+                'state': tx.state,
+                'gateway_status': trade.status,
+            })
+    processed = results.get('notify processed', 0) + results.get('return processed', 0)
+    return {
+        'states': dict(states),
+        'mismatches': len(mismatches),
+        'mismatch_samples': mismatches[:10],
+        'callback_results': results,
+        # 每筆交易應只完整處理一次，其餘皆應由冪等紀錄攔下
+        'processed_more_than_once': max(processed - len(trades), 0),
+    }
+
+
+def check_stats(env, transactions):
+    """ 比對增量維護的付款統計與由交易重新計算的結果，回傳不一致的維度數 """
+    Stats = env['newebpay.payment.stats']
+    expected = Counter()
+    for key, values in Stats._snapshot(transactions).values():
+        for measure, value in zip(('count', 'gross', 'refunded', 'failures'), values):
+            expected[key + (measure,)] += value
+    actual = Counter()
+    for row in env.tables['newebpay.payment.stats'].records.values():
+        key = (row['date'], row['provider_id'], row['payment_type'] or '', row['state'])
+        for measure, field in (('count', 'tx_count'), ('gross', 'amount_gross'),
+                               ('refunded', 'amount_refunded'), ('failures', 'failure_count')):
+            actual[key + (measure,)] += row[field]
+    keys = {key[:4] for key in expected.keys() | actual.keys()}
+    return sum(
+        1 for key in keys
+        if any(abs(expected[key + (measure,)] - actual[key + (measure,)]) >= 0.005
+               for measure in ('count', 'gross', 'refunded', 'failures'))
+    )
+
+
+def configure_admission(env, args):
+    """ 依參數設定准入限流的系統參數（未指定時停用，量測處理能力本身） """
+    env.config_parameters['newebpay_payment.callback_rate_per_ip'] = str(args.admission_rate or 0)
+    if args.admission_burst:
+        env.config_parameters['newebpay_payment.callback_burst_per_ip'] = str(args.admission_burst)
+
+
+# ---- HTTP 模式 ----
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    """ 不跟隨重新導向（只量測回調本身） """
+
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+
+def run_http(args):
+    from benchmarks.gateway_simulator import MPGGatewaySimulator
+
+    if not args.merchant or not args.orders:
+        raise SystemExit('HTTP 模式需要 --merchant 與 --orders')
+    merchant_id, keys = args.merchant
+    rng = random.Random(args.seed)
+    gateway = MPGGatewaySimulator({merchant_id: keys}, failure_rate=args.failure_rate, seed=args.seed)
+    if args.serve_gateway is not None:
+        gateway.serve(port=args.serve_gateway)
+    target = args.target.rstrip('/')
+    opener = urllib.request.build_opener(_NoRedirect)
+    report = {'mode': 'http', 'target': target, 'phases': {}}
+    try:
+        with open(args.orders) as orders_file:
+            trades = [
+                gateway.create_trade(merchant_id, order['MerchantOrderNo'], order['Amt'])
+                for order in map(json.loads, filter(str.strip, orders_file))
+            ]
+        events = build_events(gateway, trades, args.duplicate_rate, args.reorder_rate, rng)
+
+        def _send(event):
+            request = urllib.request.Request(
+                f'{target}/payment/newebpay/{event.kind}',
+                data=urllib.parse.urlencode(event.post).encode('utf-8'),
+                headers={'Content-Type': 'application/x-www-form-urlencoded'},
+            )
+            try:
+                with opener.open(request, timeout=args.timeout) as response:
+                    body = response.read().decode('utf-8', 'replace')
+                    status = response.status
+            except urllib.error.HTTPError as e:
+                body = e.read().decode('utf-8', 'replace')
+                status = e.code
+                if 300 <= status < 400:
+                    return f'redirect {urllib.parse.urlsplit(e.headers.get("Location", "")).path}'
+            if status == 429:
+                return 'throttled'
+            return f'http {status} {body[:40]}'
+
+        samples, responses, wall = dispatch(events, _send, args.concurrency)
+        for kind, kind_samples in samples.items():
+            report['phases'][kind] = _phase(kind_samples, wall)
+        report['callbacks'] = {'events': len(events), 'wall_seconds': wall,
+                               'throughput_per_sec': len(events) / wall if wall else 0.0}
+        report['responses'] = dict(sorted(responses.items()))
+    finally:
+        gateway.shutdown()
+    return report
+
+
+def print_report(report):
+    print(f"模式: {report['mode']}" + (f" ({report['target']})" if report.get('target') else ''))
+    print(f"{'階段':<12}{'筆數':>8}{'throughput/s':>14}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name, result in report['phases'].items():
+        print(f"{name:<12}{result['iterations']:>8}{result['throughput_per_sec']:>14.1f}"
+              f"{result['p50_ms']:>10.3f}{result['p95_ms']:>10.3f}{result['p99_ms']:>10.3f}")
+    callbacks = report.get('callbacks')
+    if callbacks:
+        print(f"\n回調總計: {callbacks['events']} 筆, {callbacks['wall_seconds']:.2f} 秒, "
+              f"{callbacks['throughput_per_sec']:.1f} 筆/秒")
+    print('\n回應分布:')
+    for key, count in report.get('responses', {}).items():
+        print(f'  {count:>8}  {key}')
+    if report.get('refunds'):
+        print('\n退款結果:')
+        for key, count in report['refunds'].items():
+            print(f'  {count:>8}  {key}')
+    consistency = report.get('consistency')
+    if consistency:
+        print(f"\n最終狀態: {consistency['states']}")
+        print(f"處理結果: {consistency['callback_results']}")
+        print(f"重複處理: {consistency['processed_more_than_once']} 次")
+        print(f"與模擬閘道結果不一致: {consistency['mismatches']} 筆")
+        if 'stats_mismatches' in consistency:
+            print(f"付款統計不一致: {consistency['stats_mismatches']} 個維度")
+        for sample in consistency['mismatch_samples']:
+            print(f'  {sample}')
+
+
+def _parse_merchant(value):
+    from benchmarks.gateway_simulator import _parse_merchant as parse
+    return parse(value)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='藍新金流回調負載測試')
+    parser.add_argument('--transactions', type=int, default=1000, help='交易筆數（行程內模式）')
+    parser.add_argument('--concurrency', type=int, default=8, help='並行送出的執行緒數')
+    parser.add_argument('--duplicate-rate', type=float, default=0.1, help='有 notify 重送的交易比例')
+    parser.add_argument('--reorder-rate', type=float, default=0.2, help='return 先於 notify 的交易比例')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='付款失敗的交易比例')
+    parser.add_argument('--refund-rate', type=float, default=0.0, help='付款成功後退款的交易比例（行程內模式）')
+    parser.add_argument('--admission-rate', type=float, default=0.0,
+                        help='每個來源 IP 每秒允許的未通過檢查回調數（0 表示停用限流）')
+    parser.add_argument('--admission-burst', type=float, default=0.0, help='每個來源 IP 允許累積的未通過檢查回調數')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--target', help='Odoo 網址（HTTP 模式）')
+    parser.add_argument('--merchant', type=_parse_merchant, help='MerchantID:HashKey:HashIV（HTTP 模式）')
+    parser.add_argument('--orders', help='訂單清單 JSON Lines 檔案（HTTP 模式）')
+    parser.add_argument('--serve-gateway', type=int, metavar='PORT', help='同時在指定埠啟動模擬閘道（HTTP 模式）')
+    parser.add_argument('--timeout', type=float, default=30.0, help='HTTP 請求逾時（秒）')
+    parser.add_argument('--json', dest='json_path', help='將報告寫入 JSON 檔案')
+    args = parser.parse_args(argv)
+
+    if args.target:
+        standin.install()
+        report = run_http(args)
+    else:
+        report = run_in_process(args)
+    print_report(report)
+    if args.json_path:
+        with open(args.json_path, 'w') as report_file:
+            json.dump(report, report_file, indent=2, ensure_ascii=False)
+    return 1 if report.get('consistency', {}).get('mismatches') else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,432 @@
+# -*- coding: utf-8 -*-
+
+"""
+藍新金流模組效能測試
+
+量測項目：
+    * NewebPayCrypto 加密 / 解密 / 簽名 / 驗證（多種資料大小）
+    * 付款表單產生（`_get_specific_rendering_values`，沿用已儲存的表單與重新產生）
+    * 伺服器通知完整流程（解碼 + `_get_tx_from_feedback_data` + `_process_notification_data`）
+      以及流程中各階段（verify / decrypt / lookup / process）
+
+`--verify-codec N` 以 N 組隨機資料比對 `utils/codec.py` 與原本的
+`quote` / `unquote` + `Crypto.Util.Padding` 實作，輸出（或例外）必須完全相同。
+
+不需要 Odoo 與資料庫，模型程式碼在 `standin.py` 的輕量替身環境中執行。
+
+使用方式::
+
+    python addons/newebpay_payment/benchmarks/run_benchmarks.py
+    python addons/newebpay_payment/benchmarks/run_benchmarks.py --save-baseline baseline.json
+    python addons/newebpay_payment/benchmarks/run_benchmarks.py --compare baseline.json --tolerance 0.2
+    python addons/newebpay_payment/benchmarks/run_benchmarks.py --verify-codec 20000
+
+`--compare` 時若任一項目的 ops/sec 低於基準值超過容許比例，結束代碼為 1，可作為部署前檢查。
+"""
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import sys
+import time
+from collections import defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks import standin  # noqa: E402
+
+HASH_KEY = '12345678901234567890123456789012'
+HASH_IV = '1234567890123456'
+MERCHANT_ID = 'MS100000000'
+
+# 加密資料大小（ItemDesc 長度，字元）
+PAYLOAD_SIZES = {
+    'small': 16,
+    'medium': 512,
+    'large': 4096,
+}
+
+
+def percentile(sorted_samples, fraction):
+    """ 取已排序樣本的百分位數 """
+    if not sorted_samples:
+        return 0.0
+    index = min(int(round(fraction * (len(sorted_samples) - 1))), len(sorted_samples) - 1)
+    return sorted_samples[index]
+
+
+def summarize(samples):
+    """ 將耗時樣本（秒）整理為 ops/sec 與 p50 / p95 / p99（毫秒） """
+    ordered = sorted(samples)
+    total = sum(ordered)
+    return {
+        'iterations': len(ordered),
+        'ops_per_sec': len(ordered) / total if total else 0.0,
+        'p50_ms': percentile(ordered, 0.50) * 1000,
+        'p95_ms': percentile(ordered, 0.95) * 1000,
+        'p99_ms': percentile(ordered, 0.99) * 1000,
+    }
+
+
+def measure(func, iterations, warmup=None):
+    """ 重複執行 `func` 並回傳每次的耗時樣本（秒） """
+    for _i in range(warmup if warmup is not None else max(iterations // 10, 1)):
+        func()
+    samples = []
+    perf_counter = time.perf_counter
+    for _i in range(iterations):
+        start = perf_counter()
+        func()
+        samples.append(perf_counter() - start)
+    return samples
+
+
+def trade_info_for(size):
+    return {
+        'MerchantID': MERCHANT_ID,
+        'RespondType': 'JSON',
+        'TimeStamp': '1700000000',
+        'Version': '2.0',
+        'MerchantOrderNo': 'S000123',
+        'Amt': 1500,
+        'ItemDesc': ('商品描述 Item&desc=' * size)[:size],
+        'Email': 'buyer@example.com',
+    }
+
+
+def bench_crypto(iterations):
+    from odoo.addons.newebpay_payment.utils.crypto import NewebPayCrypto
+
+    results = {}
+    for label, size in PAYLOAD_SIZES.items():
+        payload = trade_info_for(size)
+        encrypted = NewebPayCrypto.encrypt_trade_info(payload, HASH_KEY, HASH_IV)
+        trade_sha = NewebPayCrypto.create_trade_sha(encrypted, HASH_KEY, HASH_IV)
+        results[f'crypto.encrypt.{label}'] = summarize(measure(
+            lambda: NewebPayCrypto.encrypt_trade_info(payload, HASH_KEY, HASH_IV), iterations))
+        results[f'crypto.decrypt.{label}'] = summarize(measure(
+            lambda: NewebPayCrypto.decrypt_trade_info(encrypted, HASH_KEY, HASH_IV), iterations))
+        results[f'crypto.sign.{label}'] = summarize(measure(
+            lambda: NewebPayCrypto.create_trade_sha(encrypted, HASH_KEY, HASH_IV), iterations))
+        results[f'crypto.verify.{label}'] = summarize(measure(
+            lambda: NewebPayCrypto.verify_trade_sha(encrypted, trade_sha, HASH_KEY, HASH_IV), iterations))
+    return results
+
+
+# ---- TradeInfo 編解碼等價性驗證 ----
+
+# 產生隨機字串用的字元（含 URL 保留字元、百分比編碼片段、多位元組字元與 surrogate）
+CODEC_ALPHABET = (
+    list('abcXYZ019_.-~ +/?#&=%:;,@!*\'()[]"<>')
+    + ['%', '%2', '%20', '%zz', '%E4%B8', '%E4%B8%AD', '%ff', '%C3%A9', '%2B', '%26', '%3D']
+    + ['中', '文', 'é', '😀', '\t', '\n', '\x00', '\ud800']
+)
+
+
+def _random_text(rng, max_length=24):
+    return ''.join(rng.choice(CODEC_ALPHABET) for _i in range(rng.randint(0, max_length)))
+
+
+def _random_value(rng):
+    kind = rng.randrange(6)
+    if kind == 0:
+        return rng.randint(-10 ** 6, 10 ** 12)
+    if kind == 1:
+        return rng.uniform(-1e6, 1e6)
+    if kind == 2:
+        return rng.choice([None, True, False, 0, '', 1.5])
+    return _random_text(rng)
+
+
+def _outcome(func, *args):
+    """ 執行並回傳結果，或例外類型與訊息 """
+    try:
+        return 'ok', func(*args)
+    except Exception as e:
+        return 'error', type(e).__name__, str(e)
+
+
+def _reference_codec():
+    """ 原本的實作（作為等價性驗證的基準） """
+    from urllib.parse import quote, unquote
+    from Crypto.Util.Padding import pad, unpad
+
+    def build_query(params):
+        return '&'.join(f"{key}={quote(str(value), safe='')}" for key, value in params.items())
+
+    def parse_query(text):
+        params = {}
+        for pair in text.split('&'):
+            if '=' in pair:
+                key, value = pair.split('=', 1)
+                params[key] = unquote(value)
+        return params
+
+    def encrypt(cipher, text):
+        return cipher.encrypt(pad(text.encode('utf-8'), 16)).hex()
+
+    def decrypt(cipher, trade_info):
+        return unpad(cipher.decrypt(bytes.fromhex(trade_info)), 16).decode('utf-8')
+
+    return build_query, parse_query, encrypt, decrypt
+
+
+def verify_codec(cases, seed=0):
+    """
+    以隨機資料比對新舊編解碼實作
+
+    :return: 不一致的案例列表
+    """
+    from Crypto.Cipher import AES
+    from odoo.addons.newebpay_payment.utils import codec
+
+    ref_build, ref_parse, ref_encrypt, ref_decrypt = _reference_codec()
+    key, iv = HASH_KEY.encode(), HASH_IV.encode()
+
+    def new_cipher():
+        return AES.new(key, AES.MODE_CBC, iv)
+
+    rng = random.Random(seed)
+    failures = []
+
+    def check(name, reference, candidate, *args):
+        expected = _outcome(reference, *args)
+        actual = _outcome(candidate, *args)
+        if expected != actual:
+            failures.append((name, args, expected, actual))
+
+    for _i in range(cases):
+        params = {_random_text(rng, 8): _random_value(rng) for _j in range(rng.randint(0, 8))}
+        check('build_query', ref_build, codec.build_query, params)
+
+        text = _random_text(rng, 64)
+        check('parse_query', ref_parse, codec.parse_query, text)
+
+        check('encrypt', lambda t: ref_encrypt(new_cipher(), t), lambda t: codec.encrypt(new_cipher(), t), text)
+
+        # 密文：非 UTF-8 明文、錯誤 padding、正常資料、長度不符、大寫、非十六進位字元、空字串
+        raw = bytes(rng.randrange(256) for _j in range(rng.randint(0, 64)))
+        valid = ref_encrypt(new_cipher(), text.replace('\ud800', ''))
+        kind = rng.randrange(7)
+        if kind == 0:
+            hex_data = new_cipher().encrypt(raw + bytes((16 - len(raw) % 16,)) * (16 - len(raw) % 16)).hex()
+        elif kind == 1:
+            hex_data = new_cipher().encrypt(raw[:len(raw) // 16 * 16]).hex()
+        elif kind == 2:
+            hex_data = valid
+        elif kind == 3:
+            hex_data = valid[:-rng.randint(1, 31)]
+        elif kind == 4:
+            hex_data = valid.upper()
+        elif kind == 5:
+            hex_data = valid[:-1] + rng.choice('gz ')
+        else:
+            hex_data = ''
+        check('decrypt', lambda h: ref_decrypt(new_cipher(), h), lambda h: codec.decrypt(new_cipher(), h), hex_data)
+    return failures
+
+
+def setup_env(transaction_count):
+    """ 建立替身環境：一個提供者、`transaction_count` 筆交易 """
+    env = standin.install()
+    env.config_parameters['web.base.url'] = 'https://shop.example.com'
+    company = env['res.company'].create({'name': 'Benchmark'})
+    provider = env['payment.provider'].create({
+        'company_id': company,
+        'name': '藍新金流',
+        'code': 'newebpay',
+        'state': 'test',
+        'newebpay_merchant_id': MERCHANT_ID,
+        'newebpay_hash_key': HASH_KEY,
+        'newebpay_hash_iv': HASH_IV,
+        'newebpay_test_mode': True,
+        'newebpay_credit_card': True,
+    })
+    partner = env['res.partner'].create({'name': 'Buyer', 'email': 'buyer@example.com'})
+    create_date = datetime.datetime(2024, 1, 1, 12, 0, 0)
+    Transaction = env['payment.transaction']
+    transactions = [
+        Transaction.create({
+            'reference': f'S{index:06d}-1',
+            'amount': 1500.0,
+            'state': 'draft',
+            'provider_id': provider,
+            'partner_id': partner,
+            'create_date': create_date,
+        })
+        for index in range(transaction_count)
+    ]
+    return env, provider, transactions
+
+
+def build_notification(tx, provider, status='SUCCESS'):
+    """ 產生與藍新金流相同格式（已加密與簽名）的伺服器通知 """
+    from odoo.addons.newebpay_payment.utils.crypto import NewebPayCrypto
+
+    trade_info = NewebPayCrypto.encrypt_trade_info({
+        'Status': status,
+        'Message': '授權成功',
+        'MerchantID': provider.newebpay_merchant_id,
+        'Amt': int(tx.amount),
+        'TradeNo': f'23{tx.id:012d}',
+        'MerchantOrderNo': tx._newebpay_get_merchant_order_no(),
+        'PaymentType': 'CREDIT',
+        'RespondType': 'String',
+        'PayTime': '2024-01-01 12:00:00',
+        'IP': '127.0.0.1',
+        'EscrowBank': 'HNCB',
+    }, provider.newebpay_hash_key, provider.newebpay_hash_iv)
+    return {
+        'Status': status,
+        'MerchantID': provider.newebpay_merchant_id,
+        'Version': '2.0',
+        'TradeInfo': trade_info,
+        'TradeSha': NewebPayCrypto.create_trade_sha(trade_info, provider.newebpay_hash_key, provider.newebpay_hash_iv),
+    }
+
+
+def bench_rendering(env, transactions, iterations):
+    samples = []
+    uncached_samples = []
+    # 先產生每筆交易的表單，之後的量測為沿用已儲存表單的情況
+    for tx in transactions:
+        tx._get_specific_rendering_values({})
+    for index in range(iterations):
+        tx = transactions[index % len(transactions)]
+        start = time.perf_counter()
+        tx._get_specific_rendering_values({})
+        samples.append(time.perf_counter() - start)
+        # 清除已儲存的表單，量測重新加密與簽名的成本
+        tx.newebpay_form_fingerprint = False
+        start = time.perf_counter()
+        tx._get_specific_rendering_values({})
+        uncached_samples.append(time.perf_counter() - start)
+    return {
+        'render.specific_rendering_values': summarize(samples),
+        'render.regenerate': summarize(uncached_samples),
+    }
+
+
+def bench_notify(env, provider, transactions, iterations):
+    Transaction = env['payment.transaction']
+    payloads = [build_notification(tx, provider) for tx in transactions]
+    stage_samples = defaultdict(list)
+    samples = []
+    for index in range(iterations):
+        tx = transactions[index % len(transactions)]
+        tx.write({'state': 'draft'})
+        post = payloads[index % len(payloads)]
+        start = time.perf_counter()
+        notification = Transaction._newebpay_decode_notification(post)
+        found = Transaction._get_tx_from_feedback_data('newebpay', notification)
+        found._process_notification_data(notification)
+        samples.append(time.perf_counter() - start)
+        for stage, elapsed in notification.timings.items():
+            stage_samples[stage].append(elapsed)
+        if found.state != 'done':
+            raise RuntimeError(f'通知處理結果不正確: {found.state} {found.state_message}')
+
+    results = {'notify.pipeline': summarize(samples)}
+    for stage, values in sorted(stage_samples.items()):
+        results[f'notify.stage.{stage}'] = summarize(values)
+    return results
+
+
+def run(iterations, transaction_count):
+    env, provider, transactions = setup_env(transaction_count)
+    results = {}
+    results.update(bench_crypto(iterations))
+    results.update(bench_rendering(env, transactions, iterations))
+    results.update(bench_notify(env, provider, transactions, iterations))
+    return results
+
+
+def print_report(results, baseline=None):
+    header = f"{'項目':<36}{'ops/sec':>12}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+    if baseline:
+        header += f"{'vs 基準':>10}"
+    print(header)
+    print('-' * len(header.encode('utf-8')))
+    for name, stats in results.items():
+        line = (
+            f"{name:<38}{stats['ops_per_sec']:>12.1f}{stats['p50_ms']:>10.3f}"
+            f"{stats['p95_ms']:>10.3f}{stats['p99_ms']:>10.3f}"
+        )
+        if baseline and name in baseline:
+            reference = baseline[name]['ops_per_sec']
+            change = (stats['ops_per_sec'] - reference) / reference if reference else 0.0
+            line += f'{change:>+10.1%}'
+        print(line)
+
+
+def compare(results, baseline, tolerance):
+    """ 回傳 ops/sec 低於基準值超過容許比例的項目 """
+    regressions = []
+    for name, reference in baseline.items():
+        current = results.get(name)
+        if not current or not reference.get('ops_per_sec'):
+            continue
+        ratio = current['ops_per_sec'] / reference['ops_per_sec']
+        if ratio < 1 - tolerance:
+            regressions.append((name, reference['ops_per_sec'], current['ops_per_sec'], ratio - 1))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='藍新金流模組效能測試')
+    parser.add_argument('--iterations', type=int, default=2000, help='每個項目的執行次數')
+    parser.add_argument('--transactions', type=int, default=1000, help='替身環境中的交易筆數')
+    parser.add_argument('--save-baseline', metavar='PATH', help='將結果寫入 JSON 基準檔')
+    parser.add_argument('--compare', metavar='PATH', help='與 JSON 基準檔比較')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='允許的 ops/sec 衰退比例（預設 0.2）')
+    parser.add_argument('--json', action='store_true', help='以 JSON 輸出結果')
+    parser.add_argument('--verify-codec', type=int, metavar='N', help='只以 N 組隨機資料驗證編解碼等價性')
+    parser.add_argument('--seed', type=int, default=0, help='等價性驗證的亂數種子')
+    args = parser.parse_args(argv)
+
+    if args.verify_codec:
+        standin.install()
+        failures = verify_codec(args.verify_codec, args.seed)
+        for name, case_args, expected, actual in failures[:20]:
+            print(f'{name}{case_args!r}:\n  原實作: {expected!r}\n  新實作: {actual!r}')
+        print(f'編解碼等價性驗證: {args.verify_codec} 組，不一致 {len(failures)} 組')
+        return 1 if failures else 0
+
+    results = run(args.iterations, args.transactions)
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as baseline_file:
+            baseline = json.load(baseline_file)['results']
+
+    if args.json:
+        print(json.dumps(results, indent=2, ensure_ascii=False))
+    else:
+        print_report(results, baseline)
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w', encoding='utf-8') as baseline_file:
+            json.dump({
+                'created': datetime.datetime.now().isoformat(timespec='seconds'),
+                'python': platform.python_version(),
+                'machine': platform.machine(),
+                'iterations': args.iterations,
+                'results': results,
+            }, baseline_file, indent=2, ensure_ascii=False)
+        print(f'\n已寫入基準檔: {args.save_baseline}')
+
+    if baseline:
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f'\n效能衰退超過 {args.tolerance:.0%}:')
+            for name, reference, current, change in regressions:
+                print(f'  {name}: {reference:.1f} → {current:.1f} ops/sec ({change:+.1%})')
+            return 1
+        print(f'\n所有項目皆在容許範圍內（{args.tolerance:.0%}）')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,719 @@
+# -*- coding: utf-8 -*-
+
+"""
+效能測試用的輕量 Odoo 替身
+
+只實作模組熱路徑會用到的最小 ORM 介面（欄位預設值、記錄集、等值索引查詢、
+系統參數、cursor 屬性），讓 `PaymentTransaction` / `PaymentProvider` 的實際程式碼
+可以在沒有 Odoo 與資料庫的環境中執行與量測。
+
+使用方式::
+
+    from benchmarks import standin
+    env = standin.install()       # 必須在匯入模組程式碼之前呼叫
+    Transaction = env['payment.transaction']
+
+控制器可透過 `odoo.http` 替身直接呼叫::
+
+    controller = standin.load_controller()
+    with standin.use_request(env, remote_addr='203.0.113.10'):
+        response = controller.newebpay_notify(**post)
+"""
+
+import contextlib
+import datetime
+import importlib
+import os
+import sys
+import threading
+import types
+from collections import defaultdict
+
+ADDON_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ADDON_NAME = os.path.basename(ADDON_DIR)
+
+
+class ValidationError(Exception):
+    pass
+
+
+class UserError(Exception):
+    pass
+
+
+class MissingError(Exception):
+    pass
+
+
+class IntegrityError(Exception):
+    """ `psycopg2.IntegrityError` 替身（違反唯一性限制） """
+
+
+class SerializationFailure(Exception):
+    """ `psycopg2.errors.SerializationFailure` 替身（Odoo 會回滾並重試整個請求） """
+
+
+class Field:
+    """ 欄位描述（只保留預設值） """
+
+    _counter = 0
+
+    def __init__(self, *args, **kwargs):
+        self.default = kwargs.get('default')
+        self.kwargs = kwargs
+
+    def get_default(self):
+        if callable(self.default):
+            return self.default(None)
+        return self.default if self.default is not None else False
+
+
+class _FieldsModule(types.ModuleType):
+    """ `odoo.fields` 替身：任何欄位型別都回傳 `Field` """
+
+    class Datetime(Field):
+        @staticmethod
+        def now(*args):
+            # 與 Odoo 相同，可作為 `default=fields.Datetime.now` 使用
+            return datetime.datetime.utcnow()
+        today = staticmethod(datetime.date.today)
+
+        @staticmethod
+        def subtract(value, **kwargs):
+            return value - datetime.timedelta(**kwargs)
+
+        @staticmethod
+        def add(value, **kwargs):
+            return value + datetime.timedelta(**kwargs)
+
+        @staticmethod
+        def to_string(value):
+            return value.strftime('%Y-%m-%d %H:%M:%S') if value else False
+
+    class Date(Field):
+        today = staticmethod(datetime.date.today)
+
+        @staticmethod
+        def to_string(value):
+            return value.strftime('%Y-%m-%d') if value else False
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return Field
+
+
+class _ApiModule(types.ModuleType):
+    """ `odoo.api` 替身：所有裝飾器都原樣回傳函式 """
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+
+        def decorator(*args, **kwargs):
+            if len(args) == 1 and callable(args[0]) and not kwargs:
+                return args[0]
+            return lambda func: func
+        return decorator
+
+
+class Response:
+    """ HTTP 回應替身 """
+
+    def __init__(self, data='', status=200, headers=None):
+        self.data = data
+        self.status_code = status
+        self.headers = dict(headers or [])
+
+    @property
+    def location(self):
+        return self.headers.get('Location')
+
+
+class Request:
+    """ `odoo.http.request` 替身（只提供控制器用到的屬性） """
+
+    def __init__(self, env, remote_addr='127.0.0.1', headers=None):
+        self.env = env
+        self.db = env.cr.dbname
+        self.httprequest = types.SimpleNamespace(remote_addr=remote_addr, headers=dict(headers or {}))
+
+    def redirect(self, location, code=303):
+        return Response('', status=code, headers=[('Location', location)])
+
+    def make_response(self, data, headers=None, status=200):
+        return Response(data, status=status, headers=headers)
+
+
+_current_request = threading.local()
+
+
+class RowLocks:
+    """
+    交易列鎖替身：以執行緒鎖模擬 `SELECT ... FOR UPDATE [SKIP LOCKED]`
+
+    鎖定持續到 `use_request()` 結束（相當於請求的資料庫交易提交）。
+    與 Odoo 的 REPEATABLE READ 相同，等待其他請求釋放的鎖定後拋出 `SerializationFailure`
+    （持有者已提交對該列的更新），由呼叫端重試整個請求。
+    """
+
+    def __init__(self):
+        self._locks = defaultdict(threading.Lock)
+        self._guard = threading.Lock()
+        self._held = threading.local()
+
+    def acquire(self, key, blocking=True):
+        held = self._held.__dict__.setdefault('keys', [])
+        if key in held:
+            return True
+        with self._guard:
+            lock = self._locks[key]
+        if not lock.acquire(False):
+            if not blocking:
+                return False
+            lock.acquire()
+            lock.release()
+            raise SerializationFailure('could not serialize access due to concurrent update')
+        held.append(key)
+        return True
+
+    def release_all(self):
+        held = self._held.__dict__.setdefault('keys', [])
+        while held:
+            key = held.pop()
+            self._locks[key].release()
+
+
+class _RequestProxy:
+    """ 依執行緒轉送到目前請求的代理物件（對應 Odoo 的 `request` werkzeug local） """
+
+    def __getattr__(self, name):
+        current = getattr(_current_request, 'value', None)
+        if current is None:
+            raise RuntimeError('目前執行緒沒有請求，請使用 standin.use_request()')
+        return getattr(current, name)
+
+
+class _HttpModule(types.ModuleType):
+    """ `odoo.http` 替身 """
+
+    Controller = object
+    request = _RequestProxy()
+
+    @staticmethod
+    def route(*args, **kwargs):
+        return lambda func: func
+
+
+@contextlib.contextmanager
+def use_request(env, remote_addr='127.0.0.1', headers=None):
+    """ 在目前執行緒設定 `odoo.http.request` """
+    previous = getattr(_current_request, 'value', None)
+    _current_request.value = Request(env, remote_addr=remote_addr, headers=headers)
+    try:
+        yield _current_request.value
+    finally:
+        env.row_locks.release_all()
+        _current_request.value = previous
+
+
+class _Postcommit:
+    def __init__(self):
+        self.callbacks = []
+
+    def add(self, callback):
+        self.callbacks.append(callback)
+
+    def run(self):
+        callbacks, self.callbacks = self.callbacks, []
+        for callback in callbacks:
+            callback()
+
+
+class Cursor:
+    """ cursor 替身：提供 dbname / postcommit，不支援 SQL """
+
+    dbname = 'benchmark'
+
+    def __init__(self):
+        self.postcommit = _Postcommit()
+        self.committed = 0
+
+    def commit(self):
+        self.committed += 1
+        self.postcommit.run()
+
+    def execute(self, query, params=None):
+        raise NotImplementedError('效能測試替身不支援原生 SQL')
+
+
+class Table:
+    """ 單一模型的記錄儲存，依需要為等值查詢建立雜湊索引 """
+
+    def __init__(self):
+        self.records = {}
+        self.next_id = 1
+        self.indexes = {}
+
+    def index_for(self, field):
+        index = self.indexes.get(field)
+        if index is None:
+            index = defaultdict(set)
+            for record_id, values in self.records.items():
+                index[values.get(field)].add(record_id)
+            self.indexes[field] = index
+        return index
+
+    def update_index(self, record_id, field, old, new):
+        index = self.indexes.get(field)
+        if index is not None:
+            index[old].discard(record_id)
+            index[new].add(record_id)
+
+
+class Environment:
+    """ 環境替身：`env[model_name]` 回傳空記錄集 """
+
+    def __init__(self):
+        self.cr = Cursor()
+        self.uid = 1
+        self.context = {}
+        self.classes = {}
+        self.tables = defaultdict(Table)
+        self.config_parameters = {}
+
+    def __getitem__(self, model_name):
+        return self.classes[model_name](self, ())
+
+    def register(self, model_name, cls):
+        self.classes[model_name] = cls
+
+
+class Model:
+    """ 記錄集替身 """
+
+    _name = None
+    _inherit = None
+    _fields_cache = None
+
+    def __init__(self, env, ids):
+        object.__setattr__(self, 'env', env)
+        object.__setattr__(self, '_ids', tuple(ids))
+
+    # ---- 記錄集基本操作 ----
+
+    @classmethod
+    def _model_name(cls):
+        return cls._name or cls._inherit
+
+    @classmethod
+    def _field_defaults(cls):
+        if cls.__dict__.get('_fields_cache') is None:
+            defaults = {}
+            for klass in reversed(cls.__mro__):
+                for name, value in vars(klass).items():
+                    if isinstance(value, Field):
+                        defaults[name] = value
+            cls._fields_cache = defaults
+        return cls._fields_cache
+
+    @property
+    def _table(self):
+        return self.env.tables[self._model_name()]
+
+    @property
+    def ids(self):
+        return list(self._ids)
+
+    @property
+    def id(self):
+        return self._ids[0] if len(self._ids) == 1 else False
+
+    def __bool__(self):
+        return bool(self._ids)
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __iter__(self):
+        for record_id in self._ids:
+            yield type(self)(self.env, (record_id,))
+
+    def __eq__(self, other):
+        return isinstance(other, Model) and self._model_name() == other._model_name() and self._ids == other._ids
+
+    def __hash__(self):
+        return hash((self._model_name(), self._ids))
+
+    def __getattribute__(self, name):
+        if name.startswith('_') or name in ('env', 'id', 'ids'):
+            return object.__getattribute__(self, name)
+        fields_ = type(self)._field_defaults()
+        if name in fields_:
+            if not self._ids:
+                return False
+            self.ensure_one()
+            return self._table.records[self._ids[0]].get(name, False)
+        return object.__getattribute__(self, name)
+
+    def __setattr__(self, name, value):
+        if name in type(self)._field_defaults():
+            self.write({name: value})
+        else:
+            object.__setattr__(self, name, value)
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return getattr(self, key)
+        return self.browse(self._ids[key])
+
+    def sudo(self, flag=True):
+        return self
+
+    def with_context(self, *args, **kwargs):
+        return self
+
+    def ensure_one(self):
+        if len(self._ids) != 1:
+            raise ValueError(f'Expected singleton: {self._model_name()}{self._ids}')
+        return self
+
+    def browse(self, ids=()):
+        if isinstance(ids, int):
+            ids = (ids,)
+        return type(self)(self.env, ids or ())
+
+    def exists(self):
+        return self.browse([i for i in self._ids if i in self._table.records])
+
+    def filtered(self, func):
+        return self.browse([record.id for record in self if func(record)])
+
+    def mapped(self, name):
+        return [getattr(record, name) for record in self]
+
+    # ---- CRUD ----
+
+    def create(self, values):
+        if isinstance(values, list):
+            ids = [self.create(vals).id for vals in values]
+            return self.browse(ids)
+        table = self._table
+        record_id = table.next_id
+        table.next_id += 1
+        record = {name: field.get_default() for name, field in type(self)._field_defaults().items()}
+        record.update(values)
+        record.setdefault('create_date', datetime.datetime.utcnow())
+        table.records[record_id] = record
+        for field, index in table.indexes.items():
+            index[record.get(field)].add(record_id)
+        return self.browse(record_id)
+
+    def write(self, values):
+        table = self._table
+        for record_id in self._ids:
+            record = table.records[record_id]
+            for field, value in values.items():
+                table.update_index(record_id, field, record.get(field), value)
+                record[field] = value
+        return True
+
+    def unlink(self):
+        table = self._table
+        for record_id in self._ids:
+            record = table.records.pop(record_id)
+            for field, index in table.indexes.items():
+                index[record.get(field)].discard(record_id)
+        return True
+
+    def read(self, fields=None):
+        return [
+            dict({'id': record_id}, **{
+                name: value for name, value in self._table.records[record_id].items()
+                if fields is None or name in fields
+            })
+            for record_id in self._ids
+        ]
+
+    # ---- 查詢（只支援 AND 串接的 = / != / in 條件） ----
+
+    def _search_ids(self, domain):
+        table = self._table
+        candidates = None
+        for field, operator, value in domain:
+            if isinstance(getattr(type(self), field, None), property):
+                continue
+            if operator == '=':
+                matches = table.index_for(field).get(value, set())
+            elif operator == 'in':
+                index = table.index_for(field)
+                matches = set().union(*(index.get(v, set()) for v in value)) if value else set()
+            else:
+                continue
+            candidates = set(matches) if candidates is None else candidates & matches
+        if candidates is None:
+            candidates = set(table.records)
+        result = []
+        for record_id in sorted(candidates):
+            record = table.records[record_id]
+            record['id'] = record_id
+            if all(self._match(record, term) for term in domain):
+                result.append(record_id)
+        return result
+
+    def _match(self, record, term):
+        field, operator, value = term
+        if field not in record:
+            # 關聯欄位（例如 provider_code）以記錄實際屬性計算
+            current = getattr(self.browse(record['id']), field)
+        else:
+            current = record.get(field)
+        if operator == '=':
+            return current == value
+        if operator == '!=':
+            return current != value
+        if operator == 'in':
+            return current in value
+        if operator == 'not in':
+            return current not in value
+        if operator == '<':
+            return current is not False and current < value
+        if operator == '>':
+            return current is not False and current > value
+        raise NotImplementedError(f'不支援的運算子: {operator}')
+
+    def search(self, domain, limit=None, order=None, offset=0):
+        ids = self._search_ids(domain)[offset:]
+        if limit:
+            ids = ids[:limit]
+        return self.browse(ids)
+
+    def search_count(self, domain, limit=None):
+        count = len(self._search_ids(domain))
+        return min(count, limit) if limit else count
+
+    # ---- payment 模組基底行為 ----
+
+    def _get_specific_rendering_values(self, processing_values):
+        return {}
+
+    def _get_tx_from_feedback_data(self, provider_code, notification_data):
+        return self.browse(())
+
+    def _process_notification_data(self, notification_data):
+        return None
+
+    def _send_refund_request(self, amount_to_refund=None):
+        return None
+
+    def _compute_feature_support_fields(self):
+        return None
+
+    def _get_default_payment_method_codes(self):
+        return set()
+
+    def _is_compatible_with_currency(self, currency):
+        return True
+
+    def _set_done(self, state_message=None):
+        self.write({'state': 'done', 'state_message': state_message or False})
+
+    def _set_pending(self, state_message=None):
+        self.write({'state': 'pending', 'state_message': state_message or False})
+
+    def _set_error(self, state_message=None):
+        self.write({'state': 'error', 'state_message': state_message or False})
+
+    def _set_canceled(self, state_message=None):
+        self.write({'state': 'cancel', 'state_message': state_message or False})
+
+    def _get_provider(self, code, raise_if_not_found=True):
+        provider = self.search([('code', '=', code)], limit=1)
+        if not provider and raise_if_not_found:
+            raise ValidationError(f'找不到提供者: {code}')
+        return provider
+
+
+class _ModelsModule(types.ModuleType):
+    """ `odoo.models` 替身 """
+
+    Model = Model
+    AbstractModel = Model
+    TransientModel = Model
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        # Constraint / Index / UniqueIndex 等資料表物件
+        return lambda *args, **kwargs: None
+
+
+class ConfigParameter(Model):
+    _name = 'ir.config_parameter'
+
+    def get_param(self, key, default=False):
+        return self.env.config_parameters.get(key, default)
+
+    def set_param(self, key, value):
+        self.env.config_parameters[key] = value
+        return True
+
+
+class Company(Model):
+    _name = 'res.company'
+    name = Field()
+
+
+class Partner(Model):
+    _name = 'res.partner'
+    name = Field()
+    email = Field()
+
+
+class TransactionStandin:
+    """ 交易列鎖與唯一性限制的記憶體版本（取代原生 SQL 的 `_newebpay_lock` 與 savepoint 寫入） """
+
+    def _newebpay_lock(self, skip_locked=False):
+        self.ensure_one()
+        return self.env.row_locks.acquire((self._model_name(), self.id), blocking=not skip_locked)
+
+    def _newebpay_store_merchant_order_no(self, merchant_order_no):
+        self.ensure_one()
+        if self.search_count([('newebpay_merchant_order_no', '=', merchant_order_no), ('id', '!=', self.id)]):
+            return False
+        self.newebpay_merchant_order_no = merchant_order_no
+        return True
+
+
+class LedgerStandin:
+    """ 通知冪等紀錄的記憶體版本（取代以原生 SQL 實作的 `_lookup` / `_record`） """
+
+    def _lookup(self, notification_data):
+        key = self._get_key(notification_data)
+        return self.env.ledger_rows.get(key) if key is not None else None
+
+    def _record(self, notification, tx, response):
+        key = self._get_key(notification)
+        if key is None or not getattr(notification, 'verified', True):
+            return
+        self.env.ledger_rows.setdefault(key, (tx.id, response))
+
+
+def _base_model(model_name, extra_fields):
+    namespace = {'_name': model_name}
+    namespace.update({name: Field(default=default) for name, default in extra_fields.items()})
+    return type(model_name.replace('.', '_'), (Model,), namespace)
+
+
+BaseProvider = _base_model('payment.provider', {
+    'name': False, 'code': False, 'state': 'enabled', 'company_id': False, 'write_date': False,
+})
+BaseTransaction = _base_model('payment.transaction', {
+    'reference': False, 'amount': 0.0, 'state': 'draft', 'state_message': False,
+    'provider_id': False, 'partner_id': False, 'create_date': False, 'company_id': False,
+    'currency_id': False,
+})
+BaseTransaction.provider_code = property(lambda self: self.provider_id.code if self.provider_id else False)
+
+
+def install():
+    """
+    將 Odoo 替身註冊到 `sys.modules` 並載入模組的模型
+
+    :return: 已註冊模型的 Environment
+    """
+    odoo = types.ModuleType('odoo')
+    odoo.__path__ = []
+    odoo_fields = _FieldsModule('odoo.fields')
+    odoo_api = _ApiModule('odoo.api')
+    odoo_models = _ModelsModule('odoo.models')
+    odoo_exceptions = types.ModuleType('odoo.exceptions')
+    odoo_exceptions.ValidationError = ValidationError
+    odoo_exceptions.UserError = UserError
+    odoo_exceptions.MissingError = MissingError
+    odoo_tools = types.ModuleType('odoo.tools')
+    odoo_tools.mute_logger = lambda *loggers: contextlib.nullcontext()
+    odoo_http = _HttpModule('odoo.http')
+    odoo_service = types.ModuleType('odoo.service')
+    odoo_service.__path__ = []
+    odoo_service_model = types.ModuleType('odoo.service.model')
+    odoo_service_model.PG_CONCURRENCY_EXCEPTIONS_TO_RETRY = (SerializationFailure,)
+    odoo_service.model = odoo_service_model
+    odoo_addons = types.ModuleType('odoo.addons')
+    odoo_addons.__path__ = []
+    addon = types.ModuleType(f'odoo.addons.{ADDON_NAME}')
+    addon.__path__ = [ADDON_DIR]
+
+    odoo.fields = odoo_fields
+    odoo.api = odoo_api
+    odoo.models = odoo_models
+    odoo.exceptions = odoo_exceptions
+    odoo.tools = odoo_tools
+    odoo.http = odoo_http
+    odoo.service = odoo_service
+    odoo.addons = odoo_addons
+    odoo._ = lambda text, *args: (text % args) if args else text
+    setattr(odoo_addons, ADDON_NAME, addon)
+
+    try:
+        import psycopg2  # noqa: F401
+    except ImportError:
+        psycopg2 = types.ModuleType('psycopg2')
+        psycopg2.IntegrityError = IntegrityError
+        sys.modules['psycopg2'] = psycopg2
+
+    sys.modules.update({
+        'odoo': odoo,
+        'odoo.fields': odoo_fields,
+        'odoo.api': odoo_api,
+        'odoo.models': odoo_models,
+        'odoo.exceptions': odoo_exceptions,
+        'odoo.tools': odoo_tools,
+        'odoo.http': odoo_http,
+        'odoo.service': odoo_service,
+        'odoo.service.model': odoo_service_model,
+        'odoo.addons': odoo_addons,
+        f'odoo.addons.{ADDON_NAME}': addon,
+    })
+
+    module_models = importlib.import_module(f'odoo.addons.{ADDON_NAME}.models')
+    env = Environment()
+    env.register('ir.config_parameter', ConfigParameter)
+    env.register('res.company', Company)
+    env.register('res.partner', Partner)
+    _register_inherited(env, module_models)
+    env.ledger_rows = {}
+    env.row_locks = RowLocks()
+    env.register('newebpay.notification.ledger', type(
+        'NewebPayNotificationLedger', (LedgerStandin, env.classes['newebpay.notification.ledger']), {}
+    ))
+    env.register('payment.transaction', type(
+        'PaymentTransaction', (TransactionStandin, env.classes['payment.transaction']), {}
+    ))
+    return env
+
+
+def load_controller():
+    """ 載入並建立 `NewebPayController`（需先呼叫 `install()`） """
+    module = importlib.import_module(f'odoo.addons.{ADDON_NAME}.controllers.newebpay_controller')
+    return module.NewebPayController()
+
+
+def _register_inherited(env, module_models):
+    """ 將模組中的模型類別與替身基底組合後註冊到環境 """
+    bases = {'payment.provider': BaseProvider, 'payment.transaction': BaseTransaction}
+    for submodule_name in dir(module_models):
+        submodule = getattr(module_models, submodule_name)
+        if not isinstance(submodule, types.ModuleType):
+            continue
+        for value in vars(submodule).values():
+            if not (isinstance(value, type) and issubclass(value, Model) and value is not Model):
+                continue
+            if value.__module__ != submodule.__name__:
+                continue
+            name = value._name or value._inherit
+            if value._inherit and not value._name:
+                # 以替身基底（或先前註冊的類別）作為父類別，讓 super() 呼叫落在替身的基底行為上
+                base = bases.get(name) or env.classes.get(name, Model)
+                value = type(value.__name__, (value, base), {})
+            env.register(name, value)
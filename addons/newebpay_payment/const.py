@@ -4,3 +4,97 @@
 DEFAULT_PAYMENT_METHOD_CODES = {
     'newebpay',
 }
+
+# 商店訂單編號（MerchantOrderNo）限制：最多 20 個字元，僅英數字
+MERCHANT_ORDER_NO_MAX_LENGTH = 20
+
+# 結帳設定（URL、固定 TradeInfo 欄位與付款方式）快取容量
+CHECKOUT_PROFILE_CACHE_SIZE = 256
+
+# 商店代號 → 提供者索引快取容量（以資料庫為單位）
+MERCHANT_INDEX_CACHE_SIZE = 64
+# 找不到商店代號時重新載入索引的最短間隔（秒）
+MERCHANT_INDEX_REFRESH_SECONDS = 30
+
+# 回調查詢交易用的行程內 LRU 快取容量（MerchantOrderNo → 交易 ID），設為 0 可停用
+TX_LOOKUP_CACHE_SIZE = 4096
+
+# 通知收件匣：每批處理筆數（可由系統參數 newebpay_payment.inbox_batch_size 覆寫）
+INBOX_BATCH_SIZE = 100
+# 通知收件匣：單筆通知最多處理次數
+INBOX_MAX_ATTEMPTS = 5
+# 通知收件匣：重試間隔（秒），第 n 次重試等待 基數 × 2^(n-1)，不超過上限
+INBOX_BACKOFF_SECONDS = 30
+INBOX_MAX_BACKOFF_SECONDS = 900
+# 通知收件匣：已處理通知的保留天數
+INBOX_RETENTION_DAYS = 30
+
+# 通知冪等紀錄：行程內快取容量
+LEDGER_CACHE_SIZE = 8192
+# 通知冪等紀錄：保留天數
+LEDGER_RETENTION_DAYS = 14
+
+# 批次退款：同時進行的退款請求上限
+BULK_REFUND_MAX_WORKERS = 8
+# 批次退款：每個商店代號每秒最多送出的退款請求數
+BULK_REFUND_RATE_PER_MERCHANT = 5
+# 批次退款：每寫回多少筆結果提交一次
+BULK_REFUND_COMMIT_SIZE = 50
+
+# 非同步退款佇列：每批送出的退款筆數
+REFUND_QUEUE_BATCH_SIZE = 50
+# 非同步退款佇列：單筆退款最多嘗試次數
+REFUND_QUEUE_MAX_ATTEMPTS = 6
+# 非同步退款佇列：重試間隔（秒），第 n 次重試等待 基數 × 2^(n-1)，不超過上限
+REFUND_QUEUE_BACKOFF_SECONDS = 60
+REFUND_QUEUE_MAX_BACKOFF_SECONDS = 3600
+# 非同步退款佇列：送出前先提交的嘗試紀錄延後下次嘗試的秒數（工作者中斷時，逾時後改走查詢確認）
+REFUND_QUEUE_CLAIM_SECONDS = 900
+# 非同步退款佇列：已完成退款的保留天數
+REFUND_QUEUE_RETENTION_DAYS = 90
+# newebpay_refund_status 的本模組狀態（其餘值為藍新金流回傳的 Status）
+REFUND_STATUS_QUEUED = 'QUEUED'
+REFUND_STATUS_RETRYING = 'RETRYING'
+REFUND_STATUS_SUCCESS = 'SUCCESS'
+REFUND_STATUS_ERROR = 'ERROR'
+
+# 交易封存：終態交易超過幾天後封存（可由系統參數 newebpay_payment.archive_after_days 覆寫）
+ARCHIVE_AFTER_DAYS = 365
+# 交易封存：每批封存筆數
+ARCHIVE_BATCH_SIZE = 500
+# 交易封存：單次排程最多封存筆數
+ARCHIVE_MAX_PER_RUN = 20000
+
+# 付款統計：一致性檢查排程比對的天數
+STATS_CHECK_DAYS = 30
+
+# 待付款交易對帳：每頁查詢筆數
+RECONCILE_PAGE_SIZE = 200
+# 待付款交易對帳：同時進行的查詢請求上限
+RECONCILE_MAX_WORKERS = 8
+# 查詢交易 API 的 TradeStatus
+TRADE_STATUS_UNPAID = '0'
+TRADE_STATUS_PAID = '1'
+TRADE_STATUS_FAILED = '2'
+TRADE_STATUS_CANCELED = '3'
+TRADE_STATUS_REFUNDED = '6'
+
+# 對帳檔匯入：每個比對區塊的行數
+SETTLEMENT_CHUNK_SIZE = 1000
+# 對帳檔交易狀態 → 預期的 payment.transaction 狀態（退款不改變原交易狀態）
+SETTLEMENT_STATUS_STATES = {
+    TRADE_STATUS_PAID: ('done',),
+    'SUCCESS': ('done',),
+    '成功': ('done',),
+    '付款成功': ('done',),
+    '已付款': ('done',),
+    TRADE_STATUS_FAILED: ('error',),
+    '失敗': ('error',),
+    '付款失敗': ('error',),
+    TRADE_STATUS_CANCELED: ('cancel',),
+    '取消': ('cancel',),
+    '已取消': ('cancel',),
+    TRADE_STATUS_REFUNDED: ('done',),
+    '退款': ('done',),
+    '已退款': ('done',),
+}
@@ -2,10 +2,20 @@
 
 from odoo import http
 from odoo.http import request
+from odoo.service.model import PG_CONCURRENCY_EXCEPTIONS_TO_RETRY
+import hmac
 import logging
 
+from ..utils import metrics, tracing
+from ..utils.admission import DEFAULT_BURST_PER_IP, DEFAULT_RATE_PER_IP, REJECT_THROTTLED, default_admission
+from ..utils.crypto import NewebPayCrypto
+from ..utils.notification import NewebPayNotification
+
 _logger = logging.getLogger(__name__)
 
+# 並行衝突（例如等待交易列鎖定後的序列化失敗）不可吞掉，交由 Odoo 回滾並重試整個請求
+_CONCURRENCY_ERRORS = PG_CONCURRENCY_EXCEPTIONS_TO_RETRY
+
 # 導入支付後處理控制器以設置交易監控
 try:
     from odoo.addons.payment.controllers.post_processing import PaymentPostProcessing
@@ -17,75 +27,294 @@ except ImportError:
 class NewebPayController(http.Controller):
     """ 藍新金流控制器，處理支付回調和返回頁面 """
 
-    @http.route('/payment/newebpay/return', type='http', auth='none', csrf=False, methods=['GET', 'POST'], website=True)
+    @staticmethod
+    def _decode_notification(post):
+        """ 將回調資料解碼為 NewebPayNotification，每個請求只解碼一次 """
+        return request.env['payment.transaction'].sudo()._newebpay_decode_notification(post)
+
+    @staticmethod
+    def _get_processed_outcome(post):
+        """ 查詢冪等紀錄，重複的通知回傳 (交易 ID, 回應內容)，否則回傳 None """
+        return request.env['newebpay.notification.ledger'].sudo()._lookup(post)
+
+    @staticmethod
+    def _record_processed(notification, tx, response):
+        """ 將成功處理的通知寫入冪等紀錄 """
+        request.env['newebpay.notification.ledger'].sudo()._record(notification, tx, response)
+
+    @staticmethod
+    def _enqueue_notification(provider, post):
+        """ 驗證通知簽名後寫入收件匣（准入檢查已驗證時沿用結果），交易處理交由排程執行 """
+        trade_info = post.get('TradeInfo')
+        trade_sha = post.get('TradeSha')
+        if not trade_info or not trade_sha:
+            _logger.error('回調資料中缺少 TradeInfo 或 TradeSha')
+            return '0|回調資料不完整'
+        hash_key, hash_iv = provider.newebpay_hash_key, provider.newebpay_hash_iv
+        verified = isinstance(post, NewebPayNotification) and post.is_verified_with(hash_key, hash_iv)
+        if not verified and not NewebPayCrypto.verify_trade_sha(trade_info, trade_sha, hash_key, hash_iv):
+            _logger.warning('藍新金流通知簽名驗證失敗，不寫入收件匣')
+            return '0|簽名驗證失敗'
+        request.env['newebpay.notification.inbox'].sudo()._enqueue(provider, post)
+        _logger.info('藍新金流通知已寫入收件匣')
+        return '1|OK'
+
+    @staticmethod
+    def _load_admission_keys():
+        """ 載入所有啟用中藍新金流提供者的 (商店代號, Hash Key, Hash IV)（只在准入金鑰快取未命中時呼叫） """
+        index = request.env['payment.provider'].sudo()._newebpay_get_merchant_index(refresh=True)
+        return [
+            (merchant_id, hash_key, hash_iv)
+            for merchant_id, entries in index.items()
+            for _provider_id, hash_key, hash_iv in entries
+        ]
+
+    @staticmethod
+    def _configure_admission():
+        """
+        套用系統參數的來源 IP 限流設定（`get_param` 有快取，設定未變更時不查詢資料庫）
+
+        `newebpay_payment.callback_rate_per_ip`：每個來源 IP 每秒允許的未通過檢查請求數（0 表示不限流）；
+        `newebpay_payment.callback_burst_per_ip`：每個來源 IP 允許累積的未通過檢查請求數。
+        """
+        get_param = request.env['ir.config_parameter'].sudo().get_param
+        try:
+            rate = float(get_param('newebpay_payment.callback_rate_per_ip', DEFAULT_RATE_PER_IP))
+            burst = float(get_param('newebpay_payment.callback_burst_per_ip', DEFAULT_BURST_PER_IP))
+        except (TypeError, ValueError):
+            rate, burst = DEFAULT_RATE_PER_IP, DEFAULT_BURST_PER_IP
+        default_admission.configure(rate, burst)
+
+    @classmethod
+    def _admit(cls, route, post):
+        """
+        前置准入檢查（限流、格式、簽名），金鑰快取命中時不存取資料庫
+
+        載入設定或金鑰失敗時拋出例外，由呼叫端依路由回應（與處理回調時的錯誤處理相同）。
+
+        :return: (拒絕原因, 通知資料)；通過時拒絕原因為 None，通知資料帶有簽名驗證結果，後續解碼不再重複驗證
+        """
+        cls._configure_admission()
+        remote_addr = request.httprequest.remote_addr
+        reason, verified_key = default_admission.admit(request.db, remote_addr, post, cls._load_admission_keys)
+        if reason:
+            metrics.ADMISSION_REJECTED.inc(route, reason)
+            _logger.debug('藍新金流回調未通過准入檢查 - 路由: %s, 原因: %s, 來源: %s', route, reason, remote_addr)
+            return reason, post
+        return None, NewebPayNotification.admitted(post, verified_key)
+
+    @staticmethod
+    def _instrumented(route, handler, post):
+        """ 執行回調處理並記錄耗時與處理中的請求數 """
+        metrics.IN_FLIGHT.inc(route)
+        try:
+            with tracing.span(route):
+                return handler(post)
+        finally:
+            metrics.IN_FLIGHT.dec(route)
+
+    # 不經過網站路由（只需驗證後重新導向到狀態頁面）
+    @http.route('/payment/newebpay/return', type='http', auth='none', csrf=False, methods=['GET', 'POST'])
     def newebpay_return(self, **post):
-        """ 處理藍新金流的返回頁面 """
+        """
+        處理藍新金流的返回頁面
+
+        交易狀態以伺服器通知為準：通知已套用或正在處理（交易列已被鎖定）時只重新導向到狀態頁面，
+        通知尚未到達時才由此完整處理。
+        """
+        try:
+            reason, post = self._admit('return', post)
+        except _CONCURRENCY_ERRORS:
+            raise
+        except Exception as e:
+            metrics.CALLBACKS.inc('return', 'error')
+            _logger.error('藍新金流返回請求准入檢查發生錯誤: %s', str(e), exc_info=True)
+            return request.redirect('/payment/status')
+        if reason:
+            return request.redirect('/payment/status')
+        return self._instrumented('return', self._handle_return, post)
+
+    def _handle_return(self, post):
         try:
             _logger.info('===== 收到藍新金流返回請求 =====')
-            _logger.info('POST 資料: %s', post)
-            _logger.info('GET 參數: %s', request.httprequest.args)
+            tracing.capture('return', post, 'POST 資料')
             
+            # 已處理過的通知（例如伺服器通知已先到達）直接導向狀態頁面
+            outcome = self._get_processed_outcome(post)
+            if outcome:
+                _logger.info('重複的藍新金流回調，略過處理 - 交易 ID: %s', outcome[0])
+                metrics.CALLBACKS.inc('return', 'duplicate')
+                tx = request.env['payment.transaction'].sudo().browse(outcome[0]).exists()
+                return self._redirect_to_status(tx) if tx else request.redirect('/payment/status')
+
+            # 解碼回調資料（驗證簽名與解密各一次），並在後續查詢與處理中共用
+            notification = self._decode_notification(post)
+
             # 取得交易記錄
-            tx = request.env['payment.transaction'].sudo()._get_tx_from_feedback_data('newebpay', post)
+            tx = request.env['payment.transaction'].sudo()._get_tx_from_feedback_data('newebpay', notification)
             if not tx:
-                _logger.error('找不到對應的交易記錄 - 回調資料: %s', post)
+                _logger.error('找不到對應的交易記錄 - 回調資料: %s', tracing.redact(post))
+                metrics.CALLBACKS.inc('return', 'not_found')
                 # 重定向到支付狀態頁面（顯示支付未找到）
                 return request.redirect('/payment/status')
             
             _logger.info('找到交易記錄 - 交易編號: %s', tx.reference)
-            
-            # 處理通知資料
+
+            # 伺服器通知正在處理（不等待鎖定）或已套用時，只重新導向
+            if not tx._newebpay_lock(skip_locked=True):
+                _logger.info('伺服器通知處理中，返回頁面直接重新導向 - 交易編號: %s', tx.reference)
+                metrics.CALLBACKS.inc('return', 'in_flight')
+                return self._redirect_to_status(tx)
+            if tx._newebpay_notification_applied(notification) or self._get_processed_outcome(post):
+                metrics.CALLBACKS.inc('return', 'duplicate')
+                return self._redirect_to_status(tx)
+
+            # 處理通知資料（伺服器通知尚未到達）
             try:
-                tx._process_notification_data(post)
+                tx._process_notification_data(notification)
+                self._record_processed(notification, tx, '1|OK')
+                metrics.CALLBACKS.inc('return', 'processed')
                 _logger.info('交易通知處理完成 - 交易編號: %s, 狀態: %s', tx.reference, tx.state)
+            except _CONCURRENCY_ERRORS:
+                raise
             except Exception as e:
+                metrics.CALLBACKS.inc('return', 'error')
                 _logger.error('處理交易通知時發生錯誤 - 交易編號: %s, 錯誤: %s', tx.reference, str(e), exc_info=True)
-            
-            # 設置交易監控，以便支付狀態頁面可以找到交易
-            if PaymentPostProcessing:
-                try:
-                    PaymentPostProcessing.monitor_transaction(tx)
-                    _logger.info('交易已設置監控 - 交易編號: %s', tx.reference)
-                except Exception as e:
-                    _logger.warning('設置交易監控時發生錯誤: %s', str(e))
-            
+
             # 重導向到確認頁面
-            return request.redirect('/payment/status')
-            
+            return self._redirect_to_status(tx)
+
+        except _CONCURRENCY_ERRORS:
+            _logger.info('藍新金流返回請求發生並行衝突，交由 Odoo 重試')
+            raise
         except Exception as e:
+            metrics.CALLBACKS.inc('return', 'error')
             _logger.error('處理藍新金流返回時發生錯誤: %s', str(e), exc_info=True)
             # 發生錯誤時重定向到支付狀態頁面
             return request.redirect('/payment/status')
 
+    @staticmethod
+    def _redirect_to_status(tx):
+        """ 設置交易監控（讓支付狀態頁面可以找到交易）並重新導向到支付狀態頁面 """
+        if PaymentPostProcessing:
+            try:
+                PaymentPostProcessing.monitor_transaction(tx)
+                _logger.info('交易已設置監控 - 交易編號: %s', tx.reference)
+            except Exception as e:
+                _logger.warning('設置交易監控時發生錯誤: %s', str(e))
+        return request.redirect('/payment/status')
+
     @http.route('/payment/newebpay/notify', type='http', auth='none', csrf=False, methods=['POST'], save_session=False)
     def newebpay_notify(self, **post):
         """ 處理藍新金流的伺服器端通知（Server to Server） """
+        try:
+            reason, post = self._admit('notify', post)
+        except _CONCURRENCY_ERRORS:
+            raise
+        except Exception as e:
+            metrics.CALLBACKS.inc('notify', 'error')
+            _logger.error('藍新金流伺服器通知准入檢查發生錯誤: %s', str(e), exc_info=True)
+            return f'0|系統錯誤: {str(e)}'
+        if reason == REJECT_THROTTLED:
+            return request.make_response('0|請求過於頻繁', status=429)
+        if reason:
+            return '0|回調資料驗證失敗'
+        return self._instrumented('notify', self._handle_notify, post)
+
+    def _handle_notify(self, post):
         try:
             _logger.info('===== 收到藍新金流伺服器通知 =====')
-            _logger.info('POST 資料: %s', post)
+            tracing.capture('notify', post, 'POST 資料')
             
+            # 重複的通知直接回傳原結果，不再解密與處理
+            outcome = self._get_processed_outcome(post)
+            if outcome:
+                _logger.info('重複的藍新金流通知，略過處理 - 交易 ID: %s', outcome[0])
+                metrics.CALLBACKS.inc('notify', 'duplicate')
+                return outcome[1]
+
+            # 非同步模式：只驗證簽名並寫入收件匣，立即回應
+            provider = request.env['payment.provider'].sudo()._newebpay_get_notification_provider(post)
+            if provider and provider.newebpay_async_notify:
+                response = self._enqueue_notification(provider, post)
+                metrics.CALLBACKS.inc('notify', 'queued' if response == '1|OK' else 'rejected')
+                return response
+
+            # 解碼回調資料（驗證簽名與解密各一次），並在後續查詢與處理中共用
+            notification = self._decode_notification(post)
+
             # 取得交易記錄
-            tx = request.env['payment.transaction'].sudo()._get_tx_from_feedback_data('newebpay', post)
+            tx = request.env['payment.transaction'].sudo()._get_tx_from_feedback_data('newebpay', notification)
             if not tx:
-                _logger.error('找不到對應的交易記錄 - 回調資料: %s', post)
+                _logger.error('找不到對應的交易記錄 - 回調資料: %s', tracing.redact(post))
+                metrics.CALLBACKS.inc('notify', 'not_found')
                 return '0|找不到交易記錄'
             
             _logger.info('找到交易記錄 - 交易編號: %s', tx.reference)
-            
+
+            # 鎖定交易列（等待正在處理同一筆交易的返回頁面或重送的通知）；
+            # 取得鎖定後若結果已由其他請求套用，視為重複通知。持有鎖定的請求已提交時
+            # 會發生序列化失敗，由 Odoo 重試整個請求
+            tx._newebpay_lock()
+            outcome = self._get_processed_outcome(post)
+            if outcome:
+                metrics.CALLBACKS.inc('notify', 'duplicate')
+                return outcome[1]
+            if tx._newebpay_notification_applied(notification):
+                _logger.info('通知結果已套用，略過處理 - 交易編號: %s', tx.reference)
+                self._record_processed(notification, tx, '1|OK')
+                metrics.CALLBACKS.inc('notify', 'duplicate')
+                return '1|OK'
+
             # 處理通知資料
             try:
-                tx._process_notification_data(post)
+                tx._process_notification_data(notification)
+                self._record_processed(notification, tx, '1|OK')
+                metrics.CALLBACKS.inc('notify', 'processed')
                 _logger.info('交易通知處理完成 - 交易編號: %s, 狀態: %s', tx.reference, tx.state)
                 
                 # 回傳成功訊息給藍新金流（格式：1|OK）
                 return '1|OK'
                 
+            except _CONCURRENCY_ERRORS:
+                raise
             except Exception as e:
+                metrics.CALLBACKS.inc('notify', 'error')
                 _logger.error('處理交易通知時發生錯誤 - 交易編號: %s, 錯誤: %s', tx.reference, str(e), exc_info=True)
                 # 即使處理失敗，也要回傳失敗訊息給藍新金流（格式：0|錯誤訊息）
                 return f'0|處理錯誤: {str(e)}'
                 
+        except _CONCURRENCY_ERRORS:
+            # 例如等待鎖定期間返回頁面已提交同一筆交易：重試時會視為重複通知
+            _logger.info('藍新金流伺服器通知發生並行衝突，交由 Odoo 重試')
+            raise
         except Exception as e:
+            metrics.CALLBACKS.inc('notify', 'error')
             _logger.error('處理藍新金流伺服器通知時發生錯誤: %s', str(e), exc_info=True)
             return f'0|系統錯誤: {str(e)}'
 
+    @http.route('/payment/newebpay/metrics', type='http', auth='none', csrf=False, methods=['GET'], save_session=False)
+    def newebpay_metrics(self, **kwargs):
+        """
+        以 Prometheus 文字格式輸出藍新金流指標（合併所有 worker）
+
+        需設定系統參數 `newebpay_payment.metrics_token`，並以 `Authorization: Bearer <token>` 存取；
+        未設定時一律拒絕（反向代理後的請求來源都像是本機，不能以來源 IP 判斷）。
+        """
+        if not self._metrics_access_allowed():
+            return request.make_response('Forbidden', status=403)
+        return request.make_response(
+            metrics.registry.render(),
+            headers=[('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')],
+        )
+
+    @staticmethod
+    def _metrics_access_allowed():
+        try:
+            token = request.env['ir.config_parameter'].sudo().get_param('newebpay_payment.metrics_token')
+        except Exception:
+            token = None
+        if not token:
+            return False
+        authorization = request.httprequest.headers.get('Authorization', '')
+        return hmac.compare_digest(authorization.encode(), f'Bearer {token}'.encode())
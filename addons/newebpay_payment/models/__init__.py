@@ -2,4 +2,9 @@
 
 from . import payment_provider
 from . import payment_transaction
-
+from . import newebpay_notification_inbox
+from . import newebpay_notification_ledger
+from . import newebpay_refund_queue
+from . import newebpay_transaction_archive
+from . import newebpay_payment_stats
+from . import newebpay_settlement_import
@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+
+import datetime
+import json
+import logging
+import threading
+
+from odoo import models, fields, api
+
+from odoo.addons.newebpay_payment import const
+
+_logger = logging.getLogger(__name__)
+
+
+class NewebPayNotificationInbox(models.Model):
+    """ 藍新金流伺服器通知收件匣：通知端點只驗證簽名並寫入此表，由排程批次處理 """
+    _name = 'newebpay.notification.inbox'
+    _description = '藍新金流通知收件匣'
+    _order = 'id'
+
+    provider_id = fields.Many2one(
+        'payment.provider',
+        string='支付提供者',
+        required=True,
+        ondelete='cascade',
+    )
+    payload = fields.Text(
+        string='原始通知資料',
+        required=True,
+        help='通知端點收到的 POST 資料（JSON）'
+    )
+    state = fields.Selection(
+        [
+            ('pending', '待處理'),
+            ('done', '已處理'),
+            ('error', '錯誤'),
+        ],
+        string='狀態',
+        default='pending',
+        required=True,
+        index=True,
+    )
+    attempts = fields.Integer(string='處理次數', default=0)
+    next_attempt_at = fields.Datetime(string='下次嘗試時間', default=fields.Datetime.now, required=True)
+    error_message = fields.Text(string='錯誤訊息')
+    transaction_id = fields.Many2one(
+        'payment.transaction',
+        string='交易',
+        ondelete='set null',
+    )
+    processed_at = fields.Datetime(string='處理時間')
+
+    @api.model
+    def _enqueue(self, provider, notification_data):
+        """
+        將已通過簽名驗證的通知寫入收件匣
+
+        :param provider: payment.provider 記錄
+        :param notification_data: 回調的 POST 資料
+        :return: newebpay.notification.inbox 記錄
+        """
+        return self.create({
+            'provider_id': provider.id,
+            'payload': json.dumps(dict(notification_data), ensure_ascii=False),
+        })
+
+    @api.model
+    def _get_batch_size(self):
+        """ 取得每批處理筆數（系統參數 `newebpay_payment.inbox_batch_size`） """
+        batch_size = self.env['ir.config_parameter'].sudo().get_param(
+            'newebpay_payment.inbox_batch_size',
+            const.INBOX_BATCH_SIZE,
+        )
+        try:
+            return max(int(batch_size), 1)
+        except (TypeError, ValueError):
+            return const.INBOX_BATCH_SIZE
+
+    def _lock_pending_batch(self, batch_size):
+        """
+        鎖定一批待處理的通知
+
+        使用 `FOR UPDATE SKIP LOCKED`，讓多個排程工作者可同時消化收件匣而不互相等待；
+        處理失敗的通知等到下次嘗試時間才會再被選出。
+        """
+        self.env.cr.execute("""
+            SELECT id
+              FROM newebpay_notification_inbox
+             WHERE state = 'pending'
+               AND attempts < %s
+               AND next_attempt_at <= %s
+          ORDER BY next_attempt_at, id
+             LIMIT %s
+               FOR UPDATE SKIP LOCKED
+        """, (const.INBOX_MAX_ATTEMPTS, fields.Datetime.now(), batch_size))
+        return self.browse([row[0] for row in self.env.cr.fetchall()])
+
+    @api.model
+    def _cron_process_inbox(self, max_batches=None):
+        """
+        排程：分批處理收件匣中的通知，每批處理完即提交
+
+        :param max_batches: 最多處理的批數（未指定時處理到收件匣清空為止）
+        :return: 本次處理的通知筆數
+        """
+        batch_size = self._get_batch_size()
+        testing = getattr(threading.current_thread(), 'testing', False)
+        processed = 0
+        batches = 0
+        while max_batches is None or batches < max_batches:
+            entries = self._lock_pending_batch(batch_size)
+            if not entries:
+                break
+            for entry in entries:
+                entry._process_entry()
+            processed += len(entries)
+            batches += 1
+            if not testing:
+                self.env.cr.commit()
+        if processed:
+            _logger.info('藍新金流通知收件匣處理完成 - 筆數: %s, 批數: %s', processed, batches)
+        return processed
+
+    def _process_entry(self):
+        """ 處理單筆通知：解碼、查詢交易並套用通知資料（於 savepoint 中執行） """
+        self.ensure_one()
+        Transaction = self.env['payment.transaction'].sudo()
+        values = {'attempts': self.attempts + 1, 'processed_at': fields.Datetime.now()}
+        try:
+            with self.env.cr.savepoint():
+                notification_data = json.loads(self.payload)
+                # 收件匣中可能有重複的通知，已處理過的直接標記完成
+                outcome = self.env['newebpay.notification.ledger']._lookup(notification_data)
+                if outcome:
+                    self.write(dict(values, state='done', transaction_id=outcome[0], error_message=False))
+                    return
+                notification = Transaction._newebpay_decode_notification(
+                    notification_data, provider=self.provider_id
+                )
+                tx = Transaction._get_tx_from_feedback_data('newebpay', notification)
+                if not tx:
+                    values.update(state='error', error_message='找不到對應的交易記錄')
+                else:
+                    # 與返回頁面、通知端點共用交易列鎖；結果已由其他請求套用時不重複處理
+                    tx._newebpay_lock()
+                    if not tx._newebpay_notification_applied(notification):
+                        tx._process_notification_data(notification)
+                    self.env['newebpay.notification.ledger']._record(notification, tx, '1|OK')
+                    values.update(state='done', transaction_id=tx.id, error_message=False)
+        except Exception as e:
+            _logger.error('處理藍新金流收件匣通知失敗 - ID: %s, 錯誤: %s', self.id, str(e), exc_info=True)
+            values['error_message'] = str(e)
+            if values['attempts'] < const.INBOX_MAX_ATTEMPTS:
+                # 尚未超過重試次數時保留為待處理，以指數退避安排下一次處理
+                delay = min(
+                    const.INBOX_BACKOFF_SECONDS * 2 ** (values['attempts'] - 1),
+                    const.INBOX_MAX_BACKOFF_SECONDS,
+                )
+                values.update(
+                    state='pending',
+                    next_attempt_at=values['processed_at'] + datetime.timedelta(seconds=delay),
+                )
+            else:
+                values['state'] = 'error'
+        self.write(values)
+
+    @api.autovacuum
+    def _gc_processed_entries(self):
+        """ 自動清理已處理完成且超過保留天數的通知 """
+        limit_date = fields.Datetime.subtract(fields.Datetime.now(), days=const.INBOX_RETENTION_DAYS)
+        self.search([('state', '=', 'done'), ('processed_at', '<', limit_date)]).unlink()
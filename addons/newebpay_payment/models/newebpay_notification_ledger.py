@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+
+import logging
+
+from odoo import models, fields, api
+
+from odoo.addons.newebpay_payment import const
+from ..utils.cache import LRUCache
+
+_logger = logging.getLogger(__name__)
+
+# (資料庫名稱, TradeSha, Status) → (交易 ID, 回應內容)
+_ledger_cache = LRUCache(const.LEDGER_CACHE_SIZE)
+
+
+class NewebPayNotificationLedger(models.Model):
+    """
+    藍新金流通知冪等紀錄
+
+    藍新金流會重送伺服器通知，瀏覽器返回頁面也會帶著相同資料。
+    通知處理成功後以 (TradeSha, Status) 記錄結果，重複的通知在解密與 ORM 查詢前即直接回傳原結果。
+    TradeNo 位於加密的 TradeInfo 中，僅作為紀錄保存；TradeSha 本身即為整份 TradeInfo 的摘要。
+    """
+    _name = 'newebpay.notification.ledger'
+    _description = '藍新金流通知冪等紀錄'
+    _order = 'id desc'
+
+    trade_sha = fields.Char(string='TradeSha', required=True, readonly=True)
+    status = fields.Char(string='狀態', readonly=True)
+    trade_no = fields.Char(string='藍新交易序號', readonly=True)
+    transaction_id = fields.Many2one(
+        'payment.transaction',
+        string='交易',
+        readonly=True,
+        ondelete='cascade',
+    )
+    response = fields.Char(string='回應內容', readonly=True)
+
+    _trade_sha_status_unique = models.Constraint(
+        'UNIQUE(trade_sha, status)',
+        '相同的通知只能記錄一次',
+    )
+
+    @api.model
+    def _get_key(self, notification_data):
+        """
+        取得通知的冪等鍵（只使用明文欄位，不需解密）
+
+        :return: (TradeSha, Status)，缺少 TradeSha 時回傳 None
+        """
+        trade_sha = notification_data.get('TradeSha')
+        if not trade_sha:
+            return None
+        return trade_sha.upper(), notification_data.get('Status') or ''
+
+    @api.model
+    def _lookup(self, notification_data):
+        """
+        查詢通知是否已處理過
+
+        先查行程內快取，再以唯一索引查詢資料表。
+
+        :param notification_data: 回調的 POST 資料
+        :return: (交易 ID, 回應內容)；未處理過時回傳 None
+        """
+        key = self._get_key(notification_data)
+        if key is None:
+            return None
+        cache_key = (self.env.cr.dbname, *key)
+        outcome = _ledger_cache.get(cache_key)
+        if outcome is not None:
+            return outcome
+
+        self.env.cr.execute("""
+            SELECT transaction_id, response
+              FROM newebpay_notification_ledger
+             WHERE trade_sha = %s AND status = %s
+        """, key)
+        row = self.env.cr.fetchone()
+        if row is None:
+            return None
+        outcome = (row[0], row[1])
+        _ledger_cache.set(cache_key, outcome)
+        return outcome
+
+    @api.model
+    def _record(self, notification, tx, response):
+        """
+        記錄已成功處理的通知
+
+        :param notification: 回調資料（NewebPayNotification 或 POST 字典）
+        :param tx: 對應的 payment.transaction 記錄
+        :param response: 回傳給藍新金流的內容
+        """
+        key = self._get_key(notification)
+        if key is None or not getattr(notification, 'verified', True):
+            return
+        trade_info = getattr(notification, 'trade_info', None) or {}
+        self.env.cr.execute("""
+            INSERT INTO newebpay_notification_ledger
+                        (trade_sha, status, trade_no, transaction_id, response,
+                         create_uid, create_date, write_uid, write_date)
+                 VALUES (%s, %s, %s, %s, %s, %s, now() at time zone 'UTC', %s, now() at time zone 'UTC')
+            ON CONFLICT (trade_sha, status) DO NOTHING
+        """, (*key, trade_info.get('TradeNo'), tx.id, response, self.env.uid, self.env.uid))
+        # 交易提交後才寫入快取，避免回滾後仍被視為已處理
+        cache_key = (self.env.cr.dbname, *key)
+        outcome = (tx.id, response)
+        self.env.cr.postcommit.add(lambda: _ledger_cache.set(cache_key, outcome))
+
+    @api.autovacuum
+    def _gc_expired_entries(self):
+        """ 自動清理超過保留天數的紀錄（藍新金流不會重送超過保留期限的通知） """
+        self.env.cr.execute("""
+            DELETE FROM newebpay_notification_ledger
+                  WHERE create_date < now() at time zone 'UTC' - make_interval(days => %s)
+        """, (const.LEDGER_RETENTION_DAYS,))
+        if self.env.cr.rowcount:
+            _logger.info('已清理藍新金流通知冪等紀錄 - 筆數: %s', self.env.cr.rowcount)
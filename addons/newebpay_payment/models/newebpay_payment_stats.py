@@ -0,0 +1,291 @@
+# -*- coding: utf-8 -*-
+
+import contextlib
+import logging
+from collections import defaultdict
+
+from odoo import models, fields, api
+
+from odoo.addons.newebpay_payment import const
+
+_logger = logging.getLogger(__name__)
+
+# 統計值欄位（順序與 `_get_tx_values` 回傳值相同）
+_MEASURES = ('tx_count', 'amount_gross', 'amount_refunded', 'failure_count')
+
+
+def _is_zero(values):
+    count, gross, refunded, failures = values
+    return not count and not failures and abs(gross) < 0.005 and abs(refunded) < 0.005
+
+
+class NewebPayPaymentStats(models.Model):
+    """
+    藍新金流每日付款統計
+
+    依交易建立日期、支付提供者、支付方式與狀態彙總筆數、金額、退款金額與失敗筆數，
+    報表直接讀取此表，不需對整個 `payment.transaction` 做 read_group。
+
+    狀態轉換時只新增差異列（例如 pending -1、done +1），同一組維度的並行回調不會更新同一列而互相衝突；
+    排程定期將同一組維度的差異列合併為一列。任何時候以 SUM 彙總的結果都正確。
+    草稿交易（尚未付款）不列入統計。
+    """
+    _name = 'newebpay.payment.stats'
+    _description = '藍新金流每日付款統計'
+    _order = 'date desc, provider_id, payment_type, state'
+
+    date = fields.Date(string='日期', required=True, index=True, readonly=True)
+    provider_id = fields.Many2one(
+        'payment.provider',
+        string='支付提供者',
+        required=True,
+        ondelete='cascade',
+        readonly=True,
+    )
+    payment_type = fields.Char(string='支付方式', readonly=True)
+    state = fields.Selection(
+        [
+            ('pending', '處理中'),
+            ('authorized', '已授權'),
+            ('done', '已完成'),
+            ('cancel', '已取消'),
+            ('error', '錯誤'),
+        ],
+        string='狀態',
+        required=True,
+        readonly=True,
+    )
+    tx_count = fields.Integer(string='交易筆數', readonly=True)
+    amount_gross = fields.Float(string='交易金額', readonly=True)
+    amount_refunded = fields.Float(string='退款金額', readonly=True)
+    failure_count = fields.Integer(string='失敗筆數', readonly=True)
+
+    # ---- 增量更新 ----
+
+    @api.model
+    def _get_tx_key(self, tx):
+        """
+        交易所屬的統計維度
+
+        :return: (日期, 提供者 ID, 支付方式, 狀態)；不列入統計時為 None
+        """
+        if tx.provider_code != 'newebpay' or tx.state == 'draft':
+            return None
+        create_date = tx.create_date or fields.Datetime.now()
+        return (create_date.date(), tx.provider_id.id, tx.newebpay_payment_type or '', tx.state)
+
+    @api.model
+    def _get_tx_values(self, tx):
+        """ 交易對統計值的貢獻：(筆數, 金額, 退款金額, 失敗筆數) """
+        return (1, tx.amount, tx.newebpay_refunded_amount or 0.0, 1 if tx.state == 'error' else 0)
+
+    @api.model
+    def _snapshot(self, transactions):
+        """ 記錄交易目前的統計維度與統計值 """
+        snapshot = {}
+        for tx in transactions:
+            key = self._get_tx_key(tx)
+            if key is not None:
+                snapshot[tx.id] = (key, self._get_tx_values(tx))
+        return snapshot
+
+    @api.model
+    @contextlib.contextmanager
+    def _track(self, transactions):
+        """
+        記錄區塊內交易狀態、支付方式或退款金額的變化並寫入差異列
+
+        區塊拋出例外時不寫入（資料庫交易會一併回滾）。
+
+        :param transactions: payment.transaction 記錄集
+        """
+        before = self._snapshot(transactions)
+        yield
+        self._add_deltas(before, self._snapshot(transactions))
+
+    @api.model
+    def _add_deltas(self, before, after):
+        """ 依前後快照計算各統計維度的差異並新增差異列 """
+        deltas = defaultdict(lambda: [0, 0.0, 0.0, 0])
+        for snapshot, sign in ((before, -1), (after, 1)):
+            for key, values in snapshot.values():
+                delta = deltas[key]
+                for index, value in enumerate(values):
+                    delta[index] += sign * value
+        vals_list = []
+        for (date, provider_id, payment_type, state), delta in deltas.items():
+            if _is_zero(delta):
+                continue
+            vals = dict(zip(_MEASURES, delta))
+            vals.update(date=date, provider_id=provider_id, payment_type=payment_type or False, state=state)
+            vals_list.append(vals)
+        if vals_list:
+            self.sudo().create(vals_list)
+
+    @api.model
+    def _cron_compact(self):
+        """
+        排程：將同一組維度的差異列合併為一列（統計值全為零的組合直接刪除）
+
+        只新增列的交易可與合併同時進行：合併只刪除查詢當下已提交的列。
+
+        :return: 合併前的列數
+        """
+        self.env.cr.execute("""
+            WITH groups AS (
+                SELECT date, provider_id, COALESCE(payment_type, '') AS payment_type, state
+                  FROM newebpay_payment_stats
+              GROUP BY 1, 2, 3, 4
+                HAVING COUNT(*) > 1
+            ), deleted AS (
+                DELETE FROM newebpay_payment_stats stats
+                 USING groups
+                 WHERE stats.date = groups.date
+                   AND stats.provider_id = groups.provider_id
+                   AND COALESCE(stats.payment_type, '') = groups.payment_type
+                   AND stats.state = groups.state
+             RETURNING stats.date, stats.provider_id, COALESCE(stats.payment_type, '') AS payment_type, stats.state,
+                       stats.tx_count, stats.amount_gross, stats.amount_refunded, stats.failure_count
+            ), merged AS (
+                INSERT INTO newebpay_payment_stats (
+                    date, provider_id, payment_type, state,
+                    tx_count, amount_gross, amount_refunded, failure_count,
+                    create_uid, create_date, write_uid, write_date
+                )
+                SELECT date, provider_id, NULLIF(payment_type, ''), state,
+                       SUM(tx_count), SUM(amount_gross), SUM(amount_refunded), SUM(failure_count),
+                       %(uid)s, NOW() AT TIME ZONE 'UTC', %(uid)s, NOW() AT TIME ZONE 'UTC'
+                  FROM deleted
+              GROUP BY date, provider_id, payment_type, state
+                HAVING SUM(tx_count) != 0 OR SUM(failure_count) != 0
+                    OR ABS(SUM(amount_gross)) >= 0.005 OR ABS(SUM(amount_refunded)) >= 0.005
+            )
+            SELECT COUNT(*) FROM deleted
+        """, {'uid': self.env.uid})
+        merged = self.env.cr.fetchone()[0]
+        self.env.invalidate_all()
+        if merged:
+            _logger.info('藍新金流付款統計合併完成 - 合併列數: %s', merged)
+        return merged
+
+    # ---- 回補與一致性檢查 ----
+
+    @api.model
+    def _compute_from_transactions(self, date_from=None, date_to=None):
+        """
+        由交易（含已封存的交易）重新計算統計
+
+        :param date_from: 起始日期（含）
+        :param date_to: 結束日期（含）
+        :return: {(日期, 提供者 ID, 支付方式, 狀態): [筆數, 金額, 退款金額, 失敗筆數]}
+        """
+        tx_clauses, archive_clauses, params = [], [], {'date_from': date_from, 'date_to': date_to}
+        if date_from:
+            tx_clauses.append('AND tx.create_date >= %(date_from)s')
+            archive_clauses.append('AND archive.tx_create_date >= %(date_from)s')
+        if date_to:
+            params['date_to'] = fields.Date.add(fields.Date.to_date(date_to), days=1)
+            tx_clauses.append('AND tx.create_date < %(date_to)s')
+            archive_clauses.append('AND archive.tx_create_date < %(date_to)s')
+        self.env.cr.execute("""
+            SELECT tx.create_date::date, tx.provider_id, COALESCE(tx.newebpay_payment_type, ''), tx.state,
+                   COUNT(*), SUM(tx.amount), SUM(COALESCE(tx.newebpay_refunded_amount, 0)),
+                   COUNT(*) FILTER (WHERE tx.state = 'error')
+              FROM payment_transaction tx
+              JOIN payment_provider provider ON provider.id = tx.provider_id
+             WHERE provider.code = 'newebpay'
+               AND tx.state != 'draft'
+               {tx_clauses}
+          GROUP BY 1, 2, 3, 4
+         UNION ALL
+            SELECT archive.tx_create_date::date, archive.provider_id, COALESCE(archive.newebpay_payment_type, ''),
+                   archive.state, COUNT(*), SUM(archive.amount), SUM(COALESCE(archive.newebpay_refunded_amount, 0)),
+                   COUNT(*) FILTER (WHERE archive.state = 'error')
+              FROM newebpay_transaction_archive archive
+             WHERE archive.provider_id IS NOT NULL
+               AND archive.state != 'draft'
+               {archive_clauses}
+          GROUP BY 1, 2, 3, 4
+        """.format(tx_clauses=' '.join(tx_clauses), archive_clauses=' '.join(archive_clauses)), params)
+        expected = defaultdict(lambda: [0, 0.0, 0.0, 0])
+        for date, provider_id, payment_type, state, *values in self.env.cr.fetchall():
+            totals = expected[(date, provider_id, payment_type, state)]
+            for index, value in enumerate(values):
+                totals[index] += value or 0
+        return dict(expected)
+
+    @api.model
+    def _read_totals(self, date_from=None, date_to=None):
+        """ 讀取統計表目前的彙總值（格式同 `_compute_from_transactions`） """
+        domain = []
+        if date_from:
+            domain.append(('date', '>=', date_from))
+        if date_to:
+            domain.append(('date', '<=', date_to))
+        totals = defaultdict(lambda: [0, 0.0, 0.0, 0])
+        for row in self.sudo().search_read(domain, ['date', 'provider_id', 'payment_type', 'state', *_MEASURES]):
+            key = (row['date'], row['provider_id'][0], row['payment_type'] or '', row['state'])
+            for index, measure in enumerate(_MEASURES):
+                totals[key][index] += row[measure]
+        return {key: values for key, values in totals.items() if not _is_zero(values)}
+
+    @api.model
+    def _check_consistency(self, date_from=None, date_to=None):
+        """
+        比對統計表與交易重新計算的結果
+
+        :param date_from: 起始日期（含），未指定時為 `STATS_CHECK_DAYS` 天前
+        :param date_to: 結束日期（含）
+        :return: 不一致的維度列表，每項為 {'key': 維度, 'expected': 應有值, 'actual': 統計表值}
+        """
+        if date_from is None:
+            date_from = fields.Date.subtract(fields.Date.context_today(self), days=const.STATS_CHECK_DAYS)
+        expected = self._compute_from_transactions(date_from, date_to)
+        actual = self._read_totals(date_from, date_to)
+        zero = [0, 0.0, 0.0, 0]
+        differences = []
+        for key in sorted(expected.keys() | actual.keys(), key=str):
+            expected_values = expected.get(key, zero)
+            actual_values = actual.get(key, zero)
+            if not _is_zero([e - a for e, a in zip(expected_values, actual_values)]):
+                differences.append({'key': key, 'expected': expected_values, 'actual': actual_values})
+        if differences:
+            _logger.warning(
+                '藍新金流付款統計不一致 - 維度數: %s, 範例: %s', len(differences), differences[:5]
+            )
+        return differences
+
+    @api.model
+    def _cron_check_consistency(self):
+        """ 排程：檢查最近的統計是否與交易一致（只記錄日誌，修正請執行 `_backfill`） """
+        return len(self._check_consistency())
+
+    @api.model
+    def _backfill(self, date_from=None, date_to=None):
+        """
+        由交易重新產生統計（首次安裝或一致性檢查發現差異時執行）
+
+        指定期間的統計列先刪除再以重新計算的結果寫入；執行期間鎖定統計表，
+        同時發生的狀態轉換等待回補完成後才寫入差異列。
+
+        :param date_from: 起始日期（含），未指定時重新產生全部統計
+        :param date_to: 結束日期（含）
+        :return: 寫入的列數
+        """
+        self.env.cr.execute('LOCK TABLE newebpay_payment_stats IN EXCLUSIVE MODE')
+        domain = []
+        if date_from:
+            domain.append(('date', '>=', date_from))
+        if date_to:
+            domain.append(('date', '<=', date_to))
+        self.sudo().search(domain).unlink()
+        vals_list = []
+        for (date, provider_id, payment_type, state), values in self._compute_from_transactions(
+            date_from, date_to,
+        ).items():
+            vals = dict(zip(_MEASURES, values))
+            vals.update(date=date, provider_id=provider_id, payment_type=payment_type or False, state=state)
+            vals_list.append(vals)
+        self.sudo().create(vals_list)
+        _logger.info('藍新金流付款統計回補完成 - 期間: %s ~ %s, 列數: %s', date_from, date_to, len(vals_list))
+        return len(vals_list)
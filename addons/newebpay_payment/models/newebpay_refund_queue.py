@@ -0,0 +1,301 @@
+# -*- coding: utf-8 -*-
+
+import datetime
+import logging
+import threading
+
+from odoo import models, fields, api, _
+from odoo.exceptions import UserError
+
+from odoo.addons.newebpay_payment import const
+from ..utils.bulk_refund import BulkRefundEngine, RefundRequest
+
+_logger = logging.getLogger(__name__)
+
+
+class NewebPayRefundQueue(models.Model):
+    """
+    藍新金流非同步退款佇列
+
+    提供者啟用非同步退款時，`_send_refund_request` 只驗證並寫入此表後立即返回，
+    退款請求由排程以有上限的執行緒池送出（依商店代號限流），不佔用網頁 worker。
+    連線失敗、逾時等結果不明的錯誤以指數退避重試；藍新金流明確拒絕的退款不重試。
+    """
+    _name = 'newebpay.refund.queue'
+    _description = '藍新金流退款佇列'
+    _order = 'id'
+
+    transaction_id = fields.Many2one(
+        'payment.transaction',
+        string='交易',
+        required=True,
+        index=True,
+        ondelete='cascade',
+    )
+    provider_id = fields.Many2one(
+        'payment.provider',
+        string='支付提供者',
+        required=True,
+        ondelete='cascade',
+    )
+    amount = fields.Float(string='退款金額', required=True)
+    state = fields.Selection(
+        [
+            ('pending', '待送出'),
+            ('done', '已完成'),
+            ('error', '錯誤'),
+        ],
+        string='狀態',
+        default='pending',
+        required=True,
+        index=True,
+    )
+    attempts = fields.Integer(string='嘗試次數', default=0)
+    next_attempt_at = fields.Datetime(string='下次嘗試時間', default=fields.Datetime.now, required=True)
+    refund_trade_no = fields.Char(string='退款交易序號')
+    response_status = fields.Char(string='回應狀態')
+    error_message = fields.Text(string='錯誤訊息')
+    processed_at = fields.Datetime(string='處理時間')
+
+    @api.model
+    def _enqueue(self, tx, amount):
+        """
+        將退款寫入佇列並觸發排程
+
+        同一筆交易同時只能有一筆待送出的退款，避免重複點擊造成重複退款。
+        檢查前先鎖定交易列，同時送出的請求依序檢查；後到的請求在前一個提交後
+        因並行更新衝突由 Odoo 重試，重試時即會看到已存在的待送出退款。
+
+        :param tx: payment.transaction 記錄
+        :param amount: 退款金額（元）
+        :return: newebpay.refund.queue 記錄
+        """
+        tx._newebpay_lock()
+        tx.invalidate_recordset(['newebpay_refund_status'])
+        # 批次退款送出前也會將交易標記為 QUEUED（沒有佇列紀錄）
+        if tx.newebpay_refund_status == const.REFUND_STATUS_QUEUED or self.search_count([
+            ('transaction_id', '=', tx.id),
+            ('state', '=', 'pending'),
+        ], limit=1):
+            raise UserError(_('此交易已有處理中的退款，請等待完成後再試'))
+        entry = self.create({
+            'transaction_id': tx.id,
+            'provider_id': tx.provider_id.id,
+            'amount': amount,
+        })
+        tx.newebpay_refund_status = const.REFUND_STATUS_QUEUED
+        cron = self.env.ref('newebpay_payment.ir_cron_newebpay_process_refunds', raise_if_not_found=False)
+        if cron:
+            cron._trigger()
+        _logger.info('藍新金流退款已加入佇列 - 交易: %s, 退款金額: %s', tx.reference, amount)
+        return entry
+
+    def _lock_due_batch(self, batch_size):
+        """ 以 `FOR UPDATE SKIP LOCKED` 鎖定一批到期的退款，多個排程工作者可同時處理 """
+        self.env.cr.execute("""
+            SELECT id
+              FROM newebpay_refund_queue
+             WHERE state = 'pending'
+               AND next_attempt_at <= %s
+          ORDER BY next_attempt_at, id
+             LIMIT %s
+               FOR UPDATE SKIP LOCKED
+        """, (fields.Datetime.now(), batch_size))
+        return self.browse([row[0] for row in self.env.cr.fetchall()])
+
+    @api.model
+    def _cron_process_refunds(self, max_batches=None, batch_size=None):
+        """
+        排程：分批送出到期的退款，每批寫回結果後提交
+
+        每批送出前先記錄嘗試次數並提交（`_claim`）：工作者在藍新金流已完成退款、
+        結果尚未提交前中斷時，下一次處理會先以查詢交易 API 確認，不會直接重複送出。
+
+        :param max_batches: 最多處理的批數（未指定時處理到沒有到期的退款為止）
+        :param batch_size: 每批筆數
+        :return: 各結果的筆數統計字典
+        """
+        batch_size = batch_size or const.REFUND_QUEUE_BATCH_SIZE
+        testing = getattr(threading.current_thread(), 'testing', False)
+        summary = {}
+        batches = 0
+        while max_batches is None or batches < max_batches:
+            entries = self._lock_due_batch(batch_size)
+            if not entries:
+                break
+            entries._claim(fields.Datetime.now())
+            if not testing:
+                self.env.cr.commit()
+            for key, count in entries._send_batch().items():
+                summary[key] = summary.get(key, 0) + count
+            batches += 1
+            if not testing:
+                self.env.cr.commit()
+        if summary:
+            _logger.info('藍新金流退款佇列處理完成 - 結果: %s', summary)
+        return summary
+
+    def _claim(self, now):
+        """
+        送出前記錄這次嘗試，並將下次嘗試時間延後到送出與寫回結果所需的時間之後
+
+        :param now: 目前時間
+        """
+        next_attempt_at = now + datetime.timedelta(seconds=const.REFUND_QUEUE_CLAIM_SECONDS)
+        for entry in self:
+            entry.write({'attempts': entry.attempts + 1, 'next_attempt_at': next_attempt_at})
+
+    def _send_batch(self):
+        """
+        送出一批已記錄嘗試（`_claim`）的退款並寫回結果
+
+        先前已嘗試過的退款先以查詢交易 API 確認：前一次請求可能已在藍新金流完成
+        （例如回應逾時或工作者中斷）。以藍新金流的已退款金額與本地紀錄比對：
+        已包含這筆退款時直接標記完成；與本地紀錄相同時才重新送出；其餘情況無法判斷，
+        標記錯誤由人工確認，不自動送出。
+
+        :return: 各結果的筆數統計字典
+        """
+        summary = {}
+        now = fields.Datetime.now()
+
+        def _count(key):
+            summary[key] = summary.get(key, 0) + 1
+
+        to_send = self
+        retries = self.filtered(lambda e: e.attempts > 1)
+        if retries:
+            statuses = retries.transaction_id._newebpay_query_trade_status()
+            for entry in retries:
+                tx = entry.transaction_id
+                result = statuses.get(tx.id)
+                if isinstance(result, Exception) or result is None:
+                    # 無法確認前一次請求的結果，不送出並等待下一次重試
+                    entry._schedule_retry(now, _('無法確認前一次退款結果: %s') % result)
+                    to_send -= entry
+                    _count('unconfirmed')
+                    continue
+                refunded = tx._newebpay_gateway_refunded_amount(result)
+                if refunded is not None and refunded >= tx.newebpay_refunded_amount + entry.amount - 0.01:
+                    entry._mark_done(now, entry.refund_trade_no or '', const.REFUND_STATUS_SUCCESS)
+                    to_send -= entry
+                    _count('already_refunded')
+                elif refunded is None or abs(refunded - tx.newebpay_refunded_amount) > 0.01:
+                    entry._mark_error(now, const.REFUND_STATUS_ERROR, _(
+                        '無法確認前一次退款結果（藍新金流已退款金額: %s，本地紀錄: %s），請人工確認'
+                    ) % (refunded, tx.newebpay_refunded_amount))
+                    to_send -= entry
+                    _count('error')
+
+        clients = {}
+        requests = []
+        for entry in to_send:
+            tx = entry.transaction_id
+            provider = entry.provider_id
+            if provider not in clients:
+                clients[provider] = provider._newebpay_get_api_client()
+            requests.append(RefundRequest(
+                tx_id=tx.id,
+                merchant_id=provider.newebpay_merchant_id,
+                client=clients[provider],
+                trade_no=tx.newebpay_trade_no,
+                amount=entry.amount,
+                order_no=tx.newebpay_merchant_order_no or tx.reference,
+            ))
+        if not requests:
+            return summary
+
+        # HTTP 請求在工作執行緒中並行送出，結果在主執行緒寫回
+        engine = BulkRefundEngine(
+            max_workers=const.BULK_REFUND_MAX_WORKERS,
+            rate_per_merchant=const.BULK_REFUND_RATE_PER_MERCHANT,
+        )
+        results = {result.tx_id: result for result in engine.run(requests, lambda _batch: None)}
+        for entry in to_send:
+            result = results[entry.transaction_id.id]
+            if result.success:
+                entry._mark_done(now, result.refund_trade_no, result.status)
+                _count('done')
+            elif result.status == const.REFUND_STATUS_ERROR:
+                # 連線失敗、逾時或回應無法驗證：結果不明，稍後重試
+                entry._schedule_retry(now, result.message)
+                _count('retry' if entry.state == 'pending' else 'error')
+            else:
+                # 藍新金流明確拒絕退款，不重試
+                entry._mark_error(now, result.status, result.message)
+                _logger.warning(
+                    '藍新金流拒絕退款 - 交易: %s, 狀態: %s, 訊息: %s',
+                    entry.transaction_id.reference, result.status, result.message,
+                )
+                _count('declined')
+        return summary
+
+    def _mark_done(self, now, refund_trade_no, status):
+        self.ensure_one()
+        self.write({
+            'state': 'done',
+            'refund_trade_no': refund_trade_no,
+            'response_status': status,
+            'error_message': False,
+            'processed_at': now,
+        })
+        tx = self.transaction_id
+        with self.env['newebpay.payment.stats']._track(tx):
+            tx.write({
+                'newebpay_refund_trade_no': refund_trade_no or tx.newebpay_refund_trade_no,
+                'newebpay_refund_status': const.REFUND_STATUS_SUCCESS,
+                'newebpay_refunded_amount': tx.newebpay_refunded_amount + self.amount,
+            })
+        _logger.info('藍新金流退款成功 - 交易: %s, 退款金額: %s', self.transaction_id.reference, self.amount)
+
+    def _mark_error(self, now, status, message):
+        """ 標記錯誤，不再自動重試 """
+        self.ensure_one()
+        self.write({
+            'state': 'error',
+            'response_status': status,
+            'error_message': message,
+            'processed_at': now,
+        })
+        self.transaction_id.newebpay_refund_status = status
+
+    def _schedule_retry(self, now, message):
+        """ 以指數退避安排下一次重試；超過嘗試次數時標記錯誤（嘗試次數已於 `_claim` 記錄） """
+        self.ensure_one()
+        attempts = self.attempts
+        if attempts >= const.REFUND_QUEUE_MAX_ATTEMPTS:
+            self._mark_error(now, const.REFUND_STATUS_ERROR, message)
+            _logger.error(
+                '藍新金流退款重試次數已用盡 - 交易: %s, 錯誤: %s', self.transaction_id.reference, message
+            )
+            return
+        delay = min(
+            const.REFUND_QUEUE_BACKOFF_SECONDS * 2 ** (attempts - 1),
+            const.REFUND_QUEUE_MAX_BACKOFF_SECONDS,
+        )
+        self.write({
+            'next_attempt_at': now + datetime.timedelta(seconds=delay),
+            'error_message': message,
+        })
+        self.transaction_id.newebpay_refund_status = const.REFUND_STATUS_RETRYING
+        _logger.warning(
+            '藍新金流退款失敗，%s 秒後重試 - 交易: %s, 第 %s 次, 錯誤: %s',
+            delay, self.transaction_id.reference, attempts, message,
+        )
+
+    def action_retry(self):
+        """ 手動重新送出錯誤的退款 """
+        for entry in self.filtered(lambda e: e.state == 'error'):
+            # 保留一次嘗試紀錄，送出前先查詢交易狀態，避免前一次請求其實已成功而重複退款
+            entry.write({'state': 'pending', 'attempts': 1, 'next_attempt_at': fields.Datetime.now()})
+            entry.transaction_id.newebpay_refund_status = const.REFUND_STATUS_QUEUED
+        cron = self.env.ref('newebpay_payment.ir_cron_newebpay_process_refunds', raise_if_not_found=False)
+        if cron:
+            cron._trigger()
+        return True
+
+    @api.autovacuum
+    def _gc_processed_entries(self):
+        """ 自動清理已完成且超過保留天數的退款 """
+        limit_date = fields.Datetime.subtract(fields.Datetime.now(), days=const.REFUND_QUEUE_RETENTION_DAYS)
+        self.search([('state', '=', 'done'), ('processed_at', '<', limit_date)]).unlink()
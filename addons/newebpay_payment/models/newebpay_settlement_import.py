@@ -0,0 +1,250 @@
+# -*- coding: utf-8 -*-
+
+import csv
+import io
+import logging
+import threading
+
+from odoo import models, fields, api, _
+from odoo.exceptions import UserError
+
+from odoo.addons.newebpay_payment import const
+from ..utils import settlement
+
+_logger = logging.getLogger(__name__)
+
+
+class NewebPaySettlementImport(models.Model):
+    """
+    藍新金流對帳檔匯入
+
+    逐行串流讀取對帳檔，每個區塊以一次 SQL 查詢（依藍新交易序號與商店訂單編號）比對交易，
+    只將不符的資料寫入 `newebpay.settlement.line`，記憶體用量與檔案大小無關。
+    """
+    _name = 'newebpay.settlement.import'
+    _description = '藍新金流對帳檔匯入'
+    _order = 'id desc'
+
+    name = fields.Char(string='名稱', required=True, default=lambda self: _('藍新金流對帳'))
+    provider_id = fields.Many2one(
+        'payment.provider',
+        string='支付提供者',
+        domain=[('code', '=', 'newebpay')],
+        help='留空時比對所有藍新金流提供者的交易',
+    )
+    file = fields.Binary(string='對帳檔', attachment=True)
+    filename = fields.Char(string='檔案名稱')
+    state = fields.Selection(
+        [
+            ('draft', '草稿'),
+            ('done', '已完成'),
+            ('error', '錯誤'),
+        ],
+        string='狀態',
+        default='draft',
+        required=True,
+    )
+    row_count = fields.Integer(string='資料行數', readonly=True)
+    matched_count = fields.Integer(string='相符筆數', readonly=True)
+    mismatch_count = fields.Integer(string='不符筆數', readonly=True)
+    error_message = fields.Text(string='錯誤訊息', readonly=True)
+    line_ids = fields.One2many('newebpay.settlement.line', 'import_id', string='不符明細', readonly=True)
+
+    def _open_file(self):
+        """
+        開啟對帳檔的二進位串流
+
+        附件存放在檔案庫時直接開啟實體檔案，避免將整個檔案載入記憶體。
+        """
+        self.ensure_one()
+        attachment = self.env['ir.attachment'].sudo().search([
+            ('res_model', '=', self._name),
+            ('res_id', '=', self.id),
+            ('res_field', '=', 'file'),
+        ], limit=1)
+        if not attachment:
+            raise UserError(_('請先上傳對帳檔'))
+        if attachment.store_fname:
+            return open(attachment._full_path(attachment.store_fname), 'rb')
+        return io.BytesIO(attachment.raw or b'')
+
+    def action_import(self):
+        """ 匯入並比對對帳檔 """
+        for record in self:
+            with record._open_file() as fileobj:
+                record._import_stream(fileobj)
+        return True
+
+    @api.model
+    def _import_file_path(self, path, provider=None, chunk_size=None):
+        """
+        直接匯入伺服器上的對帳檔（例如由 `odoo shell` 處理過大而不便上傳的檔案）
+
+        :param path: 檔案路徑
+        :param provider: payment.provider 記錄（可選）
+        :param chunk_size: 每個比對區塊的行數
+        :return: newebpay.settlement.import 記錄
+        """
+        record = self.create({
+            'name': path.rsplit('/', 1)[-1],
+            'filename': path.rsplit('/', 1)[-1],
+            'provider_id': provider.id if provider else False,
+        })
+        with open(path, 'rb') as fileobj:
+            record._import_stream(fileobj, chunk_size=chunk_size)
+        return record
+
+    def _import_stream(self, fileobj, chunk_size=None):
+        """
+        串流比對對帳檔
+
+        每個區塊比對完成後寫入不符明細與進度，並清除 ORM 快取；非測試環境下逐區塊提交。
+        格式錯誤、無法解碼或 CSV 解析失敗時匯入標記為錯誤（已比對的進度保留）。
+
+        :param fileobj: 二進位檔案物件
+        :param chunk_size: 每個比對區塊的行數
+        """
+        self.ensure_one()
+        testing = getattr(threading.current_thread(), 'testing', False)
+        Line = self.env['newebpay.settlement.line']
+        # 重新匯入時清除先前的明細（以 SQL 刪除，不將明細載入記憶體）
+        self.env.cr.execute('DELETE FROM newebpay_settlement_line WHERE import_id = %s', (self.id,))
+        self.env.invalidate_all()
+        counts = {'row_count': 0, 'matched_count': 0, 'mismatch_count': 0}
+        try:
+            rows = settlement.iter_rows(fileobj)
+            for chunk in settlement.chunked(rows, chunk_size or const.SETTLEMENT_CHUNK_SIZE):
+                matched, mismatches = self._match_chunk(chunk)
+                if mismatches:
+                    Line.create(mismatches)
+                counts['row_count'] += len(chunk)
+                counts['matched_count'] += matched
+                counts['mismatch_count'] += len(mismatches)
+                self.write(counts)
+                self.env.flush_all()
+                self.env.invalidate_all()
+                if not testing:
+                    self.env.cr.commit()
+        except settlement.SettlementFormatError as e:
+            self.write(dict(counts, state='error', error_message=str(e)))
+            return
+        except (UnicodeDecodeError, csv.Error) as e:
+            # 編碼只以檔案開頭的樣本判斷，之後的內容仍可能無法解碼或 CSV 格式錯誤；
+            # 先前已提交的區塊保留，匯入標記為錯誤
+            _logger.warning('藍新金流對帳檔讀取失敗 - %s: 第 %s 筆之後, 錯誤: %s', self.name, counts['row_count'], e)
+            self.write(dict(
+                counts,
+                state='error',
+                error_message=_('對帳檔第 %s 筆資料之後無法讀取: %s') % (counts['row_count'], e),
+            ))
+            return
+        self.write(dict(counts, state='done', error_message=False))
+        _logger.info(
+            '藍新金流對帳檔匯入完成 - %s: 共 %s 行, 相符 %s 筆, 不符 %s 筆',
+            self.name, counts['row_count'], counts['matched_count'], counts['mismatch_count'],
+        )
+
+    def _fetch_transactions(self, trade_nos, order_nos):
+        """
+        以一次查詢取得區塊內所有相關交易（含已封存的交易，封存交易的 id 為 None）
+
+        :return: (依藍新交易序號的字典, 依商店訂單編號的字典)，值為 (id, amount, state)
+        """
+        provider_clause = ' AND tx.provider_id = %s' if self.provider_id else ''
+        query = """
+            SELECT NULL, tx.newebpay_trade_no, tx.newebpay_merchant_order_no, tx.amount, tx.state
+              FROM newebpay_transaction_archive tx
+             WHERE (tx.newebpay_trade_no = ANY(%s) OR tx.newebpay_merchant_order_no = ANY(%s))
+        """ + provider_clause + """
+         UNION ALL
+            SELECT tx.id, tx.newebpay_trade_no, tx.newebpay_merchant_order_no, tx.amount, tx.state
+              FROM payment_transaction tx
+              JOIN payment_provider provider ON provider.id = tx.provider_id
+             WHERE provider.code = 'newebpay'
+               AND (tx.newebpay_trade_no = ANY(%s) OR tx.newebpay_merchant_order_no = ANY(%s))
+        """ + provider_clause
+        params = [list(trade_nos), list(order_nos)]
+        if self.provider_id:
+            params.append(self.provider_id.id)
+        self.env.cr.execute(query, params + params)
+        by_trade_no = {}
+        by_order_no = {}
+        for tx_id, trade_no, order_no, amount, state in self.env.cr.fetchall():
+            # 同一筆交易同時存在於封存與交易表（例如已還原）時以交易表為準
+            if trade_no and (tx_id or trade_no not in by_trade_no):
+                by_trade_no[trade_no] = (tx_id, amount, state)
+            if order_no and (tx_id or order_no not in by_order_no):
+                by_order_no[order_no] = (tx_id, amount, state)
+        return by_trade_no, by_order_no
+
+    def _match_chunk(self, rows):
+        """
+        比對一個區塊
+
+        :param rows: SettlementRow 列表
+        :return: (相符筆數, 不符明細的 create 值列表)
+        """
+        by_trade_no, by_order_no = self._fetch_transactions(
+            {row.trade_no for row in rows if row.trade_no},
+            {row.merchant_order_no for row in rows if row.merchant_order_no},
+        )
+        matched = 0
+        mismatches = []
+        for row in rows:
+            tx = by_trade_no.get(row.trade_no) or by_order_no.get(row.merchant_order_no)
+            base_vals = {
+                'import_id': self.id,
+                'line_no': row.line_no,
+                'trade_no': row.trade_no,
+                'merchant_order_no': row.merchant_order_no,
+                'file_amount': row.amount or 0.0,
+                'file_status': row.status,
+            }
+            if tx is None:
+                mismatches.append(dict(base_vals, mismatch_type='missing'))
+                continue
+
+            tx_id, tx_amount, tx_state = tx
+            tx_vals = dict(base_vals, transaction_id=tx_id, tx_amount=tx_amount, tx_state=tx_state)
+            row_ok = True
+            if row.amount is not None and abs(row.amount - float(tx_amount or 0.0)) > 0.01:
+                mismatches.append(dict(tx_vals, mismatch_type='amount'))
+                row_ok = False
+            expected_states = const.SETTLEMENT_STATUS_STATES.get(row.status)
+            if expected_states and tx_state not in expected_states:
+                mismatches.append(dict(tx_vals, mismatch_type='status'))
+                row_ok = False
+            matched += row_ok
+        return matched, mismatches
+
+
+class NewebPaySettlementLine(models.Model):
+    """ 藍新金流對帳不符明細 """
+    _name = 'newebpay.settlement.line'
+    _description = '藍新金流對帳不符明細'
+    _order = 'import_id desc, line_no'
+
+    import_id = fields.Many2one(
+        'newebpay.settlement.import',
+        string='對帳檔匯入',
+        required=True,
+        index=True,
+        ondelete='cascade',
+    )
+    line_no = fields.Integer(string='行號')
+    mismatch_type = fields.Selection(
+        [
+            ('missing', '找不到交易'),
+            ('amount', '金額不符'),
+            ('status', '狀態不符'),
+        ],
+        string='不符類型',
+        required=True,
+    )
+    trade_no = fields.Char(string='藍新交易序號')
+    merchant_order_no = fields.Char(string='商店訂單編號')
+    file_amount = fields.Float(string='對帳檔金額')
+    file_status = fields.Char(string='對帳檔狀態')
+    transaction_id = fields.Many2one('payment.transaction', string='交易', ondelete='set null')
+    tx_amount = fields.Float(string='交易金額')
+    tx_state = fields.Char(string='交易狀態')
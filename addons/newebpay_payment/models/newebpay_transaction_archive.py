@@ -0,0 +1,314 @@
+# -*- coding: utf-8 -*-
+
+import base64
+import json
+import logging
+import threading
+import zlib
+
+from odoo import models, fields, api, _
+from odoo.exceptions import UserError
+
+from odoo.addons.newebpay_payment import const
+
+_logger = logging.getLogger(__name__)
+
+# 不保存在封存資料中的欄位類型（反向關聯由對方保存；二進位欄位過大）
+_SKIPPED_FIELD_TYPES = ('one2many', 'binary')
+# 封存資料中記錄其他記錄參照的鍵：[[模型, 欄位, [記錄 ID...]], ...]
+_REFERENCES_KEY = '__references__'
+
+
+class NewebPayTransactionArchive(models.Model):
+    """
+    藍新金流交易封存
+
+    超過保留天數且已是終態的藍新交易由排程分批移到此表，`payment.transaction` 只保留近期交易，
+    回調查詢與後台列表不受歷史資料量影響。封存只保留常用的查詢欄位，
+    其餘欄位以 zlib 壓縮的 JSON 保存，需要時（晚到的退款、稽核）由後台手動還原。
+
+    刪除交易時會被一併刪除或阻擋刪除的參照（冪等紀錄、退款佇列等）存在時不封存；
+    刪除時設為空值的參照（付款、子交易的來源交易等）記錄在封存資料中，還原時重新指向還原的交易。
+    """
+    _name = 'newebpay.transaction.archive'
+    _description = '藍新金流交易封存'
+    _order = 'id desc'
+    _rec_name = 'reference'
+
+    archived_tx_id = fields.Integer(string='原交易 ID', readonly=True, index=True)
+    reference = fields.Char(string='交易編號', readonly=True, index=True)
+    provider_id = fields.Many2one('payment.provider', string='支付提供者', readonly=True, ondelete='set null')
+    newebpay_merchant_order_no = fields.Char(string='藍新商店訂單編號', readonly=True, index='btree_not_null')
+    newebpay_trade_no = fields.Char(string='藍新交易序號', readonly=True, index='btree_not_null')
+    newebpay_payment_type = fields.Char(string='支付方式', readonly=True)
+    amount = fields.Float(string='金額', readonly=True)
+    currency_id = fields.Many2one('res.currency', string='幣別', readonly=True, ondelete='set null')
+    state = fields.Char(string='狀態', readonly=True)
+    newebpay_refund_trade_no = fields.Char(string='退款交易序號', readonly=True)
+    newebpay_refund_status = fields.Char(string='退款狀態', readonly=True)
+    newebpay_refunded_amount = fields.Float(string='已退款金額', readonly=True)
+    tx_create_date = fields.Datetime(string='交易建立時間', readonly=True)
+    last_state_change = fields.Datetime(string='最後狀態變更', readonly=True)
+    payload = fields.Binary(string='壓縮資料', attachment=False, readonly=True)
+
+    @api.model
+    def _get_archive_after_days(self):
+        """ 取得封存天數（系統參數 `newebpay_payment.archive_after_days`） """
+        days = self.env['ir.config_parameter'].sudo().get_param(
+            'newebpay_payment.archive_after_days',
+            const.ARCHIVE_AFTER_DAYS,
+        )
+        try:
+            return max(int(days), 1)
+        except (TypeError, ValueError):
+            return const.ARCHIVE_AFTER_DAYS
+
+    @api.model
+    def _get_reference_fields(self):
+        """
+        所有模型中參照 `payment.transaction` 的儲存 many2one 欄位
+
+        :return: (刪除時設為空值的欄位, 刪除時會一併刪除或阻擋刪除的欄位)
+        """
+        relinked, blocking = [], []
+        for model in self.env.registry.values():
+            if model._abstract or model._transient or not model._auto:
+                continue
+            for field in model._fields.values():
+                if field.type != 'many2one' or field.comodel_name != 'payment.transaction' or not field.store:
+                    continue
+                (relinked if field.ondelete == 'set null' else blocking).append(field)
+        return relinked, blocking
+
+    @api.model
+    def _select_batch(self, cutoff, after_id, batch_size):
+        """
+        選出一批可封存的交易 ID
+
+        只封存終態的藍新交易，並略過仍被刪除時會一併刪除或阻擋刪除的記錄參照的交易
+        （例如尚未清理的冪等紀錄、退款佇列），避免稽核紀錄隨封存消失。
+        """
+        _relinked, blocking = self._get_reference_fields()
+        conditions = ''.join(
+            f"""
+               AND NOT EXISTS (
+                       SELECT 1
+                         FROM "{self.env[field.model_name]._table}" ref
+                        WHERE ref."{field.name}" = tx.id
+                   )"""
+            for field in blocking
+        )
+        self.env.cr.execute(f"""
+            SELECT tx.id
+              FROM payment_transaction tx
+              JOIN payment_provider provider ON provider.id = tx.provider_id
+             WHERE provider.code = 'newebpay'
+               AND tx.state IN ('done', 'cancel', 'error')
+               AND COALESCE(tx.last_state_change, tx.create_date) < %s
+               AND tx.id > %s{conditions}
+          ORDER BY tx.id
+             LIMIT %s
+        """, (cutoff, after_id, batch_size))
+        return [row[0] for row in self.env.cr.fetchall()]
+
+    @api.model
+    def _get_references(self, transactions):
+        """
+        取得刪除交易時會被設為空值的參照
+
+        :return: {交易 ID: [[模型, 欄位, [記錄 ID...]], ...]}
+        """
+        relinked, _blocking = self._get_reference_fields()
+        references = {tx_id: [] for tx_id in transactions.ids}
+        for field in relinked:
+            self.env.cr.execute(f"""
+                SELECT "{field.name}", ARRAY_AGG(id ORDER BY id)
+                  FROM "{self.env[field.model_name]._table}"
+                 WHERE "{field.name}" = ANY(%s)
+              GROUP BY 1
+            """, (transactions.ids,))
+            for tx_id, record_ids in self.env.cr.fetchall():
+                references[tx_id].append([field.model_name, field.name, record_ids])
+        return references
+
+    @api.model
+    def _cron_archive_transactions(self, batch_size=None, max_records=None):
+        """
+        排程：將超過保留天數的終態藍新交易分批移到封存表，每批提交一次
+
+        :param batch_size: 每批筆數
+        :param max_records: 本次最多封存筆數
+        :return: 封存筆數
+        """
+        batch_size = batch_size or const.ARCHIVE_BATCH_SIZE
+        max_records = max_records or const.ARCHIVE_MAX_PER_RUN
+        cutoff = fields.Datetime.subtract(fields.Datetime.now(), days=self._get_archive_after_days())
+        testing = getattr(threading.current_thread(), 'testing', False)
+        Transaction = self.env['payment.transaction'].sudo()
+        archived = 0
+        last_id = 0
+        while archived < max_records:
+            tx_ids = self._select_batch(cutoff, last_id, min(batch_size, max_records - archived))
+            if not tx_ids:
+                break
+            last_id = tx_ids[-1]
+            archived += self._archive_batch(Transaction.browse(tx_ids))
+            self.env.invalidate_all()
+            if not testing:
+                self.env.cr.commit()
+        if archived:
+            _logger.info('藍新金流交易封存完成 - 筆數: %s', archived)
+        return archived
+
+    @api.model
+    def _archive_batch(self, transactions):
+        """
+        封存一批交易
+
+        整批建立封存並刪除原交易；整批失敗時（例如個別交易仍被其他資料以限制刪除的外鍵參照）
+        改為逐筆處理，無法刪除的交易保留在原表。
+
+        :return: 封存筆數
+        """
+        references = self._get_references(transactions)
+        try:
+            with self.env.cr.savepoint():
+                self.create([self._prepare_archive_values(tx, references[tx.id]) for tx in transactions])
+                transactions.unlink()
+            return len(transactions)
+        except Exception as e:
+            _logger.info('整批封存失敗，改為逐筆處理: %s', e)
+
+        archived = 0
+        for tx in transactions:
+            try:
+                with self.env.cr.savepoint():
+                    self.create(self._prepare_archive_values(tx, references[tx.id]))
+                    tx.unlink()
+                archived += 1
+            except Exception as e:
+                _logger.warning('無法封存藍新交易 - 交易: %s, 錯誤: %s', tx.reference, e)
+        return archived
+
+    @api.model
+    def _prepare_archive_values(self, tx, references=None):
+        """
+        由交易產生封存值（常用查詢欄位 + 壓縮的完整欄位資料）
+
+        :param references: 刪除時會被設為空值的參照（見 `_get_references`）
+        """
+        payload = self._serialize_transaction(tx)
+        payload[_REFERENCES_KEY] = references or []
+        return {
+            'archived_tx_id': tx.id,
+            'reference': tx.reference,
+            'provider_id': tx.provider_id.id,
+            'newebpay_merchant_order_no': tx.newebpay_merchant_order_no,
+            'newebpay_trade_no': tx.newebpay_trade_no,
+            'newebpay_payment_type': tx.newebpay_payment_type,
+            'amount': tx.amount,
+            'currency_id': tx.currency_id.id,
+            'state': tx.state,
+            'newebpay_refund_trade_no': tx.newebpay_refund_trade_no,
+            'newebpay_refund_status': tx.newebpay_refund_status,
+            'newebpay_refunded_amount': tx.newebpay_refunded_amount,
+            'tx_create_date': tx.create_date,
+            'last_state_change': tx.last_state_change,
+            'payload': self._compress_payload(payload),
+        }
+
+    @api.model
+    def _serialize_transaction(self, tx):
+        """ 以 `create` 可接受的格式取出交易的所有儲存欄位 """
+        values = {}
+        for name, field in tx._fields.items():
+            if not field.store or field.automatic or field.type in _SKIPPED_FIELD_TYPES:
+                continue
+            values[name] = field.convert_to_write(tx[name], tx)
+        values['create_date'] = tx.create_date
+        return values
+
+    @staticmethod
+    def _compress_payload(values):
+        data = json.dumps(values, default=str, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        return base64.b64encode(zlib.compress(data, 9))
+
+    def _get_payload(self):
+        """ 解壓縮封存的欄位資料 """
+        self.ensure_one()
+        if not self.payload:
+            return {}
+        return json.loads(zlib.decompress(base64.b64decode(self.payload)).decode('utf-8'))
+
+    @api.model
+    def _lookup(self, merchant_order_no=None, trade_no=None, reference=None):
+        """
+        查詢封存的交易
+
+        :return: newebpay.transaction.archive 記錄（找不到時為空記錄集）
+        """
+        for field_name, value in (
+            ('newebpay_merchant_order_no', merchant_order_no),
+            ('newebpay_trade_no', trade_no),
+            ('reference', reference),
+        ):
+            if value:
+                archive = self.search([(field_name, '=', value)], limit=1)
+                if archive:
+                    return archive
+        return self.browse()
+
+    def _restore(self):
+        """
+        將封存的交易還原到 `payment.transaction`（例如晚到的退款或稽核），並刪除封存
+
+        還原的交易 ID 與原交易不同：封存時記錄的參照（付款、子交易等）重新指向還原的交易；
+        來源交易也已封存時一併還原。參照的記錄（客戶、訂單、發票等）已不存在時略過該欄位。
+
+        :return: 還原的 payment.transaction 記錄
+        """
+        self.ensure_one()
+        Transaction = self.env['payment.transaction'].sudo()
+        payload = self._get_payload()
+        references = payload.pop(_REFERENCES_KEY, [])
+        values = {}
+        for name, value in payload.items():
+            field = Transaction._fields.get(name)
+            if field is None:
+                continue
+            if value and field.type == 'many2one':
+                if not self.env[field.comodel_name].browse(value).exists():
+                    if field.comodel_name != 'payment.transaction':
+                        continue
+                    source = self.search([('archived_tx_id', '=', value)], limit=1)
+                    if not source:
+                        continue
+                    value = source._restore().id
+            elif value and field.type == 'many2many':
+                ids = [record_id for command in value for record_id in command[2]]
+                value = [(6, 0, self.env[field.comodel_name].browse(ids).exists().ids)]
+            values[name] = value
+        if not values.get('reference'):
+            raise UserError(_('封存資料不完整，無法還原交易'))
+        tx = Transaction.create(values)
+        for model_name, field_name, record_ids in references:
+            if model_name not in self.env:
+                continue
+            records = self.env[model_name].sudo().browse(record_ids).exists()
+            records.filtered(lambda record: not record[field_name]).write({field_name: tx.id})
+        _logger.info('已還原封存的藍新交易 - 交易: %s, 原交易 ID: %s, 新交易 ID: %s',
+                     tx.reference, self.archived_tx_id, tx.id)
+        self.unlink()
+        return tx
+
+    def action_restore(self):
+        """ 手動還原封存的交易並開啟交易 """
+        transactions = self.env['payment.transaction']
+        for archive in self:
+            transactions |= archive._restore()
+        return {
+            'type': 'ir.actions.act_window',
+            'res_model': 'payment.transaction',
+            'view_mode': 'list,form',
+            'domain': [('id', 'in', transactions.ids)],
+        }
@@ -1,8 +1,47 @@
 # -*- coding: utf-8 -*-
 
-from odoo import models, fields
+import hashlib
+import logging
+import time
+from urllib.parse import urlparse, urlunparse
+
+from odoo import models, fields, api, _
+from odoo.exceptions import ValidationError
 
 from odoo.addons.newebpay_payment import const
+from odoo.addons.newebpay_payment.utils.admission import default_admission
+from odoo.addons.newebpay_payment.utils.api_client import NewebPayAPIClient
+from odoo.addons.newebpay_payment.utils.cache import LRUCache
+from odoo.addons.newebpay_payment.utils.crypto import NewebPayCrypto
+from odoo.addons.newebpay_payment.utils.http_transport import (
+    DEFAULT_CONNECT_TIMEOUT,
+    DEFAULT_POOL_SIZE,
+    DEFAULT_READ_TIMEOUT,
+    get_transport,
+)
+
+_logger = logging.getLogger(__name__)
+
+# 變更時需要清除加密上下文快取的欄位
+NEWEBPAY_CREDENTIAL_FIELDS = {'newebpay_merchant_id', 'newebpay_hash_key', 'newebpay_hash_iv'}
+
+# 付款方式欄位與 TradeInfo 參數的對應（順序即為送出順序）
+NEWEBPAY_METHOD_FLAGS = (
+    ('newebpay_credit_card', 'CREDIT'),
+    ('newebpay_webatm', 'WEBATM'),
+    ('newebpay_vacc', 'VACC'),
+    ('newebpay_cvs', 'CVS'),
+    ('newebpay_barcode', 'BARCODE'),
+)
+
+# (資料庫名稱, 提供者 ID, 公司 ID, 最後修改時間, web.base.url) → 結帳設定
+_checkout_profile_cache = LRUCache(const.CHECKOUT_PROFILE_CACHE_SIZE)
+
+# 資料庫名稱 → (載入時間, {商店代號: ((提供者 ID, Hash Key, Hash IV), ...)})
+_merchant_index_cache = LRUCache(const.MERCHANT_INDEX_CACHE_SIZE)
+
+# 變更時需重建商店代號索引的欄位
+NEWEBPAY_INDEX_FIELDS = NEWEBPAY_CREDENTIAL_FIELDS | {'code', 'state', 'company_id'}
 
 
 class PaymentProvider(models.Model):
@@ -32,6 +71,16 @@ class PaymentProvider(models.Model):
         default=True,
         help='啟用測試模式時，將使用藍新金流的測試環境'
     )
+    newebpay_async_notify = fields.Boolean(
+        string='非同步處理通知',
+        default=False,
+        help='啟用時，伺服器通知只驗證簽名並寫入收件匣後立即回應，交易狀態由排程批次更新'
+    )
+    newebpay_async_refund = fields.Boolean(
+        string='非同步退款',
+        default=False,
+        help='啟用時，退款請求寫入佇列後立即返回，由排程送出並在失敗時自動重試，退款狀態顯示於交易上'
+    )
 
     # 支援的付款方式
     newebpay_credit_card = fields.Boolean(
@@ -60,6 +109,273 @@ class PaymentProvider(models.Model):
         help='啟用條碼繳費'
     )
 
+    @api.model_create_multi
+    def create(self, vals_list):
+        """ 覆寫以在新增提供者時重建商店代號索引與准入金鑰快取 """
+        providers = super().create(vals_list)
+        if any(provider.code == 'newebpay' for provider in providers):
+            _merchant_index_cache.pop(self.env.cr.dbname)
+            default_admission.invalidate(self.env.cr.dbname)
+        return providers
+
+    def write(self, vals):
+        """ 覆寫以在金鑰變更時清除對應的加密上下文、商店代號索引與准入金鑰快取 """
+        stale_keys = []
+        if NEWEBPAY_CREDENTIAL_FIELDS.intersection(vals):
+            stale_keys = [
+                (provider.newebpay_hash_key, provider.newebpay_hash_iv)
+                for provider in self.filtered(lambda p: p.code == 'newebpay')
+            ]
+        res = super().write(vals)
+        for hash_key, hash_iv in stale_keys:
+            NewebPayCrypto.invalidate_context(hash_key=hash_key, hash_iv=hash_iv)
+        if NEWEBPAY_INDEX_FIELDS.intersection(vals):
+            _merchant_index_cache.pop(self.env.cr.dbname)
+            default_admission.invalidate(self.env.cr.dbname)
+        self._newebpay_invalidate_checkout_profile()
+        return res
+
+    def _newebpay_invalidate_checkout_profile(self):
+        """ 清除此提供者的結帳設定快取（其他 worker 由快取鍵中的最後修改時間自動失效） """
+        dbname = self.env.cr.dbname
+        provider_ids = set(self.ids)
+        _checkout_profile_cache.discard_if(lambda key, _profile: key[0] == dbname and key[1] in provider_ids)
+
+    def _newebpay_get_checkout_profile(self):
+        """
+        取得此提供者的結帳設定（已快取）
+
+        包含 API URL、ReturnURL / NotifyURL 與啟用的付款方式等與交易無關的 TradeInfo 欄位。
+        快取鍵包含提供者最後修改時間、`web.base.url` 與模擬閘道網址（`_newebpay_get_api_base_url`），
+        提供者或系統參數變更後自動重新產生。
+
+        :return: {'api_url': str, 'return_url': str, 'notify_url': str, 'trade_info': dict, 'fingerprint': str}
+        """
+        self.ensure_one()
+        get_param = self.env['ir.config_parameter'].sudo().get_param
+        base_url = get_param('web.base.url')
+        cache_key = (
+            self.env.cr.dbname, self.id, self.company_id.id, self.write_date, base_url,
+            self._newebpay_get_api_base_url(),
+        )
+        profile = _checkout_profile_cache.get(cache_key)
+        if profile is None:
+            profile = self._newebpay_build_checkout_profile(base_url)
+            _checkout_profile_cache.set(cache_key, profile)
+        return profile
+
+    def _newebpay_build_checkout_profile(self, base_url):
+        """ 產生結帳設定（驗證提供者設定並調整 ReturnURL / NotifyURL 的埠號） """
+        self.ensure_one()
+        # 驗證必要設定
+        if not self.newebpay_merchant_id or not self.newebpay_hash_key or not self.newebpay_hash_iv:
+            raise ValidationError(_('藍新金流設定不完整，請檢查商店代號、Hash Key 和 Hash IV'))
+
+        # 建立返回和通知 URL
+        # 藍新金流要求：ReturnURL 和 NotifyURL 的埠號只能是 80（HTTP）或 443（HTTPS）
+
+        # 驗證 base_url 是否配置
+        if not base_url:
+            raise ValidationError(_('系統設定中缺少 web.base.url 參數，請在「設定」>「技術」>「參數」>「系統參數」中配置'))
+
+        # 解析 URL 並確保埠號符合要求
+        parsed_url = urlparse(base_url)
+        scheme = parsed_url.scheme.lower()  # http 或 https
+        hostname = parsed_url.hostname or (parsed_url.netloc.split(':')[0] if ':' in parsed_url.netloc else parsed_url.netloc)
+
+        # 驗證 hostname 是否存在
+        if not hostname:
+            raise ValidationError(_('無法從 web.base.url 解析主機名稱，請檢查設定是否正確（應為 http://example.com 或 https://example.com 格式）'))
+
+        # 根據協定設定正確的埠號（HTTP=80, HTTPS=443）
+        # 藍新金流要求埠號必須明確為 80 或 443
+        if scheme == 'https':
+            # HTTPS 使用 443
+            port = 443
+        elif scheme == 'http':
+            # HTTP 使用 80
+            port = 80
+        else:
+            raise ValidationError(_('web.base.url 必須使用 http:// 或 https:// 協定'))
+
+        # 重新組裝 base URL，確保使用正確的埠號
+        # 如果主機名已包含埠號資訊，先移除
+        if ':' in hostname:
+            hostname = hostname.split(':')[0]
+
+        new_netloc = f"{hostname}:{port}"
+        adjusted_base_url = urlunparse((
+            scheme,
+            new_netloc,
+            parsed_url.path.rstrip('/'),  # 移除尾部斜線
+            parsed_url.params,
+            parsed_url.query,
+            parsed_url.fragment
+        ))
+
+        return_url = f"{adjusted_base_url}/payment/newebpay/return"
+        notify_url = f"{adjusted_base_url}/payment/newebpay/notify"
+
+        _logger.debug('URL 調整 - 原始: %s, 調整後: %s (埠號: %s)', base_url, adjusted_base_url, port)
+
+        trade_info = {
+            'ReturnURL': return_url,
+            'NotifyURL': notify_url,
+        }
+        # 設定啟用的付款方式
+        for field_name, param in NEWEBPAY_METHOD_FLAGS:
+            if self[field_name]:
+                trade_info[param] = '1'
+
+        # 商店代號、金鑰與結帳設定的指紋，交易以此判斷已儲存的付款表單是否仍有效
+        fingerprint = hashlib.sha256('\x1f'.join((
+            self.newebpay_merchant_id,
+            self.newebpay_hash_key,
+            self.newebpay_hash_iv,
+            *(f'{key}={value}' for key, value in trade_info.items()),
+        )).encode('utf-8')).hexdigest()
+
+        return {
+            'api_url': self._newebpay_get_mpg_url(),
+            'return_url': return_url,
+            'notify_url': notify_url,
+            'trade_info': trade_info,
+            'fingerprint': fingerprint,
+        }
+
+    def _newebpay_get_api_base_url(self):
+        """
+        取得模擬閘道網址（系統參數 `newebpay_payment.api_base_url`）
+
+        只有測試狀態（`state == 'test'`）的提供者採用，啟用中的提供者一律連到藍新金流正式或測試主機。
+
+        :return: 模擬閘道網址，未設定或提供者非測試狀態時為 None
+        """
+        self.ensure_one()
+        if self.state != 'test':
+            return None
+        return self.env['ir.config_parameter'].sudo().get_param('newebpay_payment.api_base_url') or None
+
+    def _newebpay_get_mpg_url(self):
+        """ 取得藍新金流 MPG 付款頁 URL（測試狀態的提供者可導向本機模擬閘道） """
+        self.ensure_one()
+        base_url = self._newebpay_get_api_base_url()
+        if base_url:
+            return f"{base_url.rstrip('/')}/MPG/mpg_gateway"
+        if self.newebpay_test_mode:
+            return 'https://ccore.newebpay.com/MPG/mpg_gateway'
+        return 'https://core.newebpay.com/MPG/mpg_gateway'
+
+    @api.model
+    def _newebpay_get_merchant_index(self, refresh=False):
+        """
+        取得商店代號 → 提供者的索引（行程內快取，依資料庫分開）
+
+        :param refresh: 是否重新自資料庫載入
+        :return: {商店代號: ((提供者 ID, Hash Key, Hash IV), ...)}
+        """
+        dbname = self.env.cr.dbname
+        cached = _merchant_index_cache.get(dbname)
+        if cached is not None and not refresh:
+            return cached[1]
+
+        providers = self.sudo().search([
+            ('code', '=', 'newebpay'),
+            ('state', '!=', 'disabled'),
+        ], order='id')
+        index = {}
+        for provider in providers:
+            if provider.newebpay_merchant_id:
+                index.setdefault(provider.newebpay_merchant_id, []).append(
+                    (provider.id, provider.newebpay_hash_key, provider.newebpay_hash_iv)
+                )
+        index = {merchant_id: tuple(entries) for merchant_id, entries in index.items()}
+        _merchant_index_cache.set(dbname, (time.monotonic(), index))
+        return index
+
+    @api.model
+    def _newebpay_resolve_provider(self, merchant_id, trade_info=None, trade_sha=None, verified_key=None):
+        """
+        依回調資料中的明文商店代號取得提供者
+
+        索引中找不到商店代號時重新載入（受 `MERCHANT_INDEX_REFRESH_SECONDS` 限制）。
+        多個提供者使用同一商店代號時（例如多公司），以已驗證的金鑰組合或 TradeSha 驗證找出金鑰相符的提供者。
+
+        :param merchant_id: 商店代號
+        :param trade_info: 加密後的 TradeInfo（可選，用於區分同一商店代號的提供者）
+        :param trade_sha: TradeSha（可選）
+        :param verified_key: 已驗證 TradeSha 的 (HashKey, HashIV)（可選，有值時不再計算 SHA256）
+        :return: payment.provider 記錄（找不到時為空記錄集）
+        """
+        if not merchant_id:
+            return self.browse()
+        entries = self._newebpay_get_merchant_index().get(merchant_id)
+        if not entries:
+            cached = _merchant_index_cache.get(self.env.cr.dbname)
+            if cached is None or time.monotonic() - cached[0] >= const.MERCHANT_INDEX_REFRESH_SECONDS:
+                entries = self._newebpay_get_merchant_index(refresh=True).get(merchant_id)
+        if not entries:
+            return self.browse()
+        if len(entries) > 1 and verified_key:
+            for provider_id, hash_key, hash_iv in entries:
+                if (hash_key, hash_iv) == verified_key:
+                    return self.browse(provider_id)
+        elif len(entries) > 1 and trade_info and trade_sha:
+            for provider_id, hash_key, hash_iv in entries:
+                if NewebPayCrypto.get_context(hash_key, hash_iv, merchant_id=merchant_id).verify(trade_info, trade_sha):
+                    return self.browse(provider_id)
+        return self.browse(entries[0][0])
+
+    @api.model
+    def _newebpay_get_notification_provider(self, notification_data):
+        """
+        取得回調資料對應的提供者
+
+        有 MerchantID 時以索引取得；沒有 MerchantID 的舊格式資料沿用單一提供者的查詢方式。
+
+        :param notification_data: 回調的 POST 資料
+        :return: payment.provider 記錄（找不到時為空記錄集）
+        """
+        merchant_id = notification_data.get('MerchantID')
+        if not merchant_id:
+            return self._get_provider('newebpay', raise_if_not_found=False)
+        return self._newebpay_resolve_provider(
+            merchant_id,
+            trade_info=notification_data.get('TradeInfo'),
+            trade_sha=notification_data.get('TradeSha'),
+            verified_key=getattr(notification_data, 'verified_key', None),
+        )
+
+    def _newebpay_get_crypto_context(self):
+        """ 取得此提供者（商店代號 + 金鑰組合）的加密上下文 """
+        self.ensure_one()
+        return NewebPayCrypto.get_context(
+            self.newebpay_hash_key,
+            self.newebpay_hash_iv,
+            merchant_id=self.newebpay_merchant_id,
+        )
+
+    def _newebpay_get_api_client(self):
+        """
+        建立此提供者的 API 客戶端
+
+        連線逾時與連線池大小可由系統參數 `newebpay_payment.http_connect_timeout`、
+        `newebpay_payment.http_read_timeout`、`newebpay_payment.http_pool_size` 調整；
+        測試狀態的提供者可由 `newebpay_payment.api_base_url` 將 API 請求導向本機模擬端點。
+        """
+        self.ensure_one()
+        get_param = self.env['ir.config_parameter'].sudo().get_param
+        return NewebPayAPIClient(
+            merchant_id=self.newebpay_merchant_id,
+            hash_key=self.newebpay_hash_key,
+            hash_iv=self.newebpay_hash_iv,
+            test_mode=self.newebpay_test_mode,
+            connect_timeout=float(get_param('newebpay_payment.http_connect_timeout', DEFAULT_CONNECT_TIMEOUT)),
+            read_timeout=float(get_param('newebpay_payment.http_read_timeout', DEFAULT_READ_TIMEOUT)),
+            transport=get_transport(pool_size=int(get_param('newebpay_payment.http_pool_size', DEFAULT_POOL_SIZE))),
+            base_url=self._newebpay_get_api_base_url(),
+        )
+
     def _compute_feature_support_fields(self):
         """ Override of `payment` to enable additional features. """
         super()._compute_feature_support_fields()
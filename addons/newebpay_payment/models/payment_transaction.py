@@ -1,13 +1,27 @@
 # -*- coding: utf-8 -*-
 
 from odoo import models, fields, api, _
-from odoo.exceptions import ValidationError
+from odoo.exceptions import UserError, ValidationError
+from odoo.tools import mute_logger
+import hashlib
 import logging
 import re
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from psycopg2 import IntegrityError
+from odoo.addons.newebpay_payment import const
+from ..utils.bulk_refund import BulkRefundEngine, RefundRequest
+from ..utils.cache import LRUCache
 from ..utils.crypto import NewebPayCrypto
+from ..utils import tracing
+from ..utils.notification import NewebPayNotification
 
 _logger = logging.getLogger(__name__)
 
+# (資料庫名稱, MerchantOrderNo) → 交易 ID
+_tx_lookup_cache = LRUCache(const.TX_LOOKUP_CACHE_SIZE)
+
 
 class PaymentTransaction(models.Model):
     _inherit = 'payment.transaction'
@@ -15,8 +29,16 @@ class PaymentTransaction(models.Model):
     newebpay_trade_no = fields.Char(
         string='藍新交易序號',
         readonly=True,
+        copy=False,
+        index='btree_not_null',
         help='藍新金流回傳的交易序號'
     )
+    newebpay_merchant_order_no = fields.Char(
+        string='藍新商店訂單編號',
+        readonly=True,
+        copy=False,
+        help='送往藍新金流的 MerchantOrderNo（交易編號過濾為英數字並限制 20 字元）'
+    )
     newebpay_payment_type = fields.Selection(
         [
             ('CREDIT', '信用卡'),
@@ -38,9 +60,43 @@ class PaymentTransaction(models.Model):
         readonly=True,
         help='退款處理狀態'
     )
+    newebpay_refunded_amount = fields.Float(
+        string='已退款金額',
+        readonly=True,
+        copy=False,
+        help='藍新金流已確認退款成功的累計金額'
+    )
+    newebpay_form_trade_info = fields.Text(
+        string='付款表單 TradeInfo',
+        readonly=True,
+        copy=False,
+        help='已加密的付款表單 TradeInfo，表單內容未變更時重複使用'
+    )
+    newebpay_form_trade_sha = fields.Char(
+        string='付款表單 TradeSha',
+        readonly=True,
+        copy=False,
+    )
+    newebpay_form_fingerprint = fields.Char(
+        string='付款表單指紋',
+        readonly=True,
+        copy=False,
+        help='產生付款表單時的金額、交易資訊、提供者金鑰與結帳設定指紋，任一變更時重新產生表單'
+    )
+
+    _newebpay_merchant_order_no_unique = models.Constraint(
+        'UNIQUE(newebpay_merchant_order_no)',
+        '藍新商店訂單編號不可重複',
+    )
 
     def _get_specific_rendering_values(self, processing_values):
-        """ 覆寫以產生藍新金流的支付表單值 """
+        """
+        覆寫以產生藍新金流的支付表單值
+
+        TimeStamp 取自交易建立時間，同一筆交易在相同設定下的表單內容固定不變；
+        加密後的 TradeInfo / TradeSha 與指紋一併儲存在交易上，客戶重新整理或返回重試時直接沿用，
+        只有金額、交易資訊、提供者金鑰或結帳設定變更時才重新加密與簽名。
+        """
         res = super()._get_specific_rendering_values(processing_values)
         if self.provider_code != 'newebpay':
             return res
@@ -48,76 +104,25 @@ class PaymentTransaction(models.Model):
         try:
             provider = self.provider_id
 
-            # 驗證必要設定
-            if not provider.newebpay_merchant_id or not provider.newebpay_hash_key or not provider.newebpay_hash_iv:
-                raise ValidationError(_('藍新金流設定不完整，請檢查商店代號、Hash Key 和 Hash IV'))
-
-            # 建立返回和通知 URL
-            # 藍新金流要求：ReturnURL 和 NotifyURL 的埠號只能是 80（HTTP）或 443（HTTPS）
-            base_url = self.env['ir.config_parameter'].sudo().get_param('web.base.url')
-            
-            # 驗證 base_url 是否配置
-            if not base_url:
-                raise ValidationError(_('系統設定中缺少 web.base.url 參數，請在「設定」>「技術」>「參數」>「系統參數」中配置'))
-            
-            # 解析 URL 並確保埠號符合要求
-            from urllib.parse import urlparse, urlunparse
-            parsed_url = urlparse(base_url)
-            scheme = parsed_url.scheme.lower()  # http 或 https
-            hostname = parsed_url.hostname or (parsed_url.netloc.split(':')[0] if ':' in parsed_url.netloc else parsed_url.netloc)
-            
-            # 驗證 hostname 是否存在
-            if not hostname:
-                raise ValidationError(_('無法從 web.base.url 解析主機名稱，請檢查設定是否正確（應為 http://example.com 或 https://example.com 格式）'))
-            
-            # 根據協定設定正確的埠號（HTTP=80, HTTPS=443）
-            # 藍新金流要求埠號必須明確為 80 或 443
-            if scheme == 'https':
-                # HTTPS 使用 443
-                port = 443
-            elif scheme == 'http':
-                # HTTP 使用 80
-                port = 80
-            else:
-                raise ValidationError(_('web.base.url 必須使用 http:// 或 https:// 協定'))
-            
-            # 重新組裝 base URL，確保使用正確的埠號
-            # 如果主機名已包含埠號資訊，先移除
-            if ':' in hostname:
-                hostname = hostname.split(':')[0]
-            
-            new_netloc = f"{hostname}:{port}"
-            adjusted_base_url = urlunparse((
-                scheme,
-                new_netloc,
-                parsed_url.path.rstrip('/'),  # 移除尾部斜線
-                parsed_url.params,
-                parsed_url.query,
-                parsed_url.fragment
-            ))
-            
-            return_url = f"{adjusted_base_url}/payment/newebpay/return"
-            notify_url = f"{adjusted_base_url}/payment/newebpay/notify"
-            
-            _logger.debug('URL 調整 - 原始: %s, 調整後: %s (埠號: %s)', base_url, adjusted_base_url, port)
+            # 取得提供者的結帳設定（URL、固定欄位與付款方式，已快取）
+            profile = provider._newebpay_get_checkout_profile()
 
             # 準備交易資訊
             # 處理商店訂單編號：藍新金流限制最多 20 個字元，且只能包含英數字
-            merchant_order_no = str(self.reference)
-            # 只保留英文字母和數字，移除特殊字符
-            merchant_order_no = re.sub(r'[^a-zA-Z0-9]', '', merchant_order_no)
-            # 如果過濾後為空，使用時間戳作為備用
-            if not merchant_order_no:
-                merchant_order_no = str(int(self.create_date.timestamp()))
-                _logger.warning('交易編號過濾後為空，使用時間戳作為備用: %s', merchant_order_no)
-            # 限制長度為 20 字元
-            if len(merchant_order_no) > 20:
-                merchant_order_no = merchant_order_no[:20]
-                _logger.warning(
-                    '交易編號超過 20 字元，已截斷 - 原始: %s, 處理後: %s',
-                    self.reference, merchant_order_no
+            merchant_order_no = self._newebpay_get_merchant_order_no()
+
+            # 表單內容未變更時沿用已儲存的加密結果
+            fingerprint = self._newebpay_get_form_fingerprint(profile, merchant_order_no)
+            if (
+                self.newebpay_form_fingerprint == fingerprint
+                and self.newebpay_form_trade_info
+                and self.newebpay_form_trade_sha
+            ):
+                _logger.debug('沿用已儲存的藍新金流付款表單 - 交易編號: %s', self.reference)
+                return self._newebpay_get_form_values(
+                    profile, self.newebpay_form_trade_info, self.newebpay_form_trade_sha
                 )
-            
+
             # 處理商品描述：限制為 50 字元（藍新金流限制）
             item_desc = str(self.reference)
             if len(item_desc) > 50:
@@ -131,28 +136,16 @@ class PaymentTransaction(models.Model):
                 'MerchantOrderNo': merchant_order_no,
                 'Amt': int(self.amount),  # 金額（元）
                 'ItemDesc': item_desc,  # 商品描述
-                'ReturnURL': return_url,
-                'NotifyURL': notify_url,
+                # ReturnURL、NotifyURL 與啟用的付款方式
+                **profile['trade_info'],
             }
 
-            # 設定啟用的付款方式
-            if provider.newebpay_credit_card:
-                trade_info_dict['CREDIT'] = '1'
-            if provider.newebpay_webatm:
-                trade_info_dict['WEBATM'] = '1'
-            if provider.newebpay_vacc:
-                trade_info_dict['VACC'] = '1'
-            if provider.newebpay_cvs:
-                trade_info_dict['CVS'] = '1'
-            if provider.newebpay_barcode:
-                trade_info_dict['BARCODE'] = '1'
-
             # 如果有客戶資訊，加入交易資訊
             if self.partner_id:
                 trade_info_dict['Email'] = self.partner_id.email or ''
                 trade_info_dict['LoginType'] = '0'
 
-            _logger.debug('準備交易資訊: %s', trade_info_dict)
+            tracing.capture('render', trade_info_dict, '準備交易資訊')
 
             # 加密交易資訊
             trade_info = NewebPayCrypto.encrypt_trade_info(
@@ -168,25 +161,135 @@ class PaymentTransaction(models.Model):
                 provider.newebpay_hash_iv
             )
 
+            self.write({
+                'newebpay_form_trade_info': trade_info,
+                'newebpay_form_trade_sha': trade_sha,
+                'newebpay_form_fingerprint': fingerprint,
+            })
+
             _logger.info('藍新金流付款表單已產生 - 交易編號: %s', self.reference)
 
-            return {
-                'api_url': self._get_newebpay_api_url(),
-                'MerchantID': provider.newebpay_merchant_id,
-                'TradeInfo': trade_info,
-                'TradeSha': trade_sha,
-                'Version': '2.0',
-            }
+            return self._newebpay_get_form_values(profile, trade_info, trade_sha)
 
         except Exception as e:
             _logger.error('產生藍新金流付款表單失敗: %s', str(e), exc_info=True)
             raise ValidationError(_('產生付款表單失敗: %s') % str(e))
 
+    def _newebpay_get_form_fingerprint(self, profile, merchant_order_no):
+        """
+        計算付款表單內容的指紋
+
+        涵蓋 TradeInfo 的所有來源：提供者結帳設定（含商店代號與金鑰）、商店訂單編號、
+        金額、交易編號（商品描述）、客戶 Email 與交易建立時間（TimeStamp）。
+        """
+        self.ensure_one()
+        return hashlib.sha256('\x1f'.join((
+            profile['fingerprint'],
+            merchant_order_no,
+            str(int(self.amount)),
+            str(self.reference),
+            (self.partner_id.email or '') if self.partner_id else '\x00',
+            str(int(self.create_date.timestamp())),
+        )).encode('utf-8')).hexdigest()
+
+    def _newebpay_get_form_values(self, profile, trade_info, trade_sha):
+        """ 組合付款表單的渲染值 """
+        return {
+            'api_url': profile['api_url'],
+            'MerchantID': self.provider_id.newebpay_merchant_id,
+            'TradeInfo': trade_info,
+            'TradeSha': trade_sha,
+            'Version': '2.0',
+        }
+
+    def _newebpay_get_merchant_order_no(self):
+        """
+        取得（必要時產生並儲存）此交易的藍新商店訂單編號
+
+        編號由交易編號過濾為英數字並截斷為 20 字元；若與其他交易重複（包括並行產生表單時
+        寫入才發現的唯一性衝突），則以交易 ID 取代尾碼。加上尾碼的編號仍可能與其他交易的編號相同
+        （例如交易編號 `SO12-X45` 過濾後為 `SO12X45`），此時拋出 UserError。
+        產生後存入 `newebpay_merchant_order_no`，讓回調可直接以唯一索引找回交易。
+        """
+        self.ensure_one()
+        if self.newebpay_merchant_order_no:
+            return self.newebpay_merchant_order_no
+
+        max_length = const.MERCHANT_ORDER_NO_MAX_LENGTH
+        # 只保留英文字母和數字，移除特殊字符
+        merchant_order_no = re.sub(r'[^a-zA-Z0-9]', '', str(self.reference))
+        # 如果過濾後為空，使用時間戳作為備用
+        if not merchant_order_no:
+            merchant_order_no = str(int(self.create_date.timestamp()))
+            _logger.warning('交易編號過濾後為空，使用時間戳作為備用: %s', merchant_order_no)
+        # 限制長度為 20 字元
+        if len(merchant_order_no) > max_length:
+            merchant_order_no = merchant_order_no[:max_length]
+            _logger.warning(
+                '交易編號超過 20 字元，已截斷 - 原始: %s, 處理後: %s',
+                self.reference, merchant_order_no
+            )
+
+        # 過濾或截斷後可能與其他交易重複，改以交易 ID 作為尾碼；
+        # 並行產生表單的其他交易可能在檢查後才取得相同編號，寫入違反唯一性限制時同樣改用尾碼
+        if self.search_count([
+            ('newebpay_merchant_order_no', '=', merchant_order_no),
+            ('id', '!=', self.id),
+        ], limit=1) or not self._newebpay_store_merchant_order_no(merchant_order_no):
+            merchant_order_no = self._newebpay_suffix_merchant_order_no(merchant_order_no)
+            if not self._newebpay_store_merchant_order_no(merchant_order_no):
+                raise UserError(_(
+                    '無法產生不重複的藍新商店訂單編號（%s 已被其他交易使用），請重新建立交易'
+                ) % merchant_order_no)
+        return merchant_order_no
+
+    def _newebpay_suffix_merchant_order_no(self, merchant_order_no):
+        """ 以交易 ID 取代商店訂單編號的尾碼 """
+        suffix = f"X{self.id}"
+        suffixed = merchant_order_no[:const.MERCHANT_ORDER_NO_MAX_LENGTH - len(suffix)] + suffix
+        _logger.warning(
+            '商店訂單編號重複，已加上交易 ID 尾碼 - 交易: %s, 處理後: %s',
+            self.reference, suffixed
+        )
+        return suffixed
+
+    def _newebpay_store_merchant_order_no(self, merchant_order_no):
+        """
+        於 savepoint 中寫入商店訂單編號
+
+        :return: 是否寫入成功（False 表示編號已被其他交易使用，違反唯一性限制）
+        """
+        try:
+            with self.env.cr.savepoint(), mute_logger('odoo.sql_db'):
+                self.newebpay_merchant_order_no = merchant_order_no
+                self.flush_recordset(['newebpay_merchant_order_no'])
+        except IntegrityError:
+            self.invalidate_recordset(['newebpay_merchant_order_no'])
+            return False
+        return True
+
     def _get_newebpay_api_url(self):
         """ 取得藍新金流 API URL """
-        if self.provider_id.newebpay_test_mode:
-            return 'https://ccore.newebpay.com/MPG/mpg_gateway'
-        return 'https://core.newebpay.com/MPG/mpg_gateway'
+        return self.provider_id._newebpay_get_mpg_url()
+
+    @api.model
+    def _newebpay_decode_notification(self, notification_data, provider=None):
+        """
+        將回調資料解碼為 `NewebPayNotification`（驗證簽名並解密一次）
+
+        若傳入的資料已是使用相同提供者解碼的通知物件，直接沿用。
+
+        :param notification_data: 回調的 POST 資料或已解碼的通知物件
+        :param provider: 用於解碼的提供者（未指定時依明文 MerchantID 取得）
+        :return: NewebPayNotification
+        """
+        if provider is None:
+            if isinstance(notification_data, NewebPayNotification) and notification_data.provider:
+                return notification_data
+            provider = self.env['payment.provider']._newebpay_get_notification_provider(notification_data)
+        if isinstance(notification_data, NewebPayNotification) and notification_data.is_decoded_with(provider):
+            return notification_data
+        return NewebPayNotification.decode(notification_data, provider)
 
     @api.model
     def _get_tx_from_feedback_data(self, provider_code, notification_data):
@@ -195,43 +298,21 @@ class PaymentTransaction(models.Model):
             return super()._get_tx_from_feedback_data(provider_code, notification_data)
 
         try:
-            # 取得 TradeInfo（加密的回調資料）
-            trade_info_encrypted = notification_data.get('TradeInfo')
-            if not trade_info_encrypted:
-                _logger.error('回調資料中缺少 TradeInfo')
-                return None
-
-            # 取得提供者
-            provider = self.env['payment.provider']._get_provider(
-                provider_code,
-                raise_if_not_found=False
-            )
-            if not provider:
-                _logger.error('找不到藍新金流提供者')
-                return None
-
-            # 解密回調資料
-            try:
-                trade_info = NewebPayCrypto.decrypt_trade_info(
-                    trade_info_encrypted,
-                    provider.newebpay_hash_key,
-                    provider.newebpay_hash_iv
-                )
-            except Exception as e:
-                _logger.error('解密回調資料失敗: %s', str(e))
+            notification = self._newebpay_decode_notification(notification_data)
+            if notification.trade_info is None:
+                _logger.error('無法解碼回調資料: %s', notification.error)
                 return None
 
             # 從解密後的資料中取得訂單編號
+            trade_info = notification.trade_info
             merchant_order_no = trade_info.get('MerchantOrderNo')
             if not merchant_order_no:
                 _logger.error('回調資料中缺少 MerchantOrderNo')
                 return None
 
             # 尋找對應的交易記錄
-            tx = self.search([
-                ('reference', '=', merchant_order_no),
-                ('provider_code', '=', 'newebpay'),
-            ], limit=1)
+            with tracing.span('lookup', notification.timings):
+                tx = self._newebpay_find_tx(merchant_order_no, trade_no=trade_info.get('TradeNo'))
 
             if not tx:
                 _logger.warning('找不到對應的交易記錄: %s', merchant_order_no)
@@ -242,34 +323,111 @@ class PaymentTransaction(models.Model):
             _logger.error('處理回調資料時發生錯誤: %s', str(e), exc_info=True)
             return None
 
+    @api.model
+    def _newebpay_find_tx(self, merchant_order_no, trade_no=None):
+        """
+        以索引欄位找出回調對應的交易
+
+        依序嘗試：行程內 LRU 快取 → `newebpay_merchant_order_no` 唯一索引 →
+        `newebpay_trade_no` 索引 → 以 `reference` 比對（相容欄位新增前建立的交易）。
+        交易已封存時只記錄警告，不自動還原（需要時由後台手動還原）。
+
+        :param merchant_order_no: 回調中的 MerchantOrderNo
+        :param trade_no: 回調中的 TradeNo（可選）
+        :return: payment.transaction 記錄（找不到時為空記錄集）
+        """
+        cache_key = (self.env.cr.dbname, merchant_order_no)
+        tx_id = _tx_lookup_cache.get(cache_key)
+        if tx_id:
+            tx = self.browse(tx_id).exists()
+            if tx:
+                return tx
+            _tx_lookup_cache.pop(cache_key)
+
+        tx = self.search([('newebpay_merchant_order_no', '=', merchant_order_no)], limit=1)
+        if not tx and trade_no:
+            tx = self.search([('newebpay_trade_no', '=', trade_no)], limit=1)
+        if not tx:
+            tx = self.search([
+                ('reference', '=', merchant_order_no),
+                ('provider_code', '=', 'newebpay'),
+            ], limit=1)
+        if not tx:
+            archive = self.env['newebpay.transaction.archive'].sudo()._lookup(
+                merchant_order_no=merchant_order_no, trade_no=trade_no, reference=merchant_order_no,
+            )
+            if archive:
+                _logger.warning(
+                    '回調對應的交易已封存，未自動還原 - 交易: %s, 原交易 ID: %s',
+                    archive.reference, archive.archived_tx_id,
+                )
+
+        if tx:
+            _tx_lookup_cache.set(cache_key, tx.id)
+        return tx
+
+    def _newebpay_lock(self, skip_locked=False):
+        """
+        以列鎖保護回調處理（伺服器通知與瀏覽器返回幾乎同時到達同一筆交易）
+
+        鎖定持續到請求的資料庫交易結束。伺服器通知等待鎖定；瀏覽器返回使用 `SKIP LOCKED`，
+        交易已被其他請求鎖定（通知處理中）時不等待，直接回傳 False。
+
+        :param skip_locked: 已被鎖定時立即回傳 False 而不等待
+        :return: 是否取得鎖定
+        """
+        self.ensure_one()
+        self.env.cr.execute(
+            'SELECT id FROM payment_transaction WHERE id = %s FOR UPDATE' + (' SKIP LOCKED' if skip_locked else ''),
+            (self.id,),
+        )
+        return self.env.cr.fetchone() is not None
+
+    def _newebpay_notification_applied(self, notification):
+        """
+        交易是否已套用此通知的結果（藍新交易序號與通知相同，且交易已是終態，
+        或通知為處理中且交易已是處理中）
+
+        :param notification: 已解碼的 NewebPayNotification
+        """
+        self.ensure_one()
+        trade_info = notification.trade_info or {}
+        if not self.newebpay_trade_no or self.newebpay_trade_no != trade_info.get('TradeNo'):
+            return False
+        if self.state in ('done', 'cancel', 'error'):
+            return True
+        return self.state == 'pending' and trade_info.get('Status') not in ('SUCCESS', 'FAIL')
+
     def _process_notification_data(self, notification_data):
         """ 處理藍新金流的回調通知 """
         super()._process_notification_data(notification_data)
         if self.provider_code != 'newebpay':
             return
 
+        timings = notification_data.timings if isinstance(notification_data, NewebPayNotification) else None
+        with tracing.span('process', timings), self.env['newebpay.payment.stats']._track(self):
+            self._newebpay_apply_notification(notification_data)
+
+    def _newebpay_apply_notification(self, notification_data):
+        """ 驗證並套用藍新金流回調通知的付款結果 """
         try:
+            # 沿用已解碼的通知（提供者不同時才以此交易的提供者重新解碼）
+            notification = self._newebpay_decode_notification(notification_data, provider=self.provider_id)
+
             # 驗證回調資料的簽名
-            if not self._verify_newebpay_notification(notification_data):
+            if not self._verify_newebpay_notification(notification):
                 _logger.warning('藍新金流回調驗證失敗 - 交易: %s', self.reference)
                 self._set_error(_('回調驗證失敗'))
                 return
 
-            # 解密回調資料
-            trade_info_encrypted = notification_data.get('TradeInfo')
-            if not trade_info_encrypted:
-                _logger.error('回調資料中缺少 TradeInfo')
+            trade_info = notification.trade_info
+            if trade_info is None:
+                _logger.error('回調資料無法解密 - 交易: %s, 錯誤: %s', self.reference, notification.error)
                 self._set_error(_('回調資料不完整'))
                 return
 
-            provider = self.provider_id
-            trade_info = NewebPayCrypto.decrypt_trade_info(
-                trade_info_encrypted,
-                provider.newebpay_hash_key,
-                provider.newebpay_hash_iv
-            )
-
-            _logger.info('處理藍新金流回調 - 交易: %s, 資料: %s', self.reference, trade_info)
+            _logger.info('處理藍新金流回調 - 交易: %s, 狀態: %s', self.reference, trade_info.get('Status'))
+            tracing.capture('process', trade_info, '回調資料')
 
             # 儲存藍新交易序號和支付方式
             self.newebpay_trade_no = trade_info.get('TradeNo')
@@ -306,34 +464,19 @@ class PaymentTransaction(models.Model):
             self._set_error(_('處理回調時發生錯誤: %s') % str(e))
 
     def _verify_newebpay_notification(self, notification_data):
-        """ 驗證藍新金流回調通知的簽名 """
+        """ 驗證藍新金流回調通知的簽名（沿用解碼時的驗證結果，不重複計算） """
         try:
-            trade_info = notification_data.get('TradeInfo')
-            trade_sha = notification_data.get('TradeSha')
-
-            if not trade_info or not trade_sha:
-                _logger.error('回調資料中缺少 TradeInfo 或 TradeSha')
+            notification = self._newebpay_decode_notification(notification_data, provider=self.provider_id)
+            if notification.error and not notification.verified:
+                _logger.error('藍新金流回調簽名無法驗證: %s', notification.error)
                 return False
 
-            provider = self.provider_id
-            if not provider.newebpay_hash_key or not provider.newebpay_hash_iv:
-                _logger.error('藍新金流設定不完整')
-                return False
-
-            # 驗證簽名
-            is_valid = NewebPayCrypto.verify_trade_sha(
-                trade_info,
-                trade_sha,
-                provider.newebpay_hash_key,
-                provider.newebpay_hash_iv
-            )
-
-            if is_valid:
+            if notification.verified:
                 _logger.debug('藍新金流回調簽名驗證成功')
             else:
                 _logger.warning('藍新金流回調簽名驗證失敗')
 
-            return is_valid
+            return notification.verified
 
         except Exception as e:
             _logger.error('驗證藍新金流回調簽名時發生錯誤: %s', str(e), exc_info=True)
@@ -358,23 +501,21 @@ class PaymentTransaction(models.Model):
             if refund_amount > self.amount:
                 raise ValidationError(_('退款金額不能超過原始交易金額'))
 
-            _logger.info('準備執行退款 - 交易: %s, 退款金額: %s', self.reference, refund_amount)
+            # 非同步模式：寫入退款佇列後立即返回，由排程送出並更新退款狀態
+            if provider.newebpay_async_refund:
+                self.env['newebpay.refund.queue'].sudo()._enqueue(self, refund_amount)
+                return True
 
-            # 使用 API 客戶端執行退款
-            from ..utils.api_client import NewebPayAPIClient
+            _logger.info('準備執行退款 - 交易: %s, 退款金額: %s', self.reference, refund_amount)
 
-            api_client = NewebPayAPIClient(
-                merchant_id=provider.newebpay_merchant_id,
-                hash_key=provider.newebpay_hash_key,
-                hash_iv=provider.newebpay_hash_iv,
-                test_mode=provider.newebpay_test_mode
-            )
+            # 使用 API 客戶端執行退款（共用行程內的 keep-alive 連線池）
+            api_client = provider._newebpay_get_api_client()
 
             # 執行退款
             refund_response = api_client.refund(
                 trade_no=self.newebpay_trade_no,
                 refund_amount=refund_amount,
-                order_no=self.reference
+                order_no=self.newebpay_merchant_order_no or self.reference
             )
 
             # 處理退款回應
@@ -383,8 +524,11 @@ class PaymentTransaction(models.Model):
                 message = refund_response.get('Message', '')
 
                 # 儲存退款交易序號和狀態
-                self.newebpay_refund_trade_no = refund_response.get('TradeNo', '')
-                self.newebpay_refund_status = status
+                with self.env['newebpay.payment.stats']._track(self):
+                    self.newebpay_refund_trade_no = refund_response.get('TradeNo', '')
+                    self.newebpay_refund_status = status
+                    if status == 'SUCCESS':
+                        self.newebpay_refunded_amount += refund_amount
 
                 if status == 'SUCCESS':
                     _logger.info('退款成功 - 交易: %s, 退款金額: %s', self.reference, refund_amount)
@@ -396,8 +540,283 @@ class PaymentTransaction(models.Model):
 
             return False
 
-        except ValidationError:
+        except UserError:
             raise
         except Exception as e:
             _logger.error('執行退款時發生錯誤: %s', str(e), exc_info=True)
             raise ValidationError(_('執行退款時發生錯誤: %s') % str(e))
+
+    def _newebpay_bulk_refund(self, domain=None, max_workers=None, rate_per_merchant=None, commit_size=None):
+        """
+        批次退款（例如活動取消時的大量信用卡退款）
+
+        交易資料先在主執行緒整理完成，退款 HTTP 請求以有上限的執行緒池並行送出，
+        並依商店代號限流；結果在主執行緒分批寫回 `newebpay_refund_trade_no` /
+        `newebpay_refund_status` 並提交。每筆交易退還尚未退款的餘額（已部分退款的交易只退剩餘金額）。
+
+        送出前先鎖定交易並標記為 `QUEUED` 後提交（`_newebpay_claim_bulk_refund`），
+        同時執行的批次退款或退款佇列不會重複送出。前一次結果不明（`ERROR`，例如逾時）的交易
+        先以查詢交易 API 確認藍新金流的已退款金額，不會重複退款。
+
+        :param domain: 搜尋條件（指定時取代目前的記錄集）
+        :param max_workers: 同時進行的退款請求上限
+        :param rate_per_merchant: 每個商店代號每秒最多送出的退款請求數
+        :param commit_size: 每寫回多少筆結果提交一次
+        :return: 摘要字典（total / submitted / succeeded / failed / skipped / already_refunded /
+                 unconfirmed / errors 等）
+        """
+        transactions = self.search(domain) if domain is not None else self
+        testing = getattr(threading.current_thread(), 'testing', False)
+        claimed, previous_status = transactions._newebpay_claim_bulk_refund()
+        already_refunded, unconfirmed = claimed.filtered(
+            lambda tx: previous_status[tx.id] == const.REFUND_STATUS_ERROR
+        )._newebpay_confirm_refunded_amount(max_workers=max_workers)
+        if not testing:
+            self.env.cr.commit()
+        eligible = claimed - already_refunded - unconfirmed
+        skipped = len(transactions) - len(eligible)
+
+        clients = {}
+        requests = []
+        amounts = {}
+        for tx in eligible:
+            provider = tx.provider_id
+            if provider not in clients:
+                clients[provider] = provider._newebpay_get_api_client()
+            amounts[tx.id] = tx.amount - tx.newebpay_refunded_amount
+            requests.append(RefundRequest(
+                tx_id=tx.id,
+                merchant_id=provider.newebpay_merchant_id,
+                client=clients[provider],
+                trade_no=tx.newebpay_trade_no,
+                amount=amounts[tx.id],
+                order_no=tx.newebpay_merchant_order_no or tx.reference,
+            ))
+
+        _logger.info(
+            '開始批次退款 - 交易筆數: %s, 略過: %s（已確認退款: %s, 無法確認: %s）',
+            len(requests), skipped, len(already_refunded), len(unconfirmed),
+        )
+
+        def _write_batch(results):
+            batch = self.browse([result.tx_id for result in results])
+            with self.env['newebpay.payment.stats']._track(batch):
+                for result in results:
+                    tx = self.browse(result.tx_id)
+                    vals = {
+                        'newebpay_refund_trade_no': result.refund_trade_no or tx.newebpay_refund_trade_no,
+                        'newebpay_refund_status': result.status,
+                    }
+                    if result.success:
+                        vals['newebpay_refunded_amount'] = tx.newebpay_refunded_amount + amounts[tx.id]
+                    tx.write(vals)
+            if not testing:
+                self.env.cr.commit()
+
+        engine = BulkRefundEngine(
+            max_workers=max_workers or const.BULK_REFUND_MAX_WORKERS,
+            rate_per_merchant=rate_per_merchant or const.BULK_REFUND_RATE_PER_MERCHANT,
+        )
+        results = engine.run(requests, _write_batch, batch_size=commit_size or const.BULK_REFUND_COMMIT_SIZE)
+        summary = engine.summarize(results, skipped=skipped)
+        summary.update(already_refunded=len(already_refunded), unconfirmed=len(unconfirmed))
+
+        _logger.info(
+            '批次退款完成 - 總筆數: %s, 成功: %s, 失敗: %s, 略過: %s',
+            summary['total'], summary['succeeded'], summary['failed'], summary['skipped']
+        )
+        return summary
+
+    def _newebpay_claim_bulk_refund(self):
+        """
+        鎖定可退款的交易並標記為 `QUEUED`（呼叫端提交後才送出退款）
+
+        以 `FOR UPDATE SKIP LOCKED` 鎖定，被其他請求鎖定（例如同時寫入退款佇列）的交易略過；
+        鎖定後重新讀取退款狀態，已在退款佇列或其他批次退款中的交易、已全額退款的交易不處理。
+
+        :return: (標記的交易, {交易 ID: 標記前的退款狀態})
+        """
+        candidates = self.filtered(
+            lambda tx: tx.provider_code == 'newebpay' and tx.state == 'done' and tx.newebpay_trade_no
+        )
+        if not candidates:
+            return self.browse(), {}
+        self.env.cr.execute(
+            'SELECT id FROM payment_transaction WHERE id = ANY(%s) FOR UPDATE SKIP LOCKED',
+            (candidates.ids,),
+        )
+        locked = self.browse([row[0] for row in self.env.cr.fetchall()])
+        locked.invalidate_recordset(['newebpay_refund_status', 'newebpay_refunded_amount'])
+        queued = self.env['newebpay.refund.queue'].sudo().search([
+            ('transaction_id', 'in', locked.ids),
+            ('state', '=', 'pending'),
+        ]).transaction_id
+        claimed = (locked - queued).filtered(
+            lambda tx: tx.newebpay_refund_status not in (const.REFUND_STATUS_QUEUED, const.REFUND_STATUS_RETRYING)
+            and tx.amount - tx.newebpay_refunded_amount > 0.01
+        )
+        previous_status = {tx.id: tx.newebpay_refund_status for tx in claimed}
+        claimed.write({'newebpay_refund_status': const.REFUND_STATUS_QUEUED})
+        return claimed, previous_status
+
+    def _newebpay_confirm_refunded_amount(self, max_workers=None):
+        """
+        以查詢交易 API 確認前一次結果不明的退款，將本地的已退款金額更新為藍新金流的金額
+
+        :param max_workers: 同時進行的查詢請求上限
+        :return: (已全額退款的交易, 無法確認而略過的交易)；無法確認的交易還原為 `ERROR`
+        """
+        already_refunded = unconfirmed = self.browse()
+        if not self:
+            return already_refunded, unconfirmed
+        results = self._newebpay_query_trade_status(max_workers=max_workers)
+        with self.env['newebpay.payment.stats']._track(self):
+            for tx in self:
+                result = results.get(tx.id)
+                refunded = None
+                if not (isinstance(result, Exception) or result is None):
+                    refunded = tx._newebpay_gateway_refunded_amount(result)
+                if refunded is None or refunded < tx.newebpay_refunded_amount - 0.01:
+                    _logger.warning('無法確認前一次批次退款結果，略過 - 交易: %s, 查詢結果: %s', tx.reference, result)
+                    tx.newebpay_refund_status = const.REFUND_STATUS_ERROR
+                    unconfirmed |= tx
+                    continue
+                if refunded > tx.newebpay_refunded_amount + 0.01:
+                    _logger.info('前一次批次退款已完成 - 交易: %s, 已退款金額: %s', tx.reference, refunded)
+                    tx.newebpay_refunded_amount = refunded
+                if tx.amount - refunded <= 0.01:
+                    tx.newebpay_refund_status = const.REFUND_STATUS_SUCCESS
+                    already_refunded |= tx
+        return already_refunded, unconfirmed
+
+    @api.model
+    def _cron_newebpay_reconcile_pending(self, page_size=None, max_workers=None):
+        """
+        排程：以查詢交易 API 對帳待付款的藍新交易（補救遺失的伺服器通知）
+
+        依 ID 分頁取出待付款交易，每頁以有上限的執行緒池並行查詢（共用連線池），
+        回應驗證後依結果分組批次更新狀態，每頁提交一次。
+
+        :param page_size: 每頁查詢筆數
+        :param max_workers: 同時進行的查詢請求上限
+        :return: 各結果的筆數統計字典
+        """
+        page_size = page_size or const.RECONCILE_PAGE_SIZE
+        testing = getattr(threading.current_thread(), 'testing', False)
+        summary = defaultdict(int)
+        last_id = 0
+        while True:
+            page = self.search([
+                ('state', '=', 'pending'),
+                ('provider_code', '=', 'newebpay'),
+                ('id', '>', last_id),
+            ], order='id', limit=page_size)
+            if not page:
+                break
+            last_id = page[-1].id
+            results = page._newebpay_query_trade_status(max_workers=max_workers)
+            with self.env['newebpay.payment.stats']._track(page):
+                page._newebpay_apply_trade_status(results, summary)
+            if not testing:
+                self.env.cr.commit()
+
+        if summary:
+            _logger.info('藍新金流待付款交易對帳完成 - 結果: %s', dict(summary))
+        return dict(summary)
+
+    def _newebpay_query_trade_status(self, max_workers=None):
+        """
+        並行查詢交易狀態（不接觸 ORM 的部分在工作執行緒中執行）
+
+        :param max_workers: 同時進行的查詢請求上限
+        :return: {交易 ID: Result 字典或 Exception}
+        """
+        clients = {}
+        requests = []
+        for tx in self:
+            provider = tx.provider_id
+            if provider not in clients:
+                clients[provider] = provider._newebpay_get_api_client()
+            requests.append((tx.id, clients[provider], tx.newebpay_merchant_order_no or tx.reference, tx.amount))
+
+        def _query(request):
+            tx_id, client, order_no, amount = request
+            try:
+                return tx_id, client.query_trade_info(order_no, amount)
+            except Exception as e:
+                return tx_id, e
+
+        with ThreadPoolExecutor(
+            max_workers=max_workers or const.RECONCILE_MAX_WORKERS,
+            thread_name_prefix='newebpay_query',
+        ) as executor:
+            return dict(executor.map(_query, requests))
+
+    def _newebpay_gateway_refunded_amount(self, result):
+        """
+        由查詢交易 API 的結果取得藍新金流端已退款的金額
+
+        TradeStatus 為退款（6）只表示交易有過退款（可能是先前的部分退款），
+        金額以信用卡的可退款餘額（BackBalance）計算。
+
+        :param result: `query_trade_info` 回傳的 Result 字典
+        :return: 已退款金額；交易已退款但回應沒有可退款餘額時為 None（無法判斷）
+        """
+        self.ensure_one()
+        try:
+            return max(float(result.get('Amt') or self.amount) - float(result['BackBalance']), 0.0)
+        except (KeyError, TypeError, ValueError):
+            pass
+        if str(result.get('TradeStatus', '')) != const.TRADE_STATUS_REFUNDED:
+            return 0.0
+        return None
+
+    def _newebpay_apply_trade_status(self, results, summary):
+        """
+        依查詢結果分組批次更新交易狀態
+
+        :param results: `_newebpay_query_trade_status` 的回傳值
+        :param summary: 累計各結果筆數的字典
+        """
+        done_ids = []
+        cancel_ids = []
+        error_ids = defaultdict(list)
+        for tx in self:
+            result = results.get(tx.id)
+            if isinstance(result, Exception) or result is None:
+                _logger.warning('查詢藍新交易狀態失敗 - 交易: %s, 錯誤: %s', tx.reference, result)
+                summary['query_failed'] += 1
+                continue
+
+            trade_status = str(result.get('TradeStatus', ''))
+            if result.get('TradeNo') or result.get('PaymentType'):
+                tx.write({
+                    'newebpay_trade_no': result.get('TradeNo') or tx.newebpay_trade_no,
+                    'newebpay_payment_type': result.get('PaymentType') or tx.newebpay_payment_type,
+                })
+
+            if trade_status == const.TRADE_STATUS_PAID:
+                if abs(float(result.get('Amt', 0)) - tx.amount) > 0.01:
+                    error_ids[_('金額驗證失敗')].append(tx.id)
+                    summary['amount_mismatch'] += 1
+                else:
+                    done_ids.append(tx.id)
+                    summary['done'] += 1
+            elif trade_status == const.TRADE_STATUS_FAILED:
+                error_ids[result.get('RespondMsg') or _('付款失敗')].append(tx.id)
+                summary['error'] += 1
+            elif trade_status == const.TRADE_STATUS_CANCELED:
+                cancel_ids.append(tx.id)
+                summary['cancel'] += 1
+            elif trade_status == const.TRADE_STATUS_UNPAID:
+                summary['still_pending'] += 1
+            else:
+                _logger.warning('未處理的藍新交易狀態 - 交易: %s, TradeStatus: %s', tx.reference, trade_status)
+                summary['unknown'] += 1
+
+        if done_ids:
+            self.browse(done_ids)._set_done()
+        if cancel_ids:
+            self.browse(cancel_ids)._set_canceled(_('藍新金流交易已取消'))
+        for message, tx_ids in error_ids.items():
+            self.browse(tx_ids)._set_error(message)
@@ -0,0 +1,5 @@
+# -*- coding: utf-8 -*-
+
+from . import test_bulk_refund
+from . import test_codec
+from . import test_refund_queue
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+
+import threading
+from contextlib import contextmanager
+from unittest.mock import patch
+
+from odoo.addons.payment.tests.common import PaymentCommon
+
+from odoo.addons.newebpay_payment.models.payment_provider import PaymentProvider
+
+HASH_KEY = '12345678901234567890123456789012'
+HASH_IV = '1234567890123456'
+
+
+class FakeAPIClient:
+    """
+    `NewebPayAPIClient` 替身：記錄退款與查詢請求，回傳預先設定的結果
+
+    `refund_response` 為退款回應（例外時拋出）；`query_results` 依商店訂單編號設定查詢結果，
+    未設定時回傳已付款、尚未退款的交易。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.refunds = []
+        self.queries = []
+        self.refund_response = {'Status': 'SUCCESS', 'TradeNo': 'R0001', 'Message': '退款成功'}
+        self.query_results = {}
+
+    def refund(self, trade_no, refund_amount, order_no=None):
+        with self._lock:
+            self.refunds.append((trade_no, refund_amount, order_no))
+        if isinstance(self.refund_response, Exception):
+            raise self.refund_response
+        return dict(self.refund_response)
+
+    def query_trade_info(self, order_no, amount):
+        with self._lock:
+            self.queries.append((order_no, amount))
+        result = self.query_results.get(order_no)
+        if isinstance(result, Exception):
+            raise result
+        return result or {'TradeStatus': '1', 'Amt': int(amount), 'BackBalance': int(amount)}
+
+
+class NewebPayCommon(PaymentCommon):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.newebpay = cls._prepare_provider('newebpay', update_values={
+            'newebpay_merchant_id': 'MS000001',
+            'newebpay_hash_key': HASH_KEY,
+            'newebpay_hash_iv': HASH_IV,
+            'newebpay_test_mode': True,
+        })
+        cls.provider = cls.newebpay
+        cls.payment_method_id = cls.env.ref('newebpay_payment.payment_method_newebpay').id
+
+    def _create_done_transaction(self, reference, amount=1000.0, **values):
+        """ 建立已付款的藍新交易（藍新交易序號與商店訂單編號由交易編號產生） """
+        return self._create_transaction(
+            'redirect',
+            reference=reference,
+            amount=amount,
+            state='done',
+            newebpay_trade_no=f'T{reference}',
+            newebpay_merchant_order_no=reference.replace('-', ''),
+            **values,
+        )
+
+    @contextmanager
+    def mock_api_client(self):
+        """ 以 `FakeAPIClient` 取代提供者的 API 客戶端 """
+        client = FakeAPIClient()
+        with patch.object(PaymentProvider, '_newebpay_get_api_client', lambda _provider: client):
+            yield client
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+
+from odoo.tests import tagged
+
+from odoo.addons.newebpay_payment import const
+from odoo.addons.newebpay_payment.tests.common import NewebPayCommon
+
+
+@tagged('post_install', '-at_install')
+class TestBulkRefund(NewebPayCommon):
+    """ 批次退款：送出前標記、退還剩餘金額、結果不明的交易先查詢 """
+
+    def setUp(self):
+        super().setUp()
+        self.tx_full = self._create_done_transaction('EV-0001')
+        self.tx_partial = self._create_done_transaction('EV-0002', newebpay_refunded_amount=300.0,
+                                                        newebpay_refund_status=const.REFUND_STATUS_SUCCESS)
+        self.tx_refunded = self._create_done_transaction('EV-0003', newebpay_refunded_amount=1000.0,
+                                                         newebpay_refund_status=const.REFUND_STATUS_SUCCESS)
+        self.transactions = self.tx_full | self.tx_partial | self.tx_refunded
+
+    def test_refunds_remaining_balance(self):
+        with self.mock_api_client() as client:
+            summary = self.transactions._newebpay_bulk_refund()
+        self.assertEqual(sorted(client.refunds), [
+            ('TEV-0001', 1000.0, 'EV0001'),
+            ('TEV-0002', 700.0, 'EV0002'),
+        ])
+        self.assertEqual((summary['submitted'], summary['succeeded'], summary['skipped']), (2, 2, 1))
+        self.assertRecordValues(self.transactions, [
+            {'newebpay_refund_status': const.REFUND_STATUS_SUCCESS, 'newebpay_refunded_amount': 1000.0},
+            {'newebpay_refund_status': const.REFUND_STATUS_SUCCESS, 'newebpay_refunded_amount': 1000.0},
+            {'newebpay_refund_status': const.REFUND_STATUS_SUCCESS, 'newebpay_refunded_amount': 1000.0},
+        ])
+        self.assertEqual(self.tx_full.newebpay_refund_trade_no, 'R0001')
+
+    def test_declined_keeps_refunded_amount(self):
+        with self.mock_api_client() as client:
+            client.refund_response = {'Status': 'TRA10002', 'Message': '退款金額超過可退款金額'}
+            summary = self.tx_partial._newebpay_bulk_refund()
+        self.assertEqual(summary['failed'], 1)
+        self.assertRecordValues(self.tx_partial, [{
+            'newebpay_refund_status': 'TRA10002',
+            'newebpay_refunded_amount': 300.0,
+        }])
+
+    def test_skips_claimed_and_queued_transactions(self):
+        """ 已在退款佇列或其他批次退款中的交易不送出 """
+        self.env['newebpay.refund.queue'].sudo()._enqueue(self.tx_full, 1000.0)
+        self.tx_partial.newebpay_refund_status = const.REFUND_STATUS_QUEUED
+        with self.mock_api_client() as client:
+            summary = self.transactions._newebpay_bulk_refund()
+        self.assertFalse(client.refunds)
+        self.assertEqual(summary['skipped'], 3)
+
+    def test_unknown_outcome_is_queried_first(self):
+        """ 前一次逾時（ERROR）但藍新金流已退款：更新已退款金額，不重複送出 """
+        self.tx_full.newebpay_refund_status = const.REFUND_STATUS_ERROR
+        with self.mock_api_client() as client:
+            client.query_results['EV0001'] = {'TradeStatus': '6', 'Amt': 1000, 'BackBalance': 0}
+            summary = self.tx_full._newebpay_bulk_refund()
+        self.assertEqual(client.queries, [('EV0001', 1000.0)])
+        self.assertFalse(client.refunds)
+        self.assertEqual(summary['already_refunded'], 1)
+        self.assertRecordValues(self.tx_full, [{
+            'newebpay_refund_status': const.REFUND_STATUS_SUCCESS,
+            'newebpay_refunded_amount': 1000.0,
+        }])
+
+    def test_unknown_outcome_not_refunded_is_sent(self):
+        self.tx_full.newebpay_refund_status = const.REFUND_STATUS_ERROR
+        with self.mock_api_client() as client:
+            self.tx_full._newebpay_bulk_refund()
+        self.assertEqual(len(client.queries), 1)
+        self.assertEqual(client.refunds, [('TEV-0001', 1000.0, 'EV0001')])
+        self.assertEqual(self.tx_full.newebpay_refunded_amount, 1000.0)
+
+    def test_unknown_outcome_unconfirmed_is_skipped(self):
+        self.tx_full.newebpay_refund_status = const.REFUND_STATUS_ERROR
+        with self.mock_api_client() as client:
+            client.query_results['EV0001'] = {'TradeStatus': '6', 'Amt': 1000}
+            summary = self.tx_full._newebpay_bulk_refund()
+        self.assertFalse(client.refunds)
+        self.assertEqual(summary['unconfirmed'], 1)
+        self.assertRecordValues(self.tx_full, [{
+            'newebpay_refund_status': const.REFUND_STATUS_ERROR,
+            'newebpay_refunded_amount': 0.0,
+        }])
+
+    def test_transient_error_is_recorded(self):
+        with self.mock_api_client() as client:
+            client.refund_response = ConnectionError('connection reset')
+            summary = self.tx_full._newebpay_bulk_refund()
+        self.assertEqual(summary['failed'], 1)
+        self.assertRecordValues(self.tx_full, [{
+            'newebpay_refund_status': const.REFUND_STATUS_ERROR,
+            'newebpay_refunded_amount': 0.0,
+        }])
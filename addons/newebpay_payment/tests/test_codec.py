@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import random
+from urllib.parse import quote, unquote
+
+from Crypto.Cipher import AES
+from Crypto.Util.Padding import pad, unpad
+
+from odoo.tests import BaseCase, tagged
+
+from odoo.addons.newebpay_payment.utils import codec
+from odoo.addons.newebpay_payment.utils.crypto import NewebPayCrypto
+
+HASH_KEY = '12345678901234567890123456789012'
+HASH_IV = '1234567890123456'
+
+# 產生隨機字串用的字元（含 URL 保留字元、百分比編碼片段、反斜線跳脫序列、多位元組字元與 surrogate）
+ALPHABET = (
+    list('abcXYZ019_.-~ +/?#&=%:;,@!*\'()[]"<>')
+    + ['%', '%2', '%20', '%zz', '%E4%B8', '%E4%B8%AD', '%ff', '%C3%A9', '%2B', '%26', '%3D', '%5C', '%00']
+    + ['\\', '\\\\', '\\x41', '\\x', '\\n', '\\%41', '\\u4e2d', '\\N{DASH}', '\\0']
+    + ['中', '文', 'é', '😀', '\t', '\n', '\x00', '\ud800']
+)
+
+
+def reference_build_query(params):
+    """ 原本的實作：`quote(str(value), safe='')` """
+    return '&'.join(f"{key}={quote(str(value), safe='')}" for key, value in params.items())
+
+
+def reference_parse_query(text):
+    """ 原本的實作：`split` + `unquote` """
+    params = {}
+    for pair in text.split('&'):
+        if '=' in pair:
+            key, value = pair.split('=', 1)
+            params[key] = unquote(value)
+    return params
+
+
+def reference_encrypt(cipher, text):
+    """ 原本的實作：`Crypto.Util.Padding.pad` """
+    return cipher.encrypt(pad(text.encode('utf-8'), 16)).hex()
+
+
+def reference_decrypt(cipher, trade_info):
+    """ 原本的實作：`Crypto.Util.Padding.unpad` """
+    return unpad(cipher.decrypt(bytes.fromhex(trade_info)), 16).decode('utf-8')
+
+
+def reference_trade_sha(trade_info):
+    """ 原本的實作：SHA256("HashKey=" + HashKey + "&" + TradeInfo + "&HashIV=" + HashIV) 轉大寫 """
+    return hashlib.sha256(f'HashKey={HASH_KEY}&{trade_info}&HashIV={HASH_IV}'.encode('utf-8')).hexdigest().upper()
+
+
+def new_cipher():
+    return AES.new(HASH_KEY.encode(), AES.MODE_CBC, HASH_IV.encode())
+
+
+def outcome(func, *args):
+    """ 執行並回傳結果，或例外類型與訊息 """
+    try:
+        return 'ok', func(*args)
+    except Exception as e:
+        return 'error', type(e).__name__, str(e)
+
+
+@tagged('post_install', '-at_install')
+class TestCodecEquivalence(BaseCase):
+    """ `utils.codec` 與原本 `quote` / `unquote` + `Crypto.Util.Padding` 實作逐位元組等價 """
+
+    CASES = 2000
+
+    def setUp(self):
+        super().setUp()
+        self.rng = random.Random(20241018)
+
+    def _random_text(self, max_length=24):
+        return ''.join(self.rng.choice(ALPHABET) for _i in range(self.rng.randint(0, max_length)))
+
+    def _random_value(self):
+        kind = self.rng.randrange(6)
+        if kind == 0:
+            return self.rng.randint(-10 ** 6, 10 ** 12)
+        if kind == 1:
+            return self.rng.uniform(-1e6, 1e6)
+        if kind == 2:
+            return self.rng.choice([None, True, False, 0, '', 1.5])
+        return self._random_text()
+
+    def assertSameOutcome(self, reference, candidate, *args):
+        self.assertEqual(outcome(candidate, *args), outcome(reference, *args), f'輸入: {args!r}')
+
+    def assertSameDecrypt(self, hex_data):
+        self.assertSameOutcome(
+            lambda h: reference_decrypt(new_cipher(), h),
+            lambda h: codec.decrypt(new_cipher(), h),
+            hex_data,
+        )
+
+    # ---- 隨機資料 ----
+
+    def test_build_query_random(self):
+        for _i in range(self.CASES):
+            params = {self._random_text(8): self._random_value() for _j in range(self.rng.randint(0, 8))}
+            self.assertSameOutcome(reference_build_query, codec.build_query, params)
+
+    def test_parse_query_random(self):
+        for _i in range(self.CASES):
+            self.assertSameOutcome(reference_parse_query, codec.parse_query, self._random_text(64))
+
+    def test_encrypt_random(self):
+        for _i in range(self.CASES):
+            self.assertSameOutcome(
+                lambda t: reference_encrypt(new_cipher(), t),
+                lambda t: codec.encrypt(new_cipher(), t),
+                self._random_text(64),
+            )
+
+    def test_decrypt_random(self):
+        """ 正常密文、非 UTF-8 明文、錯誤 padding、長度不符、大寫、非十六進位字元 """
+        for _i in range(self.CASES):
+            raw = bytes(self.rng.randrange(256) for _j in range(self.rng.randint(0, 64)))
+            valid = reference_encrypt(new_cipher(), self._random_text(64).replace('\ud800', ''))
+            kind = self.rng.randrange(6)
+            if kind == 0:
+                padding = 16 - len(raw) % 16
+                hex_data = new_cipher().encrypt(raw + bytes((padding,)) * padding).hex()
+            elif kind == 1:
+                hex_data = new_cipher().encrypt(raw[:len(raw) // 16 * 16]).hex()
+            elif kind == 2:
+                hex_data = valid
+            elif kind == 3:
+                hex_data = valid[:-self.rng.randint(1, 31)]
+            elif kind == 4:
+                hex_data = valid.upper()
+            else:
+                hex_data = valid[:-1] + self.rng.choice('gz ')
+            self.assertSameDecrypt(hex_data)
+
+    def test_round_trip_random(self):
+        for _i in range(self.CASES):
+            params = {
+                f'K{index}': self._random_text().replace('\ud800', '')
+                for index in range(self.rng.randint(0, 8))
+            }
+            trade_info = NewebPayCrypto.encrypt_trade_info(params, HASH_KEY, HASH_IV)
+            self.assertEqual(trade_info, reference_encrypt(new_cipher(), reference_build_query(params)))
+            self.assertEqual(NewebPayCrypto.decrypt_trade_info(trade_info, HASH_KEY, HASH_IV), params)
+
+    # ---- padding 邊界 ----
+
+    def test_padding_block_boundaries(self):
+        """ 明文長度落在區塊邊界前後（含多位元組字元跨越邊界） """
+        for length in range(0, 4 * codec.BLOCK_SIZE + 2):
+            for text in ('a' * length, 'é' * length, '中' + 'a' * length):
+                with self.subTest(length=length, text=text[:4]):
+                    self.assertSameOutcome(
+                        lambda t: reference_encrypt(new_cipher(), t),
+                        lambda t: codec.encrypt(new_cipher(), t),
+                        text,
+                    )
+                    self.assertSameDecrypt(reference_encrypt(new_cipher(), text))
+                    data = text.encode('utf-8')
+                    self.assertEqual(bytes(codec.pad_into(data)), pad(data, codec.BLOCK_SIZE))
+
+    def test_padding_invalid(self):
+        """ padding 位元組為 0、大於區塊大小、前後不一致、資料不足一個區塊或為空 """
+        block = b'0123456789abcdef'
+        for plain in (
+            block[:15] + b'\x00',
+            block[:15] + b'\x11',
+            block[:15] + b'\xff',
+            block[:14] + b'\x01\x02',
+            block[:13] + b'\x02\x03\x03',
+            block + block[:15] + b'\x00',
+            b'\x10' * 15 + b'\x11',
+        ):
+            with self.subTest(plain=plain):
+                self.assertSameDecrypt(new_cipher().encrypt(plain).hex())
+        for hex_data in ('', '00', block.hex()[:-2], block.hex() + 'ab'):
+            with self.subTest(hex_data=hex_data):
+                self.assertSameDecrypt(hex_data)
+
+    def test_unpad_view_full_block(self):
+        """ 整個區塊都是 padding 時移除該區塊 """
+        data = bytes((codec.BLOCK_SIZE,)) * codec.BLOCK_SIZE
+        self.assertEqual(bytes(codec.unpad_view(memoryview(data))), b'')
+        block = b'0123456789abcdef'
+        self.assertEqual(bytes(codec.unpad_view(memoryview(block + data))), block)
+
+    # ---- 跳脫序列 ----
+
+    def test_unquote_escape_sequences(self):
+        """ 百分比編碼與 `codecs.escape_decode` 會處理的反斜線序列 """
+        for value in (
+            '', '%', '%%', '%2', '%20', '%zz', '%2G', '%g0', '%E4%B8%AD', '%E4%B8', '%e4%b8%ad',
+            '%ff', '%FF%FE', '%C3%A9', '%00', '%5C', '%5Cx41', '%5C%5C', '%25', '%2541', '%%41',
+            '\\', '\\\\', '\\x41', '\\x4', '\\x', '\\n', '\\t', '\\0', '\\101', '\\u4e2d', '\\N{DASH}',
+            '\\%41', '%41\\', 'a\\x%41', '\\\\x41', '+', 'a+b%2Bc', '中%E6%96%87', '😀%F0%9F%98%80',
+            '\ud800', '%ED%A0%80', 'é\\%C3%A9',
+        ):
+            with self.subTest(value=value):
+                self.assertSameOutcome(unquote, codec._unquote, value)
+                self.assertSameOutcome(reference_parse_query, codec.parse_query, f'K={value}&L={value}')
+
+    def test_parse_query_separators(self):
+        """ 缺少 `=`、重複鍵、空鍵與值中含 `=` """
+        for text in ('', '&', '=', 'a', 'a=', '=b', 'a=b=c', 'a=1&a=2', 'a&b=1&&c=%3D=', 'a=%26&b=%3D'):
+            with self.subTest(text=text):
+                self.assertSameOutcome(reference_parse_query, codec.parse_query, text)
+
+    def test_build_query_values(self):
+        """ 非字串值以 `str()` 轉換，安全字元不編碼 """
+        for value in (None, True, 0, -1, 1.5, 1e20, 'A-Z_a.z~0', 'a b', 'a+b', '中', '\\x41', '%41', '\ud800'):
+            with self.subTest(value=value):
+                self.assertSameOutcome(reference_build_query, codec.build_query, {'K': value})
+
+    # ---- 簽名 ----
+
+    def test_trade_sha(self):
+        trade_info = NewebPayCrypto.encrypt_trade_info({'Amt': 100, 'ItemDesc': '測試'}, HASH_KEY, HASH_IV)
+        trade_sha = NewebPayCrypto.create_trade_sha(trade_info, HASH_KEY, HASH_IV)
+        self.assertEqual(trade_sha, reference_trade_sha(trade_info))
+        self.assertTrue(NewebPayCrypto.verify_trade_sha(trade_info, trade_sha, HASH_KEY, HASH_IV))
+        self.assertTrue(NewebPayCrypto.verify_trade_sha(trade_info, trade_sha.lower(), HASH_KEY, HASH_IV))
+        self.assertFalse(NewebPayCrypto.verify_trade_sha(trade_info + '0', trade_sha, HASH_KEY, HASH_IV))
+        self.assertFalse(NewebPayCrypto.verify_trade_sha(trade_info, '', HASH_KEY, HASH_IV))
+
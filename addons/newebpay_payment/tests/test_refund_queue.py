@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+
+from odoo import fields
+from odoo.exceptions import UserError
+from odoo.tests import tagged
+
+from odoo.addons.newebpay_payment import const
+from odoo.addons.newebpay_payment.tests.common import NewebPayCommon
+
+
+@tagged('post_install', '-at_install')
+class TestRefundQueue(NewebPayCommon):
+    """ 非同步退款佇列：送出前記錄嘗試、重試前先查詢、拒絕與暫時性錯誤的處理 """
+
+    def setUp(self):
+        super().setUp()
+        self.Queue = self.env['newebpay.refund.queue'].sudo()
+        self.tx = self._create_done_transaction('S00012-1')
+
+    def _run_due(self):
+        """ 將所有待送出的退款設為到期並執行排程 """
+        self.Queue.search([('state', '=', 'pending')]).next_attempt_at = fields.Datetime.now()
+        return self.Queue._cron_process_refunds()
+
+    def test_enqueue_rejects_duplicate(self):
+        entry = self.Queue._enqueue(self.tx, 400.0)
+        self.assertEqual(entry.state, 'pending')
+        self.assertEqual(self.tx.newebpay_refund_status, const.REFUND_STATUS_QUEUED)
+        with self.assertRaises(UserError):
+            self.Queue._enqueue(self.tx, 400.0)
+        self.assertEqual(self.Queue.search_count([('transaction_id', '=', self.tx.id)]), 1)
+
+    def test_first_attempt_sends_without_query(self):
+        entry = self.Queue._enqueue(self.tx, 400.0)
+        with self.mock_api_client() as client:
+            summary = self.Queue._cron_process_refunds()
+        self.assertEqual(summary, {'done': 1})
+        self.assertFalse(client.queries)
+        self.assertEqual(client.refunds, [('TS00012-1', 400.0, 'S000121')])
+        self.assertRecordValues(entry, [{'state': 'done', 'attempts': 1, 'refund_trade_no': 'R0001'}])
+        self.assertRecordValues(self.tx, [{
+            'newebpay_refund_status': const.REFUND_STATUS_SUCCESS,
+            'newebpay_refund_trade_no': 'R0001',
+            'newebpay_refunded_amount': 400.0,
+        }])
+
+    def test_claimed_entry_is_not_due_again(self):
+        """ 送出前記錄的嘗試將下次嘗試時間延後，中斷的排程不會立即重新送出 """
+        entry = self.Queue._enqueue(self.tx, 400.0)
+        entry._claim(fields.Datetime.now())
+        self.assertEqual(entry.attempts, 1)
+        self.assertGreater(entry.next_attempt_at, fields.Datetime.now())
+        with self.mock_api_client() as client:
+            self.assertEqual(self.Queue._cron_process_refunds(), {})
+        self.assertFalse(client.refunds)
+
+    def test_retry_already_refunded_is_not_resent(self):
+        """ 前一次請求已在藍新金流完成：查詢後直接標記完成 """
+        entry = self.Queue._enqueue(self.tx, 400.0)
+        entry._claim(fields.Datetime.now())
+        with self.mock_api_client() as client:
+            client.query_results['S000121'] = {'TradeStatus': '6', 'Amt': 1000, 'BackBalance': 600}
+            summary = self._run_due()
+        self.assertEqual(summary, {'already_refunded': 1})
+        self.assertEqual(client.queries, [('S000121', 1000.0)])
+        self.assertFalse(client.refunds)
+        self.assertEqual(entry.state, 'done')
+        self.assertEqual(self.tx.newebpay_refunded_amount, 400.0)
+
+    def test_retry_not_refunded_is_resent(self):
+        entry = self.Queue._enqueue(self.tx, 400.0)
+        entry._claim(fields.Datetime.now())
+        with self.mock_api_client() as client:
+            summary = self._run_due()
+        self.assertEqual(summary, {'done': 1})
+        self.assertEqual(len(client.queries), 1)
+        self.assertEqual(len(client.refunds), 1)
+        self.assertRecordValues(entry, [{'state': 'done', 'attempts': 2}])
+        self.assertEqual(self.tx.newebpay_refunded_amount, 400.0)
+
+    def test_retry_after_earlier_partial_refund(self):
+        """ TradeStatus 6 只表示有過退款：已退款金額只包含先前的部分退款時重新送出 """
+        self.tx.newebpay_refunded_amount = 100.0
+        entry = self.Queue._enqueue(self.tx, 400.0)
+        entry._claim(fields.Datetime.now())
+        with self.mock_api_client() as client:
+            client.query_results['S000121'] = {'TradeStatus': '6', 'Amt': 1000, 'BackBalance': 900}
+            summary = self._run_due()
+        self.assertEqual(summary, {'done': 1})
+        self.assertEqual(len(client.refunds), 1)
+        self.assertEqual(self.tx.newebpay_refunded_amount, 500.0)
+
+    def test_retry_unknown_refunded_amount_stops(self):
+        """ 已退款但無法得知金額：標記錯誤，不自動送出 """
+        entry = self.Queue._enqueue(self.tx, 400.0)
+        entry._claim(fields.Datetime.now())
+        with self.mock_api_client() as client:
+            client.query_results['S000121'] = {'TradeStatus': '6', 'Amt': 1000}
+            summary = self._run_due()
+        self.assertEqual(summary, {'error': 1})
+        self.assertFalse(client.refunds)
+        self.assertEqual(entry.state, 'error')
+        self.assertEqual(self.tx.newebpay_refund_status, const.REFUND_STATUS_ERROR)
+        self.assertEqual(self.tx.newebpay_refunded_amount, 0.0)
+
+    def test_retry_query_failure_is_not_resent(self):
+        entry = self.Queue._enqueue(self.tx, 400.0)
+        entry._claim(fields.Datetime.now())
+        with self.mock_api_client() as client:
+            client.query_results['S000121'] = UserError('timeout')
+            summary = self._run_due()
+        self.assertEqual(summary, {'unconfirmed': 1})
+        self.assertFalse(client.refunds)
+        self.assertEqual(entry.state, 'pending')
+        self.assertGreater(entry.next_attempt_at, fields.Datetime.now())
+        self.assertEqual(self.tx.newebpay_refund_status, const.REFUND_STATUS_RETRYING)
+
+    def test_transient_error_is_retried(self):
+        entry = self.Queue._enqueue(self.tx, 400.0)
+        with self.mock_api_client() as client:
+            client.refund_response = ConnectionError('connection reset')
+            summary = self.Queue._cron_process_refunds()
+        self.assertEqual(summary, {'retry': 1})
+        self.assertRecordValues(entry, [{'state': 'pending', 'attempts': 1}])
+        self.assertGreater(entry.next_attempt_at, fields.Datetime.now())
+        self.assertRecordValues(self.tx, [{
+            'newebpay_refund_status': const.REFUND_STATUS_RETRYING,
+            'newebpay_refunded_amount': 0.0,
+        }])
+
+    def test_transient_error_gives_up_after_max_attempts(self):
+        entry = self.Queue._enqueue(self.tx, 400.0)
+        entry.attempts = const.REFUND_QUEUE_MAX_ATTEMPTS - 1
+        with self.mock_api_client() as client:
+            client.refund_response = ConnectionError('connection reset')
+            self._run_due()
+        self.assertEqual(entry.state, 'error')
+        self.assertEqual(self.tx.newebpay_refund_status, const.REFUND_STATUS_ERROR)
+
+    def test_declined_is_not_retried(self):
+        entry = self.Queue._enqueue(self.tx, 400.0)
+        with self.mock_api_client() as client:
+            client.refund_response = {'Status': 'TRA10002', 'Message': '退款金額超過可退款金額'}
+            summary = self.Queue._cron_process_refunds()
+            self.assertEqual(self._run_due(), {})
+        self.assertEqual(summary, {'declined': 1})
+        self.assertEqual(len(client.refunds), 1)
+        self.assertRecordValues(entry, [{'state': 'error', 'response_status': 'TRA10002'}])
+        self.assertRecordValues(self.tx, [{'newebpay_refund_status': 'TRA10002', 'newebpay_refunded_amount': 0.0}])
+
+    def test_manual_retry_queries_first(self):
+        entry = self.Queue._enqueue(self.tx, 400.0)
+        with self.mock_api_client() as client:
+            client.refund_response = {'Status': 'TRA10002', 'Message': '退款金額超過可退款金額'}
+            self.Queue._cron_process_refunds()
+            entry.action_retry()
+            client.refund_response = {'Status': 'SUCCESS', 'TradeNo': 'R0002', 'Message': '退款成功'}
+            self._run_due()
+        self.assertEqual(len(client.queries), 1)
+        self.assertEqual(entry.state, 'done')
+        self.assertEqual(self.tx.newebpay_refunded_amount, 400.0)
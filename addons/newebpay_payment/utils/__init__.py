@@ -1,4 +1,14 @@
 # -*- coding: utf-8 -*-
 
+from . import cache
+from . import codec
+from . import tracing
 from . import crypto
+from . import http_transport
 from . import api_client
+from . import rate_limit
+from . import bulk_refund
+from . import notification
+from . import admission
+from . import metrics
+from . import settlement
@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+
+"""
+藍新金流回調（notify / return）的前置准入檢查
+
+在任何資料庫存取、解密與 ORM 查詢之前依序檢查：
+
+1. 來源 IP 權杖桶限流（只計算未通過檢查的請求，藍新金流的正常通知不受限）
+2. POST 資料格式（欄位是否齊全、長度與字元集）
+3. 以快取的金鑰（依明文 MerchantID）固定時間比對 TradeSha
+
+金鑰快取依資料庫分開保存，快取中找不到 MerchantID 時才重新載入，
+且每個資料庫在 `refresh_interval` 內最多重新載入一次，大量偽造請求不會造成資料庫查詢。
+通過檢查時回傳驗證成功的金鑰組合，後續解碼沿用驗證結果，每個回調只計算一次 SHA256。
+"""
+
+import re
+import threading
+import time
+
+from .crypto import NewebPayCrypto
+from .rate_limit import TokenBucketRegistry
+
+# 每個來源 IP 每秒允許的未通過檢查請求數（0 表示不限流）
+DEFAULT_RATE_PER_IP = 20
+# 每個來源 IP 允許累積的未通過檢查請求數
+DEFAULT_BURST_PER_IP = 100
+# 金鑰快取重新載入的最短間隔（秒）
+DEFAULT_REFRESH_INTERVAL = 30
+# TradeInfo 長度上限（十六進位字元）
+DEFAULT_MAX_TRADE_INFO_LENGTH = 32768
+
+# 拒絕原因
+REJECT_THROTTLED = 'throttled'
+REJECT_MALFORMED = 'malformed'
+REJECT_UNKNOWN_MERCHANT = 'unknown_merchant'
+REJECT_BAD_SIGNATURE = 'bad_signature'
+
+_MERCHANT_ID_RE = re.compile(r'[A-Za-z0-9_]{1,32}')
+_TRADE_SHA_RE = re.compile(r'[0-9A-Fa-f]{64}')
+_HEX_RE = re.compile(r'[0-9A-Fa-f]+')
+
+
+class NewebPayAdmission:
+    """ 回調前置准入檢查 """
+
+    def __init__(self, rate_per_ip=DEFAULT_RATE_PER_IP, burst_per_ip=DEFAULT_BURST_PER_IP,
+                 refresh_interval=DEFAULT_REFRESH_INTERVAL, max_trade_info_length=DEFAULT_MAX_TRADE_INFO_LENGTH):
+        """
+        :param rate_per_ip: 每個來源 IP 每秒允許的未通過檢查請求數（0 表示不限流）
+        :param burst_per_ip: 每個來源 IP 允許累積的未通過檢查請求數
+        :param refresh_interval: 金鑰快取重新載入的最短間隔（秒）
+        :param max_trade_info_length: TradeInfo 長度上限
+        """
+        self.buckets = None
+        self.configure(rate_per_ip, burst_per_ip)
+        self.refresh_interval = refresh_interval
+        self.max_trade_info_length = max_trade_info_length
+        # 資料庫名稱 → (載入時間, {MerchantID: ((hash_key, hash_iv), ...)})
+        self._keys = {}
+        self._lock = threading.Lock()
+
+    def configure(self, rate_per_ip, burst_per_ip):
+        """
+        調整來源 IP 限流設定（與目前設定相同時不變，設定變更時重新計算所有來源的權杖）
+
+        :param rate_per_ip: 每個來源 IP 每秒允許的未通過檢查請求數（0 表示不限流）
+        :param burst_per_ip: 每個來源 IP 允許累積的未通過檢查請求數
+        """
+        if rate_per_ip <= 0:
+            self.buckets = None
+            return
+        buckets = self.buckets
+        if buckets is None or (buckets.rate, buckets.capacity) != (rate_per_ip, burst_per_ip):
+            self.buckets = TokenBucketRegistry(rate_per_ip, burst_per_ip)
+
+    def validate_shape(self, post):
+        """ 檢查 POST 資料格式，不符時回傳 False """
+        merchant_id = post.get('MerchantID')
+        trade_info = post.get('TradeInfo')
+        trade_sha = post.get('TradeSha')
+        if not isinstance(merchant_id, str) or not _MERCHANT_ID_RE.fullmatch(merchant_id):
+            return False
+        if not isinstance(trade_sha, str) or not _TRADE_SHA_RE.fullmatch(trade_sha):
+            return False
+        if not isinstance(trade_info, str) or not trade_info or len(trade_info) > self.max_trade_info_length:
+            return False
+        # AES-CBC 密文為 16 位元組的倍數（32 個十六進位字元）
+        return len(trade_info) % 32 == 0 and bool(_HEX_RE.fullmatch(trade_info))
+
+    def _get_keys(self, dbname, merchant_id, load_keys, reload=False):
+        """
+        取得商店代號的金鑰組合
+
+        快取未命中（或 `reload` 為 True）且距離上次載入超過重新載入間隔時才呼叫 `load_keys`。
+        """
+        loaded_at, keys = self._keys.get(dbname, (None, {}))
+        if merchant_id in keys and not reload:
+            return keys[merchant_id]
+        if loaded_at is not None and time.monotonic() - loaded_at < self.refresh_interval:
+            return keys.get(merchant_id, ())
+        with self._lock:
+            loaded_at, keys = self._keys.get(dbname, (None, {}))
+            if loaded_at is None or time.monotonic() - loaded_at >= self.refresh_interval:
+                keys = {}
+                for provider_merchant_id, hash_key, hash_iv in load_keys():
+                    if provider_merchant_id and hash_key and hash_iv:
+                        keys[provider_merchant_id] = keys.get(provider_merchant_id, ()) + ((hash_key, hash_iv),)
+                self._keys[dbname] = (time.monotonic(), keys)
+        return keys.get(merchant_id, ())
+
+    @staticmethod
+    def _verify(keys, trade_info, trade_sha):
+        """ 回傳驗證成功的 (hash_key, hash_iv)，都不相符時回傳 None """
+        # 同一商店代號可能有多組金鑰（例如多公司共用商店代號），每組都以固定時間比較
+        verified_key = None
+        for hash_key, hash_iv in keys:
+            if NewebPayCrypto.get_context(hash_key, hash_iv).verify(trade_info, trade_sha) and verified_key is None:
+                verified_key = (hash_key, hash_iv)
+        return verified_key
+
+    def admit(self, dbname, remote_addr, post, load_keys):
+        """
+        執行准入檢查
+
+        每個未通過格式或簽名檢查的請求取用來源 IP 的一個權杖，權杖用完後該來源的請求
+        直接以限流拒絕（不再計算 SHA256）；通過檢查的請求不取用權杖。
+
+        :param dbname: 資料庫名稱
+        :param remote_addr: 來源 IP
+        :param post: 回調的 POST 資料
+        :param load_keys: 載入金鑰的函式，回傳 (MerchantID, HashKey, HashIV) 的可迭代物件（只在快取未命中時呼叫）
+        :return: (拒絕原因, 驗證成功的 (HashKey, HashIV))；通過時拒絕原因為 None
+        """
+        buckets = self.buckets
+        bucket = buckets.get(remote_addr) if buckets is not None else None
+        if bucket is not None and not bucket.has_tokens():
+            return REJECT_THROTTLED, None
+        reason, verified_key = self._check(dbname, post, load_keys)
+        if reason and bucket is not None:
+            bucket.try_acquire()
+        return reason, verified_key
+
+    def _check(self, dbname, post, load_keys):
+        """ 檢查格式與簽名，回傳 (拒絕原因, 驗證成功的 (HashKey, HashIV)) """
+        if not self.validate_shape(post):
+            return REJECT_MALFORMED, None
+        merchant_id = post['MerchantID']
+        keys = self._get_keys(dbname, merchant_id, load_keys)
+        if not keys:
+            return REJECT_UNKNOWN_MERCHANT, None
+        verified_key = self._verify(keys, post['TradeInfo'], post['TradeSha'])
+        if verified_key:
+            return None, verified_key
+        # 金鑰可能已在其他 worker 更新，重新載入（受重新載入間隔限制）後再驗證一次
+        fresh_keys = self._get_keys(dbname, merchant_id, load_keys, reload=True)
+        if fresh_keys != keys:
+            verified_key = self._verify(fresh_keys, post['TradeInfo'], post['TradeSha'])
+            if verified_key:
+                return None, verified_key
+        return REJECT_BAD_SIGNATURE, None
+
+    def check(self, dbname, remote_addr, post, load_keys):
+        """
+        執行准入檢查（參數同 `admit`）
+
+        :return: 拒絕原因；通過時回傳 None
+        """
+        return self.admit(dbname, remote_addr, post, load_keys)[0]
+
+    def invalidate(self, dbname=None):
+        """ 清除金鑰快取（提供者金鑰變更時呼叫） """
+        with self._lock:
+            if dbname is None:
+                self._keys.clear()
+            else:
+                self._keys.pop(dbname, None)
+
+
+default_admission = NewebPayAdmission()
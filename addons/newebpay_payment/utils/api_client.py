@@ -6,13 +6,21 @@
 用於處理退款等 API 請求
 """
 
+import hmac
 import logging
-import urllib.request
+import time
 import urllib.parse
-import urllib.error
 import json
 from odoo import exceptions
+from . import tracing
 from .crypto import NewebPayCrypto
+from .http_transport import (
+    DEFAULT_CONNECT_TIMEOUT,
+    DEFAULT_READ_TIMEOUT,
+    HTTPResponseError,
+    TransportError,
+    get_transport,
+)
 
 _logger = logging.getLogger(__name__)
 
@@ -20,25 +28,38 @@ _logger = logging.getLogger(__name__)
 class NewebPayAPIClient:
     """藍新金流 API 客戶端類別"""
 
-    def __init__(self, merchant_id, hash_key, hash_iv, test_mode=True):
+    def __init__(self, merchant_id, hash_key, hash_iv, test_mode=True,
+                 connect_timeout=DEFAULT_CONNECT_TIMEOUT, read_timeout=DEFAULT_READ_TIMEOUT, transport=None,
+                 base_url=None):
         """
         初始化 API 客戶端
 
+        所有客戶端共用行程內的 keep-alive 連線池，建立客戶端本身不會建立連線。
+
         :param merchant_id: 商店代號
         :param hash_key: Hash Key
         :param hash_iv: Hash IV
         :param test_mode: 是否為測試模式
+        :param connect_timeout: 建立連線逾時（秒）
+        :param read_timeout: 讀取回應逾時（秒）
+        :param transport: 自訂的 HTTP 連線池（未指定時使用行程共用的連線池）
+        :param base_url: 自訂的 API 主機（例如本機模擬端點，未指定時依測試模式決定）
         """
         self.merchant_id = merchant_id
         self.hash_key = hash_key
         self.hash_iv = hash_iv
         self.test_mode = test_mode
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.transport = transport or get_transport()
 
         # 設定 API 端點
-        if test_mode:
-            self.refund_url = 'https://ccore.newebpay.com/API/CreditCard/Cancel'
+        if base_url:
+            self.base_url = base_url.rstrip('/')
         else:
-            self.refund_url = 'https://core.newebpay.com/API/CreditCard/Cancel'
+            self.base_url = 'https://ccore.newebpay.com' if test_mode else 'https://core.newebpay.com'
+        self.refund_url = f'{self.base_url}/API/CreditCard/Cancel'
+        self.query_url = f'{self.base_url}/API/QueryTradeInfo'
 
         _logger.debug('NewebPayAPIClient 初始化完成 - 測試模式: %s', test_mode)
 
@@ -89,58 +110,40 @@ class NewebPayAPIClient:
 
             _logger.debug('退款請求資料: MerchantID=%s, TradeNo=%s', self.merchant_id, trade_no)
 
-            # 準備 POST 資料
-            post_data = urllib.parse.urlencode(request_data).encode('utf-8')
-
-            # 發送退款請求
-            req = urllib.request.Request(
-                self.refund_url,
-                data=post_data,
-                headers={
-                    'Content-Type': 'application/x-www-form-urlencoded',
-                }
-            )
-
-            try:
-                with urllib.request.urlopen(req, timeout=30) as response:
-                    response_text = response.read().decode('utf-8')
-                    response_data = json.loads(response_text)
-
-                    _logger.info('退款回應: %s', response_data)
-
-                    # 驗證回應簽名
-                    if 'TradeInfo' in response_data and 'TradeSha' in response_data:
-                        is_valid = NewebPayCrypto.verify_trade_sha(
-                            response_data['TradeInfo'],
-                            response_data['TradeSha'],
-                            self.hash_key,
-                            self.hash_iv
-                        )
-
-                        if not is_valid:
-                            _logger.error('退款回應簽名驗證失敗')
-                            raise exceptions.ValidationError('退款回應簽名驗證失敗')
-
-                        # 解密回應資料
-                        trade_info_decrypted = NewebPayCrypto.decrypt_trade_info(
-                            response_data['TradeInfo'],
-                            self.hash_key,
-                            self.hash_iv
-                        )
-
-                        _logger.info('退款成功 - 回應資料: %s', trade_info_decrypted)
-                        return trade_info_decrypted
-                    else:
-                        _logger.error('退款回應格式錯誤: %s', response_data)
-                        raise exceptions.ValidationError('退款回應格式錯誤')
-
-            except urllib.error.HTTPError as e:
-                error_body = e.read().decode('utf-8') if e.fp else ''
-                _logger.error('退款 HTTP 錯誤: %s - %s', e.code, error_body)
-                raise exceptions.ValidationError(f'退款請求失敗: HTTP {e.code}')
-            except urllib.error.URLError as e:
-                _logger.error('退款 URL 錯誤: %s', str(e))
-                raise exceptions.ValidationError(f'退款請求失敗: {str(e)}')
+            with tracing.span('refund_http'):
+                response_data = self._post(self.refund_url, request_data)
+
+            tracing.capture('refund', response_data, '退款回應')
+
+            # 驗證回應簽名
+            if 'TradeInfo' in response_data and 'TradeSha' in response_data:
+                is_valid = NewebPayCrypto.verify_trade_sha(
+                    response_data['TradeInfo'],
+                    response_data['TradeSha'],
+                    self.hash_key,
+                    self.hash_iv
+                )
+
+                if not is_valid:
+                    _logger.error('退款回應簽名驗證失敗')
+                    raise exceptions.ValidationError('退款回應簽名驗證失敗')
+
+                # 解密回應資料
+                trade_info_decrypted = NewebPayCrypto.decrypt_trade_info(
+                    response_data['TradeInfo'],
+                    self.hash_key,
+                    self.hash_iv
+                )
+
+                _logger.info(
+                    '退款回應 - 交易序號: %s, 狀態: %s',
+                    trade_no, trade_info_decrypted.get('Status')
+                )
+                tracing.capture('refund', trade_info_decrypted, '退款回應資料')
+                return trade_info_decrypted
+            else:
+                _logger.error('退款回應格式錯誤: %s', tracing.redact(response_data))
+                raise exceptions.ValidationError('退款回應格式錯誤')
 
         except json.JSONDecodeError as e:
             _logger.error('解析退款回應 JSON 失敗: %s', str(e))
@@ -150,3 +153,79 @@ class NewebPayAPIClient:
             if isinstance(e, exceptions.ValidationError):
                 raise
             raise exceptions.ValidationError(f'退款處理發生錯誤: {str(e)}')
+
+    def query_trade_info(self, order_no, amount):
+        """
+        查詢交易狀態（QueryTradeInfo）
+
+        回應的 CheckCode 驗證失敗時拋出 ValidationError。
+
+        :param order_no: 商店訂單編號（MerchantOrderNo）
+        :param amount: 交易金額（元）
+        :return: 回應中的 Result 字典（含 TradeStatus、TradeNo、PaymentType 等）
+        """
+        amount = int(amount)
+        check_value = NewebPayCrypto.create_check_value({
+            'Amt': amount,
+            'MerchantID': self.merchant_id,
+            'MerchantOrderNo': order_no,
+        }, self.hash_key, self.hash_iv)
+        request_data = {
+            'MerchantID': self.merchant_id,
+            'Version': '1.3',
+            'RespondType': 'JSON',
+            'CheckValue': check_value,
+            'TimeStamp': str(int(time.time())),
+            'MerchantOrderNo': order_no,
+            'Amt': amount,
+        }
+
+        try:
+            with tracing.span('query_http'):
+                response_data = self._post(self.query_url, request_data)
+        except json.JSONDecodeError as e:
+            _logger.error('解析查詢交易回應 JSON 失敗: %s', str(e))
+            raise exceptions.ValidationError(f'解析查詢交易回應失敗: {str(e)}')
+
+        tracing.capture('query', response_data, '查詢交易回應')
+        if response_data.get('Status') != 'SUCCESS':
+            raise exceptions.ValidationError(
+                f"查詢交易失敗: {response_data.get('Status')} {response_data.get('Message', '')}"
+            )
+
+        result = response_data.get('Result') or {}
+        check_code = NewebPayCrypto.create_check_code({
+            'Amt': result.get('Amt', ''),
+            'MerchantID': result.get('MerchantID', ''),
+            'MerchantOrderNo': result.get('MerchantOrderNo', ''),
+            'TradeNo': result.get('TradeNo', ''),
+        }, self.hash_key, self.hash_iv)
+        if not hmac.compare_digest(check_code, str(result.get('CheckCode', '')).upper()):
+            _logger.error('查詢交易回應驗證碼不符 - 訂單編號: %s', order_no)
+            raise exceptions.ValidationError('查詢交易回應驗證碼不符')
+        return result
+
+    def _post(self, url, request_data):
+        """
+        透過共用連線池發送表單 POST 請求並解析 JSON 回應
+
+        :param url: API 端點
+        :param request_data: 表單參數字典
+        :return: 回應 JSON 字典
+        """
+        post_data = urllib.parse.urlencode(request_data).encode('utf-8')
+        try:
+            response_body = self.transport.post(
+                url,
+                post_data,
+                headers={'Content-Type': 'application/x-www-form-urlencoded'},
+                connect_timeout=self.connect_timeout,
+                read_timeout=self.read_timeout,
+            )
+        except HTTPResponseError as e:
+            _logger.error('API HTTP 錯誤: %s - %s', e.status, e.body.decode('utf-8', 'replace'))
+            raise exceptions.ValidationError(f'API 請求失敗: HTTP {e.status}')
+        except TransportError as e:
+            _logger.error('API 連線錯誤: %s', str(e))
+            raise exceptions.ValidationError(f'API 請求失敗: {str(e)}')
+        return json.loads(response_body.decode('utf-8'))
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+
+"""
+藍新金流批次退款引擎
+
+以有上限的執行緒池並行呼叫 `NewebPayAPIClient.refund`，並依商店代號以權杖桶限流。
+引擎本身不接觸 ORM：呼叫端先將交易資料整理為 `RefundRequest`，
+結果再以批次回呼交由呼叫端寫回資料庫。
+"""
+
+import logging
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from .rate_limit import TokenBucketRegistry
+
+_logger = logging.getLogger(__name__)
+
+RefundRequest = namedtuple('RefundRequest', ['tx_id', 'merchant_id', 'client', 'trade_no', 'amount', 'order_no'])
+RefundResult = namedtuple('RefundResult', ['tx_id', 'success', 'status', 'refund_trade_no', 'message', 'elapsed'])
+
+
+class BulkRefundEngine:
+    """ 並行退款引擎 """
+
+    def __init__(self, max_workers=8, rate_per_merchant=5, burst=None):
+        """
+        :param max_workers: 同時進行的退款請求上限
+        :param rate_per_merchant: 每個商店代號每秒最多送出的退款請求數
+        :param burst: 每個商店代號允許的突發請求數（預設等於 rate_per_merchant）
+        """
+        self.max_workers = max_workers
+        self.buckets = TokenBucketRegistry(rate_per_merchant, burst)
+
+    def _refund_one(self, request):
+        """ 執行單筆退款（於工作執行緒中執行） """
+        self.buckets.get(request.merchant_id).acquire()
+        start = time.perf_counter()
+        try:
+            response = request.client.refund(
+                trade_no=request.trade_no,
+                refund_amount=request.amount,
+                order_no=request.order_no,
+            ) or {}
+        except Exception as e:
+            return RefundResult(request.tx_id, False, 'ERROR', '', str(e), time.perf_counter() - start)
+        status = response.get('Status', '')
+        return RefundResult(
+            request.tx_id,
+            status == 'SUCCESS',
+            status,
+            response.get('TradeNo', ''),
+            response.get('Message', ''),
+            time.perf_counter() - start,
+        )
+
+    def run(self, requests, on_batch, batch_size=50):
+        """
+        執行批次退款
+
+        :param requests: RefundRequest 的可迭代物件
+        :param on_batch: 每累積 `batch_size` 筆結果時呼叫的回呼，參數為 RefundResult 列表
+        :param batch_size: 每批回呼的結果筆數
+        :return: 所有 RefundResult 列表
+        """
+        results = []
+        batch = []
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='newebpay_refund') as executor:
+            futures = [executor.submit(self._refund_one, request) for request in requests]
+            for future in as_completed(futures):
+                result = future.result()
+                results.append(result)
+                batch.append(result)
+                if len(batch) >= batch_size:
+                    on_batch(batch)
+                    batch = []
+        if batch:
+            on_batch(batch)
+        return results
+
+    @staticmethod
+    def summarize(results, skipped=0, max_errors=50):
+        """
+        產生批次退款摘要
+
+        :param results: RefundResult 列表
+        :param skipped: 未送出退款的交易筆數
+        :param max_errors: 摘要中最多列出的失敗明細數
+        :return: 摘要字典
+        """
+        failures = [r for r in results if not r.success]
+        elapsed = sorted(r.elapsed for r in results)
+        return {
+            'total': len(results) + skipped,
+            'submitted': len(results),
+            'succeeded': len(results) - len(failures),
+            'failed': len(failures),
+            'skipped': skipped,
+            'max_latency': elapsed[-1] if elapsed else 0.0,
+            'median_latency': elapsed[len(elapsed) // 2] if elapsed else 0.0,
+            'errors': [
+                {'tx_id': r.tx_id, 'status': r.status, 'message': r.message}
+                for r in failures[:max_errors]
+            ],
+        }
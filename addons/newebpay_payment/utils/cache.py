@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+
+"""
+藍新金流模組共用的行程內快取工具
+"""
+
+import threading
+from collections import OrderedDict
+
+
+class LRUCache:
+    """執行緒安全的固定容量 LRU 快取（容量為 0 時停用）"""
+
+    def __init__(self, maxsize):
+        """
+        :param maxsize: 最多保留的項目數
+        """
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        """ 取得快取值並將其標記為最近使用 """
+        with self._lock:
+            try:
+                self._data.move_to_end(key)
+            except KeyError:
+                return default
+            return self._data[key]
+
+    def set(self, key, value):
+        """ 寫入快取值，超過容量時淘汰最久未使用的項目 """
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        """ 移除並回傳快取值 """
+        with self._lock:
+            return self._data.pop(key, default)
+
+    def discard_if(self, predicate):
+        """ 移除所有 `predicate(key, value)` 為真的項目 """
+        with self._lock:
+            for key in [k for k, v in self._data.items() if predicate(k, v)]:
+                del self._data[key]
+
+    def clear(self):
+        """ 清空快取 """
+        with self._lock:
+            self._data.clear()
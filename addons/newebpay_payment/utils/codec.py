@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+
+"""
+TradeInfo 位元組層級編解碼
+
+回調解碼是付款流程中最耗 CPU 的路徑，這裡盡量減少中間物件與 Python 層級的逐字元迴圈：
+
+* 解碼：十六進位一次轉為位元組 → AES 解密 → 以 memoryview 切片移除 PKCS7 padding（不複製）
+  → 一次轉為字串 → 單次掃描解析 urlencoded 資料；含百分比編碼的值以 C 實作的
+  `codecs.escape_decode` 一次解碼，格式不符時才退回 `unquote`
+* 編碼：只含安全字元的值略過 URL 編碼 → 寫入預先配置（含 padding）的 bytearray → AES 加密
+
+輸出與原本的 `quote` / `unquote` + `Crypto.Util.Padding` 實作逐位元組相同，
+等價性由 `tests/test_codec.py` 驗證（隨機資料、padding 邊界與跳脫序列）。
+"""
+
+import codecs
+import re
+from urllib.parse import quote, unquote
+
+from Crypto.Util.Padding import unpad
+
+BLOCK_SIZE = 16
+
+# `quote(value, safe='')` 不會編碼的字元
+_SAFE_VALUE_RE = re.compile(r'[A-Za-z0-9_.~\-]*')
+
+
+def build_query(params):
+    """
+    將字典組合為 query string（值以 `quote(str(value), safe='')` 編碼，鍵不編碼）
+
+    :param params: 參數字典
+    :return: query string
+    """
+    fullmatch = _SAFE_VALUE_RE.fullmatch
+    parts = []
+    append = parts.append
+    for key, value in params.items():
+        if type(value) is not str:
+            value = str(value)
+        append(f'{key}={value if fullmatch(value) else quote(value, safe="")}')
+    return '&'.join(parts)
+
+
+def _unquote(value):
+    """
+    與 `unquote(value)` 結果相同的快速版本
+
+    將 `%XX` 轉為 `\\xXX` 後交由 `codecs.escape_decode` 一次解碼（原有的反斜線先跳脫）；
+    遇到不完整或非十六進位的百分比編碼時退回 `unquote`。
+    """
+    try:
+        data = value.encode('utf-8')
+        if b'\\' in data:
+            data = data.replace(b'\\', b'\\\\')
+        return codecs.escape_decode(data.replace(b'%', b'\\x'))[0].decode('utf-8', 'replace')
+    except ValueError:
+        return unquote(value)
+
+
+def parse_query(text):
+    """
+    單次掃描解析 query string（值以 `unquote` 解碼，鍵不解碼，沒有 `=` 的片段略過）
+
+    :param text: query string
+    :return: 參數字典
+    """
+    params = {}
+    for pair in text.split('&'):
+        key, sep, value = pair.partition('=')
+        if sep:
+            params[key] = _unquote(value) if '%' in value else value
+    return params
+
+
+def pad_into(data):
+    """
+    將資料寫入含 PKCS7 padding 的預先配置緩衝區
+
+    :param data: 明文位元組
+    :return: bytearray（長度為區塊大小的倍數）
+    """
+    length = len(data)
+    padding = BLOCK_SIZE - length % BLOCK_SIZE
+    buffer = bytearray(length + padding)
+    buffer[:length] = data
+    buffer[length:] = bytes((padding,)) * padding
+    return buffer
+
+
+def unpad_view(view):
+    """
+    原地檢查並移除 PKCS7 padding
+
+    :param view: 解密後資料的 memoryview
+    :return: 移除 padding 後的 memoryview 切片（不複製）
+    """
+    length = len(view)
+    padding = view[-1] if length else 0
+    if length % BLOCK_SIZE or not 0 < padding <= BLOCK_SIZE or view[-padding:] != bytes((padding,)) * padding:
+        # 格式錯誤時交由 `unpad` 拋出與原實作相同的例外
+        unpad(bytes(view), BLOCK_SIZE)
+    return view[:-padding]
+
+
+def encrypt(cipher, text):
+    """
+    加密 query string
+
+    :param cipher: 新建立的 AES-CBC 物件
+    :param text: query string
+    :return: 小寫十六進位密文
+    """
+    return cipher.encrypt(pad_into(text.encode('utf-8'))).hex()
+
+
+def decrypt(cipher, trade_info):
+    """
+    解密十六進位 TradeInfo
+
+    :param cipher: 新建立的 AES-CBC 物件
+    :param trade_info: 十六進位密文
+    :return: 明文字串
+    """
+    data = cipher.decrypt(bytes.fromhex(trade_info))
+    return str(unpad_view(memoryview(data)), 'utf-8')
@@ -7,18 +7,120 @@
 """
 
 import hashlib
+import hmac
 import json
 import logging
 from Crypto.Cipher import AES
-from Crypto.Util.Padding import pad, unpad
-from urllib.parse import quote, unquote
+
+from . import codec, tracing
+from .cache import LRUCache
 
 _logger = logging.getLogger(__name__)
 
+# 加密上下文快取上限（以商店代號 + 金鑰組合為單位）
+CONTEXT_CACHE_SIZE = 64
+
+
+class NewebPayCryptoContext:
+    """
+    單一商店金鑰組合的加密上下文
+
+    預先編碼 Hash Key / Hash IV，並保留已餵入簽名前綴的 SHA256 物件，
+    讓每次加密、解密、簽名只需要處理該筆資料本身。
+    """
+
+    __slots__ = ('merchant_id', 'hash_key', 'hash_iv', '_key_bytes', '_iv_bytes', '_sha_prefix', '_sha_suffix')
+
+    def __init__(self, hash_key, hash_iv, merchant_id=None):
+        self.merchant_id = merchant_id
+        self.hash_key = hash_key
+        self.hash_iv = hash_iv
+        self._key_bytes = hash_key.encode('utf-8')
+        self._iv_bytes = hash_iv.encode('utf-8')
+        # 簽名字串 = "HashKey=" + HashKey + "&" + TradeInfo + "&HashIV=" + HashIV
+        self._sha_prefix = hashlib.sha256(f"HashKey={hash_key}&".encode('utf-8'))
+        self._sha_suffix = f"&HashIV={hash_iv}".encode('utf-8')
+
+    def new_cipher(self):
+        """ 建立新的 AES-256-CBC 物件（CBC 模式有狀態，每筆資料需獨立物件） """
+        return AES.new(self._key_bytes, AES.MODE_CBC, self._iv_bytes)
+
+    def encrypt(self, trade_info_str):
+        """ 加密已組合好的 query string，回傳小寫十六進位字串 """
+        return codec.encrypt(self.new_cipher(), trade_info_str)
+
+    def decrypt(self, trade_info):
+        """ 解密十六進位 TradeInfo，回傳移除 padding 後的字串 """
+        return codec.decrypt(self.new_cipher(), trade_info)
+
+    def sign(self, trade_info):
+        """ 計算 TradeSha（大寫） """
+        sha = self._sha_prefix.copy()
+        sha.update(trade_info.encode('utf-8'))
+        sha.update(self._sha_suffix)
+        return sha.hexdigest().upper()
+
+    def verify(self, trade_info, trade_sha):
+        """ 以固定時間比較驗證 TradeSha（不區分大小寫） """
+        return hmac.compare_digest(self.sign(trade_info).encode('ascii'), str(trade_sha).upper().encode('utf-8'))
+
 
 class NewebPayCrypto:
     """藍新金流加密/解密和簽名驗證類別"""
 
+    _contexts = LRUCache(CONTEXT_CACHE_SIZE)
+
+    @classmethod
+    def get_context(cls, hash_key, hash_iv, merchant_id=None):
+        """
+        取得（或建立）指定金鑰組合的加密上下文
+
+        快取以 (merchant_id, hash_key, hash_iv) 為鍵，金鑰變更時自然會對應到新的上下文；
+        舊的上下文由 `invalidate_context` 或 LRU 淘汰移除。
+
+        :param hash_key: Hash Key
+        :param hash_iv: Hash IV
+        :param merchant_id: 商店代號（可選）
+        :return: NewebPayCryptoContext
+        """
+        cache_key = (merchant_id, hash_key, hash_iv)
+        context = cls._contexts.get(cache_key)
+        if context is None:
+            context = NewebPayCryptoContext(hash_key, hash_iv, merchant_id=merchant_id)
+            cls._contexts.set(cache_key, context)
+        return context
+
+    @classmethod
+    def invalidate_context(cls, merchant_id=None, hash_key=None, hash_iv=None):
+        """
+        移除快取中的加密上下文
+
+        未指定任何條件時清除全部；否則移除符合所有指定條件的上下文。
+        """
+        if merchant_id is None and hash_key is None and hash_iv is None:
+            cls._contexts.clear()
+            return
+
+        def _matches(cache_key, _context):
+            cached_merchant_id, cached_key, cached_iv = cache_key
+            return (
+                (merchant_id is None or cached_merchant_id == merchant_id)
+                and (hash_key is None or cached_key == hash_key)
+                and (hash_iv is None or cached_iv == hash_iv)
+            )
+
+        cls._contexts.discard_if(_matches)
+
+    @staticmethod
+    def _build_query_string(trade_info_dict):
+        """ 將字典轉換為 query string（對值進行 URL 編碼，key 不編碼） """
+        return codec.build_query(trade_info_dict)
+
+    @staticmethod
+    def _parse_query_string(trade_info_str):
+        """ 將解密後的 query string 解析為字典（對值進行 URL 解碼） """
+        return codec.parse_query(trade_info_str)
+
     @staticmethod
     def encrypt_trade_info(trade_info_dict, hash_key, hash_iv):
         """
@@ -33,33 +135,12 @@ class NewebPayCrypto:
             # 將字典轉換為 query string 格式（藍新金流要求格式）
             # 根據藍新金流文件，需要使用 http_build_query 的方式（自動 URL 編碼）
             # 類似 PHP 的 http_build_query，需要對值進行 URL 編碼
-            trade_info_parts = []
-            for key, value in trade_info_dict.items():
-                # 對值進行 URL 編碼，確保特殊字符被正確處理
-                # 但不需要對 key 進行編碼
-                encoded_value = quote(str(value), safe='')
-                trade_info_parts.append(f"{key}={encoded_value}")
-            trade_info_str = '&'.join(trade_info_parts)
-
-            _logger.info('原始交易資訊（加密前）: %s', trade_info_str)
-
-            # 使用 AES-256-CBC 加密
-            cipher = AES.new(
-                hash_key.encode('utf-8'),
-                AES.MODE_CBC,
-                hash_iv.encode('utf-8')
-            )
+            trade_info_str = NewebPayCrypto._build_query_string(trade_info_dict)
 
-            # 進行 PKCS7 padding
-            padded_data = pad(trade_info_str.encode('utf-8'), AES.block_size)
+            tracing.capture('encrypt', trade_info_dict, '原始交易資訊（加密前）')
 
-            # 加密
-            encrypted = cipher.encrypt(padded_data)
-
-            # 轉換為十六進位字串並轉小寫（藍新金流要求小寫）
-            trade_info = encrypted.hex()
-
-            _logger.info('加密後的 TradeInfo: %s', trade_info)
+            # 使用 AES-256-CBC 加密（PKCS7 padding），轉換為小寫十六進位字串（藍新金流要求小寫）
+            trade_info = NewebPayCrypto.get_context(hash_key, hash_iv).encrypt(trade_info_str)
             return trade_info
 
         except Exception as e:
@@ -77,35 +158,14 @@ class NewebPayCrypto:
         :return: 解密後的交易資訊字典
         """
         try:
-            # 將十六進位字串轉換為 bytes
-            encrypted = bytes.fromhex(trade_info)
-
-            # 使用 AES-256-CBC 解密
-            cipher = AES.new(
-                hash_key.encode('utf-8'),
-                AES.MODE_CBC,
-                hash_iv.encode('utf-8')
-            )
-
-            # 解密
-            decrypted = cipher.decrypt(encrypted)
-
-            # 移除 PKCS7 padding
-            unpadded = unpad(decrypted, AES.block_size)
-
-            # 轉換為字串
-            trade_info_str = unpadded.decode('utf-8')
+            # 使用 AES-256-CBC 解密並移除 PKCS7 padding
+            trade_info_str = NewebPayCrypto.get_context(hash_key, hash_iv).decrypt(trade_info)
 
             # 解析 query string 為字典
             # 注意：因為加密時使用了 URL 編碼（quote），解密後需要對值進行 URL 解碼（unquote）
-            trade_info_dict = {}
-            for pair in trade_info_str.split('&'):
-                if '=' in pair:
-                    key, value = pair.split('=', 1)
-                    # 對值進行 URL 解碼，還原原始值
-                    trade_info_dict[key] = unquote(value)
-
-            _logger.debug('解密後的交易資訊: %s', trade_info_dict)
+            trade_info_dict = NewebPayCrypto._parse_query_string(trade_info_str)
+
+            tracing.capture('decrypt', trade_info_dict, '解密後的交易資訊')
             return trade_info_dict
 
         except Exception as e:
@@ -127,17 +187,8 @@ class NewebPayCrypto:
         try:
             # 組合簽名字串（根據藍新金流 PHP 範例）
             # 注意：中間是直接接加密後的 TradeInfo，沒有 "TradeInfo=" 前綴
-            sign_string = f"HashKey={hash_key}&{trade_info}&HashIV={hash_iv}"
-
-            _logger.info('簽名字串: %s', sign_string)
-
-            # 計算 SHA256 雜湊值
-            sha256_hash = hashlib.sha256(sign_string.encode('utf-8')).hexdigest()
-
-            # 轉為大寫
-            trade_sha = sha256_hash.upper()
-
-            _logger.info('TradeSha 簽名: %s', trade_sha)
+            # 計算 SHA256 雜湊值並轉為大寫
+            trade_sha = NewebPayCrypto.get_context(hash_key, hash_iv).sign(trade_info)
             return trade_sha
 
         except Exception as e:
@@ -159,14 +210,101 @@ class NewebPayCrypto:
             # 計算預期的簽名
             expected_sha = NewebPayCrypto.create_trade_sha(trade_info, hash_key, hash_iv)
 
-            # 比較簽名（不區分大小寫）
-            is_valid = expected_sha.upper() == trade_sha.upper()
+            # 以固定時間比較簽名（不區分大小寫）
+            is_valid = hmac.compare_digest(expected_sha.upper().encode('ascii'), trade_sha.upper().encode('utf-8'))
 
             if not is_valid:
-                _logger.warning('簽名驗證失敗 - 預期: %s, 實際: %s', expected_sha, trade_sha)
+                _logger.warning('簽名驗證失敗 - 預期: %s…, 實際: %s…', expected_sha[:8], str(trade_sha)[:8])
 
             return is_valid
 
         except Exception as e:
             _logger.error('驗證 TradeSha 簽名時發生錯誤: %s', str(e))
-            return False
\ No newline at end of file
+            return False
+
+    @staticmethod
+    def create_check_value(params, hash_key, hash_iv):
+        """
+        建立查詢交易 API 的檢查碼（CheckValue）
+
+        檢查碼 = SHA256("IV=" + HashIV + "&" + 依參數名稱排序的 query string + "&Key=" + HashKey)
+
+        :param params: 參與檢查碼的參數（Amt、MerchantID、MerchantOrderNo）
+        :param hash_key: Hash Key
+        :param hash_iv: Hash IV
+        :return: 檢查碼（大寫）
+        """
+        query = '&'.join(f'{key}={params[key]}' for key in sorted(params))
+        return hashlib.sha256(f'IV={hash_iv}&{query}&Key={hash_key}'.encode('utf-8')).hexdigest().upper()
+
+    @staticmethod
+    def create_check_code(params, hash_key, hash_iv):
+        """
+        建立查詢交易 API 回應的驗證碼（CheckCode）
+
+        驗證碼 = SHA256("HashIV=" + HashIV + "&" + 依參數名稱排序的 query string + "&HashKey=" + HashKey)
+
+        :param params: 參與驗證碼的參數（Amt、MerchantID、MerchantOrderNo、TradeNo）
+        :param hash_key: Hash Key
+        :param hash_iv: Hash IV
+        :return: 驗證碼（大寫）
+        """
+        query = '&'.join(f'{key}={params[key]}' for key in sorted(params))
+        return hashlib.sha256(f'HashIV={hash_iv}&{query}&HashKey={hash_key}'.encode('utf-8')).hexdigest().upper()
+
+    @staticmethod
+    def encrypt_many(trade_info_dicts, hash_key, hash_iv):
+        """
+        批次加密交易資訊
+
+        共用同一個加密上下文，適用於對帳、批次產生付款連結等大量資料的情境。
+
+        :param trade_info_dicts: 交易資訊字典的可迭代物件
+        :param hash_key: Hash Key
+        :param hash_iv: Hash IV
+        :return: 加密後的 TradeInfo 字串列表（順序與輸入相同）
+        """
+        context = NewebPayCrypto.get_context(hash_key, hash_iv)
+        build = NewebPayCrypto._build_query_string
+        results = [context.encrypt(build(trade_info_dict)) for trade_info_dict in trade_info_dicts]
+        _logger.debug('批次加密完成 - 筆數: %s', len(results))
+        return results
+
+    @staticmethod
+    def decrypt_many(trade_infos, hash_key, hash_iv, raise_on_error=True):
+        """
+        批次解密交易資訊
+
+        :param trade_infos: 加密後 TradeInfo 字串的可迭代物件
+        :param hash_key: Hash Key
+        :param hash_iv: Hash IV
+        :param raise_on_error: 為 False 時，無法解密的項目回傳 None 而不中斷整批
+        :return: 解密後的交易資訊字典列表（順序與輸入相同）
+        """
+        context = NewebPayCrypto.get_context(hash_key, hash_iv)
+        parse = NewebPayCrypto._parse_query_string
+        results = []
+        for trade_info in trade_infos:
+            try:
+                results.append(parse(context.decrypt(trade_info)))
+            except Exception as e:
+                if raise_on_error:
+                    _logger.error('批次解密交易資訊失敗: %s', str(e))
+                    raise
+                _logger.warning('批次解密時略過無效資料: %s', str(e))
+                results.append(None)
+        _logger.debug('批次解密完成 - 筆數: %s', len(results))
+        return results
+
+    @staticmethod
+    def sign_many(trade_infos, hash_key, hash_iv):
+        """
+        批次建立交易簽名（TradeSha）
+
+        :param trade_infos: 加密後 TradeInfo 字串的可迭代物件
+        :param hash_key: Hash Key
+        :param hash_iv: Hash IV
+        :return: 簽名字串（大寫）列表（順序與輸入相同）
+        """
+        context = NewebPayCrypto.get_context(hash_key, hash_iv)
+        return [context.sign(trade_info) for trade_info in trade_infos]
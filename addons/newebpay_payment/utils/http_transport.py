@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+
+"""
+藍新金流 API 的 HTTP 連線池
+
+每個端點主機（ccore / core）維持一組持久的 HTTPS keep-alive 連線，
+由整個行程內的所有 API 客戶端共用，避免每次請求都重新進行 TLS 握手。
+"""
+
+import http.client
+import logging
+import queue
+import select
+import threading
+from urllib.parse import urlsplit
+
+_logger = logging.getLogger(__name__)
+
+# 每個主機最多保留的閒置連線數
+DEFAULT_POOL_SIZE = 8
+# 建立連線逾時（秒）
+DEFAULT_CONNECT_TIMEOUT = 5
+# 讀取回應逾時（秒）
+DEFAULT_READ_TIMEOUT = 30
+
+
+class TransportError(Exception):
+    """ 無法完成 HTTP 請求（連線失敗、逾時、連線中斷等） """
+
+
+class HTTPResponseError(TransportError):
+    """ 伺服器回應非 2xx 狀態碼 """
+
+    def __init__(self, status, body):
+        super().__init__(f'HTTP {status}')
+        self.status = status
+        self.body = body
+
+
+class _HostPool:
+    """ 單一主機的閒置連線池 """
+
+    def __init__(self, scheme, host, port, pool_size):
+        self.scheme = scheme
+        self.host = host
+        self.port = port
+        self._idle = queue.LifoQueue(maxsize=pool_size)
+
+    def acquire(self, connect_timeout):
+        """
+        取出一條閒置連線，沒有時建立新連線；回傳 (連線, 是否為重複使用)
+
+        已被伺服器關閉的閒置連線（可讀取代表收到 EOF 或非預期資料）直接捨棄。
+        """
+        while True:
+            try:
+                connection = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            if not _is_dropped(connection):
+                return connection, True
+            connection.close()
+        connection_class = http.client.HTTPSConnection if self.scheme == 'https' else http.client.HTTPConnection
+        return connection_class(self.host, self.port, timeout=connect_timeout), False
+
+    def release(self, connection):
+        """ 將連線放回池中，池已滿時直接關閉 """
+        try:
+            self._idle.put_nowait(connection)
+        except queue.Full:
+            connection.close()
+
+    def close(self):
+        """ 關閉所有閒置連線 """
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+def _is_dropped(connection):
+    """ 閒置連線是否已不可用（socket 已關閉或可讀取） """
+    if connection.sock is None:
+        return True
+    try:
+        readable, _writable, _errors = select.select([connection.sock], [], [], 0)
+    except (OSError, ValueError):
+        return True
+    return bool(readable)
+
+
+class PooledHTTPTransport:
+    """ 執行緒安全、以主機為單位的 keep-alive 連線池 """
+
+    def __init__(self, pool_size=DEFAULT_POOL_SIZE):
+        self.pool_size = pool_size
+        self._pools = {}
+        self._lock = threading.Lock()
+
+    def _get_pool(self, scheme, host, port):
+        key = (scheme, host, port)
+        pool = self._pools.get(key)
+        if pool is None:
+            with self._lock:
+                pool = self._pools.get(key)
+                if pool is None:
+                    pool = self._pools[key] = _HostPool(scheme, host, port, self.pool_size)
+        return pool
+
+    def post(self, url, body, headers=None,
+             connect_timeout=DEFAULT_CONNECT_TIMEOUT, read_timeout=DEFAULT_READ_TIMEOUT):
+        """
+        以 POST 發送請求
+
+        重複使用的連線若在送出請求時就失敗（閒置連線已被伺服器關閉），會以新連線重送一次；
+        請求送出後的任何錯誤（包括等待回應時連線中斷）都不重送，因為伺服器可能已經處理，
+        非冪等請求（如退款）由呼叫端先查詢結果再決定是否重試。
+
+        :param url: 完整 URL
+        :param body: 請求內容（bytes）
+        :param headers: 額外的 HTTP 標頭
+        :param connect_timeout: 建立連線逾時（秒）
+        :param read_timeout: 讀取回應逾時（秒）
+        :return: 回應內容（bytes）
+        :raise HTTPResponseError: 回應狀態碼非 2xx
+        :raise TransportError: 連線或讀取失敗
+        """
+        parts = urlsplit(url)
+        scheme = parts.scheme.lower()
+        port = parts.port or (443 if scheme == 'https' else 80)
+        pool = self._get_pool(scheme, parts.hostname, port)
+        path = parts.path or '/'
+        if parts.query:
+            path = f'{path}?{parts.query}'
+        request_headers = {'Connection': 'keep-alive'}
+        request_headers.update(headers or {})
+
+        for _attempt in range(2):
+            connection, reused = pool.acquire(connect_timeout)
+            try:
+                if connection.sock is None:
+                    connection.connect()
+                connection.sock.settimeout(read_timeout)
+                connection.request('POST', path, body=body, headers=request_headers)
+            except ConnectionError as e:
+                connection.close()
+                if reused:
+                    _logger.debug('閒置連線已被伺服器關閉，改用新連線重送 - 主機: %s', parts.hostname)
+                    continue
+                raise TransportError(str(e)) from e
+            except (OSError, http.client.HTTPException) as e:
+                connection.close()
+                raise TransportError(str(e)) from e
+            try:
+                response = connection.getresponse()
+                status = response.status
+                data = response.read()
+            except (OSError, http.client.HTTPException) as e:
+                connection.close()
+                raise TransportError(str(e)) from e
+
+            if response.will_close:
+                connection.close()
+            else:
+                pool.release(connection)
+
+            if not 200 <= status < 300:
+                raise HTTPResponseError(status, data)
+            return data
+
+        raise TransportError('無法建立連線')
+
+    def close(self):
+        """ 關閉所有主機的閒置連線 """
+        with self._lock:
+            for pool in self._pools.values():
+                pool.close()
+            self._pools.clear()
+
+
+_transport = None
+_transport_lock = threading.Lock()
+
+
+def get_transport(pool_size=DEFAULT_POOL_SIZE):
+    """
+    取得行程共用的連線池
+
+    首次呼叫時建立；之後 `pool_size` 與目前連線池不同時（例如系統參數
+    `newebpay_payment.http_pool_size` 已修改）改建新的連線池，並關閉舊連線池的閒置連線，
+    進行中的請求不受影響。
+    """
+    global _transport
+    transport = _transport
+    if transport is None or transport.pool_size != pool_size:
+        with _transport_lock:
+            transport = _transport
+            if transport is None or transport.pool_size != pool_size:
+                if transport is not None:
+                    transport.close()
+                transport = _transport = PooledHTTPTransport(pool_size=pool_size)
+    return transport
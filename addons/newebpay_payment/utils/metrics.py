@@ -0,0 +1,322 @@
+# -*- coding: utf-8 -*-
+
+"""
+藍新金流付款流程的行程內指標（Prometheus 文字格式）
+
+* 計數器（counter）、量表（gauge）、固定區間直方圖（histogram）
+* 每個執行緒各自累計（thread-local 分片），記錄時不需取得鎖；
+  匯出時才合併所有分片，已結束執行緒的分片併入行程總計後釋放。
+* prefork 模式下每個 worker 定期將自己的快照寫入共用目錄
+  （`<data_dir>/newebpay_metrics/<pid>.json`），匯出時合併所有 worker 的檔案。
+
+`tracing.span` 的每個階段（notify / return / verify / decrypt / lookup / process /
+refund_http / query_http）都會自動記錄到 `newebpay_stage_duration_seconds`。
+"""
+
+import bisect
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from . import tracing
+
+_logger = logging.getLogger(__name__)
+
+# 直方圖預設區間上限（秒）
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# worker 寫出快照的最短間隔（秒）
+DEFAULT_FLUSH_INTERVAL = 5.0
+# 已結束 worker 的快照檔保留時間（秒）
+DEFAULT_STALE_SECONDS = 3600
+
+
+class _Metric:
+    """ 指標基底類別 """
+
+    kind = None
+
+    def __init__(self, registry, name, documentation, labelnames=()):
+        self.registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def _new_value(self):
+        return [0.0]
+
+    def _cell(self, labelvalues):
+        """ 取得目前執行緒分片中的值（不需取得鎖） """
+        values = self.registry._shard().setdefault(self.name, {})
+        cell = values.get(labelvalues)
+        if cell is None:
+            cell = values[labelvalues] = self._new_value()
+        return cell
+
+
+class Counter(_Metric):
+    """ 只增不減的計數器 """
+
+    kind = 'counter'
+
+    def inc(self, *labelvalues, amount=1):
+        self._cell(labelvalues)[0] += amount
+
+
+class Gauge(_Metric):
+    """ 可增減的量表（各執行緒、各 worker 的值相加） """
+
+    kind = 'gauge'
+
+    def inc(self, *labelvalues, amount=1):
+        self._cell(labelvalues)[0] += amount
+
+    def dec(self, *labelvalues, amount=1):
+        self._cell(labelvalues)[0] -= amount
+
+
+class Histogram(_Metric):
+    """ 固定區間直方圖 """
+
+    kind = 'histogram'
+
+    def __init__(self, registry, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(registry, name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_value(self):
+        # 各區間計數（最後一格為 +Inf）、總和
+        return [0] * (len(self.buckets) + 1) + [0.0]
+
+    def observe(self, value, *labelvalues):
+        cell = self._cell(labelvalues)
+        cell[bisect.bisect_left(self.buckets, value)] += 1
+        cell[-1] += value
+
+
+def _merge_into(target, source):
+    """ 合併兩組 {指標名稱: {標籤值: 數值列表}} """
+    for name, values in source.items():
+        merged = target.setdefault(name, {})
+        for labelvalues, cell in values.items():
+            current = merged.get(labelvalues)
+            if current is None:
+                merged[labelvalues] = list(cell)
+            else:
+                for index, value in enumerate(cell):
+                    current[index] += value
+
+
+class MetricsRegistry:
+    """ 指標登錄表 """
+
+    def __init__(self, directory=None, flush_interval=DEFAULT_FLUSH_INTERVAL):
+        """
+        :param directory: worker 快照檔目錄（未指定時使用 Odoo data_dir 或系統暫存目錄）
+        :param flush_interval: worker 寫出快照的最短間隔（秒）
+        """
+        self._metrics = {}
+        self._local = threading.local()
+        self._shards = []
+        self._retired = {}
+        self._lock = threading.Lock()
+        self._directory = directory
+        self.flush_interval = flush_interval
+        self._next_flush = 0.0
+
+    # ---- 指標定義 ----
+
+    def _register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(self, name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge(self, name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(self, name, documentation, labelnames, buckets))
+
+    # ---- 行程內彙總 ----
+
+    def _shard(self):
+        data = getattr(self._local, 'data', None)
+        if data is None:
+            data = self._local.data = {}
+            with self._lock:
+                self._shards.append((threading.current_thread(), data))
+        return data
+
+    def snapshot(self):
+        """
+        合併所有執行緒分片
+
+        :return: {指標名稱: {標籤值: 數值列表}}
+        """
+        with self._lock:
+            alive = []
+            for thread, data in self._shards:
+                if thread.is_alive():
+                    alive.append((thread, data))
+                else:
+                    _merge_into(self._retired, data)
+            self._shards = alive
+            merged = {}
+            _merge_into(merged, self._retired)
+        for _thread, data in alive:
+            # 其他執行緒可能同時新增標籤值，先複製再合併
+            _merge_into(merged, {name: dict(values) for name, values in list(data.items())})
+        return merged
+
+    # ---- 跨 worker 彙總 ----
+
+    @property
+    def directory(self):
+        if self._directory is None:
+            try:
+                from odoo.tools import config
+                base = config['data_dir']
+            except Exception:
+                base = tempfile.gettempdir()
+            self._directory = os.path.join(base, 'newebpay_metrics')
+        return self._directory
+
+    def maybe_flush(self):
+        """ 距離上次寫出超過間隔時寫出快照 """
+        if time.monotonic() >= self._next_flush:
+            self.flush()
+
+    def flush(self):
+        """ 將本行程的快照寫入共用目錄（以暫存檔 + rename 確保讀取端不會讀到半份資料） """
+        self._next_flush = time.monotonic() + self.flush_interval
+        data = {
+            name: [[list(labelvalues), cell] for labelvalues, cell in values.items()]
+            for name, values in self.snapshot().items()
+        }
+        directory = self.directory
+        try:
+            os.makedirs(directory, exist_ok=True)
+            path = os.path.join(directory, f'{os.getpid()}.json')
+            fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+            with os.fdopen(fd, 'w') as tmp_file:
+                json.dump(data, tmp_file)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            _logger.warning('寫出藍新金流指標快照失敗: %s', e)
+
+    def collect(self, stale_seconds=DEFAULT_STALE_SECONDS):
+        """
+        合併所有 worker 的快照（含本行程最新資料）
+
+        :param stale_seconds: 已結束 worker 的快照檔保留時間
+        :return: {指標名稱: {標籤值: 數值列表}}
+        """
+        self.flush()
+        merged = {}
+        now = time.time()
+        try:
+            filenames = os.listdir(self.directory)
+        except OSError:
+            filenames = []
+        for filename in filenames:
+            if not filename.endswith('.json'):
+                continue
+            path = os.path.join(self.directory, filename)
+            try:
+                if now - os.path.getmtime(path) > stale_seconds and not _pid_alive(int(filename[:-5])):
+                    os.unlink(path)
+                    continue
+                with open(path) as snapshot_file:
+                    data = json.load(snapshot_file)
+            except (OSError, ValueError):
+                continue
+            _merge_into(merged, {
+                name: {tuple(labelvalues): cell for labelvalues, cell in samples}
+                for name, samples in data.items()
+            })
+        return merged
+
+    def render(self, data=None):
+        """
+        輸出 Prometheus 文字格式
+
+        :param data: `collect()` 或 `snapshot()` 的結果（預設合併所有 worker）
+        """
+        if data is None:
+            data = self.collect()
+        lines = []
+        for name, metric in sorted(self._metrics.items()):
+            lines.append(f'# HELP {name} {metric.documentation}')
+            lines.append(f'# TYPE {name} {metric.kind}')
+            for labelvalues, cell in sorted(data.get(name, {}).items()):
+                labels = _format_labels(metric.labelnames, labelvalues)
+                if metric.kind != 'histogram':
+                    lines.append(f'{name}{_wrap(labels)} {_format_value(cell[0])}')
+                    continue
+                cumulative = 0
+                for bound, count in zip((*metric.buckets, float('inf')), cell[:-1]):
+                    cumulative += count
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    bucket_labels = labels + ['le="%s"' % le]
+                    lines.append(f'{name}_bucket{_wrap(bucket_labels)} {cumulative}')
+                lines.append(f'{name}_sum{_wrap(labels)} {_format_value(cell[-1])}')
+                lines.append(f'{name}_count{_wrap(labels)} {cumulative}')
+        return '\n'.join(lines) + '\n'
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True
+    return True
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(labelnames, labelvalues):
+    return [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, labelvalues)]
+
+
+def _wrap(labels):
+    return '{' + ','.join(labels) + '}' if labels else ''
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+registry = MetricsRegistry()
+
+STAGE_DURATION = registry.histogram(
+    'newebpay_stage_duration_seconds', '藍新金流各處理階段耗時（秒）', ('stage',))
+STAGE_ERRORS = registry.counter(
+    'newebpay_stage_errors_total', '藍新金流各處理階段發生例外的次數', ('stage',))
+CALLBACKS = registry.counter(
+    'newebpay_callbacks_total', '藍新金流回調請求數（依路由與結果）', ('route', 'result'))
+IN_FLIGHT = registry.gauge(
+    'newebpay_requests_in_flight', '處理中的藍新金流回調請求數', ('route',))
+ADMISSION_REJECTED = registry.counter(
+    'newebpay_admission_rejected_total', '未通過前置准入檢查的回調請求數（依路由與原因）', ('route', 'reason'))
+
+
+def _observe_stage(stage, elapsed, error):
+    STAGE_DURATION.observe(elapsed, stage)
+    if error:
+        STAGE_ERRORS.inc(stage)
+    registry.maybe_flush()
+
+
+tracing.add_listener(_observe_stage)
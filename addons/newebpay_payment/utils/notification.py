@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+
+"""
+藍新金流回調通知解碼
+
+每個回調請求只解碼一次：一次 SHA256 簽名驗證、一次 AES 解密，
+結果在交易查詢、驗證與處理之間共用。准入檢查已驗證簽名的通知（`admitted`）不再重複驗證。
+"""
+
+import logging
+
+from . import tracing
+from .crypto import NewebPayCrypto
+
+_logger = logging.getLogger(__name__)
+
+
+class NewebPayNotification(dict):
+    """
+    已解碼的藍新金流回調通知
+
+    本身即為原始 POST 資料字典（可直接傳給需要 notification_data 的方法），
+    另外附帶解碼結果：
+
+    * ``provider``：用於解碼的 payment.provider 記錄
+    * ``verified``：TradeSha 簽名是否驗證成功
+    * ``verified_key``：驗證 TradeSha 成功的 (HashKey, HashIV)
+    * ``trade_info``：解密後的交易資訊字典（解密失敗時為 None）
+    * ``error``：解碼過程中的錯誤訊息（無錯誤時為 None）
+    * ``timings``：各階段耗時（秒）
+    """
+
+    def __init__(self, notification_data, provider=None):
+        super().__init__(notification_data or {})
+        self.provider = provider
+        self.verified = False
+        self.verified_key = None
+        self.trade_info = None
+        self.error = None
+        self.timings = {}
+
+    @classmethod
+    def admitted(cls, notification_data, verified_key):
+        """
+        建立已在准入檢查中驗證簽名（尚未解密）的通知
+
+        :param notification_data: 回調的 POST 資料
+        :param verified_key: 驗證成功的 (HashKey, HashIV)
+        :return: NewebPayNotification
+        """
+        notification = cls(notification_data)
+        notification.verified = True
+        notification.verified_key = verified_key
+        return notification
+
+    def is_verified_with(self, hash_key, hash_iv):
+        """ 簽名是否已以指定的金鑰組合驗證成功 """
+        return self.verified and self.verified_key == (hash_key, hash_iv)
+
+    @classmethod
+    def decode(cls, notification_data, provider):
+        """
+        驗證並解密回調資料
+
+        :param notification_data: 回調的 POST 資料
+        :param provider: payment.provider 記錄（可為空記錄集）
+        :return: NewebPayNotification
+        """
+        notification = cls(notification_data, provider=provider)
+        trade_info_encrypted = notification.get('TradeInfo')
+        trade_sha = notification.get('TradeSha')
+
+        if not trade_info_encrypted:
+            notification.error = '回調資料中缺少 TradeInfo'
+            return notification
+        if not provider:
+            notification.error = '找不到藍新金流提供者'
+            return notification
+        if not provider.newebpay_hash_key or not provider.newebpay_hash_iv:
+            notification.error = '藍新金流設定不完整'
+            return notification
+
+        hash_key = provider.newebpay_hash_key
+        hash_iv = provider.newebpay_hash_iv
+
+        if isinstance(notification_data, NewebPayNotification) and notification_data.is_verified_with(hash_key, hash_iv):
+            # 准入檢查已以相同金鑰驗證
+            notification.verified = True
+        else:
+            with tracing.span('verify', notification.timings):
+                if trade_sha:
+                    notification.verified = NewebPayCrypto.verify_trade_sha(
+                        trade_info_encrypted, trade_sha, hash_key, hash_iv
+                    )
+                else:
+                    notification.error = '回調資料中缺少 TradeSha'
+        if notification.verified:
+            notification.verified_key = (hash_key, hash_iv)
+
+        with tracing.span('decrypt', notification.timings):
+            try:
+                notification.trade_info = NewebPayCrypto.decrypt_trade_info(
+                    trade_info_encrypted, hash_key, hash_iv
+                )
+            except Exception as e:
+                notification.error = f'解密回調資料失敗: {e}'
+
+        return notification
+
+    def is_decoded_with(self, provider):
+        """ 是否已使用指定的提供者解碼 """
+        return bool(self.provider) and self.provider == provider
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+
+"""
+權杖桶（token bucket）限流工具
+"""
+
+import threading
+import time
+
+from .cache import LRUCache
+
+
+class TokenBucket:
+    """
+    執行緒安全的權杖桶
+
+    以每秒 `rate` 個權杖的速度補充，最多累積 `capacity` 個。
+    """
+
+    def __init__(self, rate, capacity=None):
+        """
+        :param rate: 每秒補充的權杖數
+        :param capacity: 權杖上限（突發量，預設等於 rate）
+        """
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(rate, 1))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        elapsed = now - self._updated
+        if elapsed > 0:
+            self._tokens = min(self.capacity, self._tokens + elapsed * self.rate)
+            self._updated = now
+
+    def try_acquire(self, tokens=1):
+        """ 嘗試取得權杖，不足時立即回傳 False """
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return True
+            return False
+
+    def has_tokens(self, tokens=1):
+        """ 檢查目前是否有足夠的權杖（不取用） """
+        with self._lock:
+            self._refill(time.monotonic())
+            return self._tokens >= tokens
+
+    def acquire(self, tokens=1):
+        """ 取得權杖，不足時阻塞等待 """
+        while True:
+            with self._lock:
+                self._refill(time.monotonic())
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                wait = (tokens - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class TokenBucketRegistry:
+    """ 依鍵值（例如商店代號、來源 IP）分別限流的權杖桶集合 """
+
+    def __init__(self, rate, capacity=None, maxsize=10000):
+        """
+        :param rate: 每個鍵每秒補充的權杖數
+        :param capacity: 每個鍵的權杖上限
+        :param maxsize: 最多追蹤的鍵數量（超過時淘汰最久未使用的鍵）
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self._buckets = LRUCache(maxsize)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """ 取得（或建立）指定鍵的權杖桶 """
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            with self._lock:
+                bucket = self._buckets.get(key)
+                if bucket is None:
+                    bucket = TokenBucket(self.rate, self.capacity)
+                    self._buckets.set(key, bucket)
+        return bucket
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+
+"""
+藍新金流對帳（撥款）檔串流解析
+
+藍新金流後台匯出的對帳檔可能有數十萬行，這裡以逐行讀取的方式解析，
+任何時間點只保留一個區塊（chunk）的資料，記憶體用量與檔案大小無關。
+"""
+
+import codecs
+import csv
+import io
+from collections import namedtuple
+
+SettlementRow = namedtuple('SettlementRow', ['line_no', 'trade_no', 'merchant_order_no', 'amount', 'status'])
+
+# 欄位名稱別名（中文後台匯出、API 欄位名稱）
+COLUMN_ALIASES = {
+    'trade_no': ('TradeNo', '藍新金流交易序號', '藍新交易序號', '交易序號'),
+    'merchant_order_no': ('MerchantOrderNo', '商店訂單編號', '訂單編號'),
+    'amount': ('Amt', '交易金額', '金額'),
+    'status': ('TradeStatus', 'Status', '交易狀態', '狀態'),
+}
+
+# 檔案編碼依序嘗試（後台匯出多為 UTF-8 with BOM 或 Big5）
+DEFAULT_ENCODINGS = ('utf-8-sig', 'cp950')
+
+
+class SettlementFormatError(ValueError):
+    """ 對帳檔格式錯誤 """
+
+
+def detect_encoding(fileobj, encodings=DEFAULT_ENCODINGS, sample_size=65536):
+    """
+    以檔案開頭的樣本判斷編碼，讀取後將檔案指標移回開頭
+
+    :param fileobj: 二進位檔案物件（需支援 seek）
+    :return: 編碼名稱
+    """
+    sample = fileobj.read(sample_size)
+    fileobj.seek(0)
+    for encoding in encodings:
+        decoder = codecs.getincrementaldecoder(encoding)()
+        try:
+            decoder.decode(sample, final=False)
+        except UnicodeDecodeError:
+            continue
+        return encoding
+    raise SettlementFormatError(f'無法判斷對帳檔編碼（已嘗試: {", ".join(encodings)}）')
+
+
+def _resolve_columns(header):
+    """ 將表頭對應到 SettlementRow 欄位，回傳 {欄位: 索引} """
+    normalized = [column.strip() for column in header]
+    columns = {}
+    for field, aliases in COLUMN_ALIASES.items():
+        for alias in aliases:
+            if alias in normalized:
+                columns[field] = normalized.index(alias)
+                break
+    if 'trade_no' not in columns and 'merchant_order_no' not in columns:
+        raise SettlementFormatError('對帳檔缺少交易序號或商店訂單編號欄位')
+    return columns
+
+
+def _parse_amount(value):
+    value = (value or '').replace(',', '').strip()
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+def iter_rows(fileobj, encoding=None, delimiter=','):
+    """
+    逐行解析對帳檔
+
+    :param fileobj: 二進位檔案物件
+    :param encoding: 檔案編碼（未指定時自動判斷）
+    :param delimiter: 欄位分隔字元
+    :return: SettlementRow 產生器（line_no 為檔案中的行號，表頭為第 1 行）
+    """
+    if encoding is None:
+        encoding = detect_encoding(fileobj)
+    text = io.TextIOWrapper(fileobj, encoding=encoding, newline='')
+    try:
+        reader = csv.reader(text, delimiter=delimiter)
+        header = next(reader, None)
+        if not header:
+            return
+        columns = _resolve_columns(header)
+
+        def cell(values, field):
+            index = columns.get(field)
+            return values[index].strip() if index is not None and index < len(values) else ''
+
+        for values in reader:
+            if not any(values):
+                continue
+            yield SettlementRow(
+                reader.line_num,
+                cell(values, 'trade_no'),
+                cell(values, 'merchant_order_no'),
+                _parse_amount(cell(values, 'amount')),
+                cell(values, 'status'),
+            )
+    finally:
+        # 不關閉呼叫端的檔案
+        text.detach()
+
+
+def chunked(iterable, size):
+    """ 將可迭代物件切成每塊最多 `size` 筆的列表 """
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+
+"""
+藍新金流付款流程的追蹤與日誌遮罩工具
+
+* `span(stage)`：量測各階段（lookup / verify / decrypt / process / refund_http 等）耗時，
+  結果可寫入呼叫端提供的 timings 字典，並在 DEBUG 等級時輸出。
+* `capture(stage, payload)`：依取樣率以 DEBUG 等級記錄遮罩後的資料內容。
+* `redact(value)`：遮罩金鑰、加密資料與個人資料。
+
+追蹤日誌使用獨立的 logger（`odoo.addons.newebpay_payment.trace`），
+可透過 `--log-handler=odoo.addons.newebpay_payment.trace:DEBUG` 單獨開啟；
+未開啟時不會進行任何字串格式化或遮罩運算。
+"""
+
+import logging
+import random
+import time
+
+_logger = logging.getLogger('odoo.addons.newebpay_payment.trace')
+
+# 資料內容的取樣記錄比例（0 ~ 1）
+DEFAULT_SAMPLE_RATE = 0.01
+
+# 完全遮罩的欄位
+SECRET_KEYS = frozenset({'HashKey', 'HashIV', 'hash_key', 'hash_iv'})
+# 只保留前幾碼與長度的欄位（加密資料、簽名）
+DIGEST_KEYS = frozenset({'TradeInfo', 'TradeSha', 'CheckCode'})
+# 個人資料欄位
+PERSONAL_KEYS = frozenset({'Email', 'PayerAccount5Code', 'Card6No', 'Card4No', 'CodeNo', 'BankCode', 'Barcode_1', 'Barcode_2', 'Barcode_3'})
+
+_sample_rate = DEFAULT_SAMPLE_RATE
+_listeners = []
+
+
+def set_sample_rate(rate):
+    """ 設定資料內容的取樣記錄比例 """
+    global _sample_rate
+    _sample_rate = max(0.0, min(float(rate), 1.0))
+
+
+def add_listener(listener):
+    """
+    註冊階段耗時監聽器
+
+    :param listener: 可呼叫物件，參數為 (stage, elapsed_seconds, error)
+    """
+    if listener not in _listeners:
+        _listeners.append(listener)
+
+
+def _mask_digest(value):
+    value = str(value)
+    return f'{value[:8]}…({len(value)})' if len(value) > 8 else '***'
+
+
+def _mask_personal(value):
+    value = str(value)
+    if '@' in value:
+        local, _sep, domain = value.partition('@')
+        return f'{local[:1]}***@{domain}'
+    return f'***{value[-2:]}' if len(value) > 4 else '***'
+
+
+def redact(value):
+    """
+    遮罩資料中的敏感欄位
+
+    :param value: 字典（或其他值，原樣回傳）
+    :return: 遮罩後的新字典
+    """
+    if not isinstance(value, dict):
+        return value
+    redacted = {}
+    for key, item in value.items():
+        if key in SECRET_KEYS:
+            redacted[key] = '***'
+        elif key in DIGEST_KEYS and item:
+            redacted[key] = _mask_digest(item)
+        elif key in PERSONAL_KEYS and item:
+            redacted[key] = _mask_personal(item)
+        elif isinstance(item, dict):
+            redacted[key] = redact(item)
+        else:
+            redacted[key] = item
+    return redacted
+
+
+def capture(stage, payload, message=''):
+    """
+    依取樣率記錄遮罩後的資料內容（僅在 DEBUG 等級開啟時）
+
+    :param stage: 階段名稱
+    :param payload: 資料內容（字典）
+    :param message: 附加說明
+    """
+    if not _logger.isEnabledFor(logging.DEBUG):
+        return
+    if _sample_rate < 1.0 and random.random() >= _sample_rate:
+        return
+    _logger.debug('[%s] %s %s', stage, message, redact(dict(payload or {})))
+
+
+class span:
+    """
+    量測階段耗時的 context manager
+
+    用法::
+
+        with tracing.span('decrypt', notification.timings):
+            ...
+    """
+
+    __slots__ = ('stage', 'timings', 'start')
+
+    def __init__(self, stage, timings=None):
+        """
+        :param stage: 階段名稱
+        :param timings: 寫入耗時（秒）的字典（可選）
+        """
+        self.stage = stage
+        self.timings = timings
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self.start
+        if self.timings is not None:
+            self.timings[self.stage] = elapsed
+        for listener in _listeners:
+            listener(self.stage, elapsed, exc_type is not None)
+        if _logger.isEnabledFor(logging.DEBUG):
+            _logger.debug('[%s] %.3f ms%s', self.stage, elapsed * 1000, ' (error)' if exc_type else '')
+        return False